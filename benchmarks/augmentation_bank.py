@@ -0,0 +1,66 @@
+import argparse
+import subprocess
+import tempfile
+import json
+import time
+import sys
+
+from benchmarks.common import train_curve, time_to_accuracy, print_table
+from build_augmentation_bank import build_augmentation_bank
+from dataloaders.AugmentationBankLoader import AugmentationBankLoader
+from utils.augmentation_bank import AugmentationBank
+
+from config import Config
+
+
+# Time-to-accuracy of training from the precomputed augmentation bank (AugmentationBankLoader)
+# with K = 4, 8 and 16 variants per image against online augmentation in patch_augment
+# (DatasetFileLoader), with the configured color jitter and rotation. The bank build time is
+# reported separately (offline, once). Each setting trains from scratch in its own process,
+# the target accuracy defaults to 95% of the best online accuracy. Requires the dataset:
+#   python -m benchmarks.augmentation_bank --n_epochs 30
+
+def worker(args):
+    build_seconds, bank_gb, loader_class = 0, 0, None
+    if (args.variants > 0):
+        Config.augmentation_bank_dir = tempfile.mkdtemp()
+        start = time.perf_counter()
+        build_augmentation_bank(Config, Config.augmentation_bank_dir, args.variants, args.threads)
+        build_seconds = time.perf_counter() - start
+        bank_gb = AugmentationBank(Config.augmentation_bank_dir).nbytes / 2**30
+        loader_class = AugmentationBankLoader
+    curve = train_curve(Config, args.n_epochs, loader_class = loader_class, threads = args.threads)
+    print(json.dumps({'build_s': build_seconds, 'bank_gb': bank_gb, 'curve': curve}))
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Augmentation bank against online augmentation')
+    argparser.add_argument('--n_epochs', type=int, default=30)
+    argparser.add_argument('--variants_list', type=int, nargs='+', default=[4, 8, 16])
+    argparser.add_argument('--target', type=float, default=None, help='validation accuracy to reach')
+    argparser.add_argument('--threads', type=int, default=0)
+    argparser.add_argument('--variants', type=int, default=None, help=argparse.SUPPRESS)
+    args = argparser.parse_args()
+
+    if (args.variants is not None):
+        worker(args)
+        sys.exit(0)
+
+    results = {}
+    # 0 variants is online augmentation
+    for variants in [0] + args.variants_list:
+        cmd = [sys.executable, '-m', 'benchmarks.augmentation_bank', '--variants', str(variants),
+               '--n_epochs', str(args.n_epochs), '--threads', str(args.threads)]
+        results[variants] = json.loads(subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout.decode()
+                                       .strip().splitlines()[-1])
+
+    target = args.target or 0.95 * max(accuracy for _, accuracy in results[0]['curve'])
+    rows = []
+    for variants, r in results.items():
+        seconds, accuracies = zip(*r['curve'])
+        reached = time_to_accuracy(r['curve'], target)
+        rows.append(['online' if variants == 0 else 'bank K={}'.format(variants), r['build_s'], r['bank_gb'],
+                     seconds[-1] / len(seconds), max(accuracies), reached if reached is not None else 'not reached'])
+
+    print("Target validation accuracy: {:.3f}".format(target))
+    print_table(['augmentation', 'build (s)', 'bank GB', 's / epoch', 'best val acc', 'time to target (s)'], rows)
@@ -0,0 +1,96 @@
+import time
+import tempfile
+import resource
+
+import numpy as np
+import tensorflow as tf
+
+
+# Helpers shared by the benchmark scripts, run them from the root directory, e.g.
+#   python -m benchmarks.inference_latency
+
+BACKBONES = ['ResNet18', 'ResNet50', 'ResNeXt']
+
+
+def cpu_session_config(threads = 0):
+    return tf.ConfigProto(device_count = {'GPU': 0},
+                          intra_op_parallelism_threads = threads,
+                          inter_op_parallelism_threads = threads)
+
+
+def random_bags(n_bags, n_patches, size = 227, channels = 3, seed = 1, dtype = np.float32):
+    rng = np.random.RandomState(seed)
+    images = rng.randint(0, 256, size = (n_bags * n_patches, size, size, channels)).astype(dtype)
+    bag_index = np.repeat(np.arange(n_bags, dtype = np.int64), n_patches)
+    return images, bag_index
+
+
+def time_runs(fn, n_warmup = 3, n_runs = 20):
+    """
+    Time a callable, returns mean and standard deviation in milliseconds
+    """
+    for _ in range(n_warmup):
+        fn()
+    times = []
+    for _ in range(n_runs):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return np.mean(times), np.std(times)
+
+
+def train_curve(config, n_epochs, loader_class = None, threads = 0):
+    """
+    Train config's model from scratch (no checkpoint saved), one validation epoch after each
+    training epoch
+    :param loader_class: DatasetFileLoader by default
+    :return: list of (training seconds so far, validation accuracy), one per epoch
+    """
+    # imported here, most benchmarks do not train
+    from dataloaders.DatasetFileLoader import DatasetFileLoader
+    from trainers.MTrainer import MTrainer
+    from utils.logger import DefinedSummarizer
+    from run import create_model
+
+    config.checkpoint_dir = tempfile.mkdtemp()
+    config.summary_dir = tempfile.mkdtemp()
+    config.save_models = False
+    data_loader = (loader_class or DatasetFileLoader)(config)
+    curve = []
+    with tf.Session(config=cpu_session_config(threads)) as sess:
+        model = create_model(data_loader, config)
+        logger = DefinedSummarizer(sess, summary_dir=config.summary_dir,
+                                   scalar_tags=['train/loss_per_epoch', 'train/acc_per_epoch', 'test/loss_per_epoch',
+                                                'test/acc_per_epoch', 'learning_rate', 'si_weight', 'mi_weight'])
+        trainer = MTrainer(sess, model, config, logger, data_loader)
+        seconds = 0
+        for epoch in range(1, n_epochs + 1):
+            trainer.train_epoch(epoch)
+            seconds += trainer.epoch_time
+            _, accuracy = trainer.test(epoch)
+            curve.append((seconds, float(accuracy)))
+    return curve
+
+
+def time_to_accuracy(curve, target):
+    # training seconds until the validation accuracy first reaches target, None if never
+    return next((seconds for seconds, accuracy in curve if accuracy >= target), None)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def print_table(headers, rows):
+    widths = [max(len(str(h)), *(len(_fmt(r[i])) for r in rows)) for i, h in enumerate(headers)]
+    print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for r in rows:
+        print("  ".join(_fmt(v).ljust(w) for v, w in zip(r, widths)))
+
+
+def _fmt(v):
+    if isinstance(v, float):
+        return "{:.2f}".format(v)
+    return str(v)
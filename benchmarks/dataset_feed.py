@@ -0,0 +1,88 @@
+import argparse
+import subprocess
+import tempfile
+import json
+import time
+import sys
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from benchmarks.common import cpu_session_config, peak_rss_mb, print_table
+from dataloaders.DatasetLoader import DatasetLoader
+from run import create_model
+
+from config import Config
+
+
+# Startup time, peak RSS and .meta checkpoint size of the in-memory DatasetLoader with the
+# host arrays fed through a generator or placeholders, against the arrays embedded in the
+# graph as constants (Config.dataset_feed). Each feed runs in its own process on the same
+# synthetic uint8 images. Startup is loader + model construction + the first batch:
+#   python -m benchmarks.dataset_feed --n_images 40
+
+FEEDS = ['constant', 'placeholder', 'generator']
+
+
+def synthetic_images(n_images, h, w, seed = 1):
+    rng = np.random.RandomState(seed)
+    images = rng.randint(0, 256, size = (n_images, h, w, 3), dtype = np.uint8)
+    labels = np.arange(n_images) % Config.num_classes
+    return images, labels, np.arange(n_images)
+
+
+def worker(args):
+    Config.dataset_feed = args.feed
+    Config.model_type = args.model_type
+    images_labels = synthetic_images(args.n_images, *args.image_size)
+    directory = tempfile.mkdtemp()
+
+    start = time.perf_counter()
+    data_loader = DatasetLoader(Config, images_labels = images_labels)
+    model = create_model(data_loader, Config)
+    graph_seconds = time.perf_counter() - start
+    with tf.Session(config=cpu_session_config(args.threads)) as sess:
+        sess.run(tf.global_variables_initializer())
+        data_loader.initialize(sess, train = True)
+        sess.run(model.x)
+        startup_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        model.saver.save(sess, os.path.join(directory, 'model'))
+        save_seconds = time.perf_counter() - start
+
+    print(json.dumps({'graph_s': graph_seconds, 'startup_s': startup_seconds, 'save_s': save_seconds,
+                      'meta_mb': os.path.getsize(os.path.join(directory, 'model.meta')) / 2**20,
+                      'peak_rss_mb': peak_rss_mb()}))
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='In-memory DatasetLoader feeds')
+    argparser.add_argument('--n_images', type=int, default=40)
+    argparser.add_argument('--image_size', type=int, nargs=2, default=[Config.image_h, Config.image_w])
+    argparser.add_argument('--model_type', default='ResNet18')
+    argparser.add_argument('--threads', type=int, default=0)
+    argparser.add_argument('--feed', default=None, help=argparse.SUPPRESS)
+    args = argparser.parse_args()
+
+    if (args.feed is not None):
+        worker(args)
+        sys.exit(0)
+
+    dataset_mb = args.n_images * args.image_size[0] * args.image_size[1] * 3 / 2**20
+    print("Dataset: {} images, {:.0f} MB uint8".format(args.n_images, dataset_mb))
+    rows = []
+    for feed in FEEDS:
+        cmd = [sys.executable, '-m', 'benchmarks.dataset_feed', '--feed', feed, '--n_images', str(args.n_images),
+               '--image_size', *map(str, args.image_size), '--model_type', args.model_type,
+               '--threads', str(args.threads)]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE)
+        if (result.returncode != 0):
+            # e.g. constants over the 2GB GraphDef limit
+            rows.append([feed, 'failed', '', '', '', ''])
+            continue
+        r = json.loads(result.stdout.decode().strip().splitlines()[-1])
+        rows.append([feed, r['graph_s'], r['startup_s'], r['save_s'], r['meta_mb'], r['peak_rss_mb']])
+
+    print_table(['feed', 'graph build (s)', 'startup (s)', 'save (s)', '.meta (MB)', 'peak RSS (MB)'], rows)
@@ -0,0 +1,126 @@
+import argparse
+import logging
+import tempfile
+import time
+import os
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from benchmarks.common import cpu_session_config, print_table
+from dataloaders.PlaceholderLoader import PlaceholderLoader
+from utils.dense_eval import DenseEvaluator, dense_input_shape, bag_probabilities
+from utils.img_utils import get_images_pathlist_labels, split_train_val
+from utils.numpy_ops import extract_patches_numpy
+from utils.quantization import head_weights
+from run import create_model
+
+from config import Config
+
+
+# Bag evaluation of whole images: explicit patch extraction (one backbone pass per patch)
+# against the fully-convolutional pass of utils.dense_eval, at increasing patch overlap.
+# Both graphs hold the same weights (Config.checkpoint_dir, or the random initialization
+# of the patch graph). Reported per image: time, bag prediction agreement and the cosine
+# similarity of the patch embeddings of the two paths. Synthetic images by default,
+# validation images (with bag accuracy) with --dataset:
+#   python -m benchmarks.dense_eval --overlaps 0 0.25 0.5
+
+def load_images(n_images, image_shape, dataset, seed = 1):
+    if (dataset):
+        _, _, _, val_images, val_labels, _ = split_train_val(*get_images_pathlist_labels(),
+                                                             ratio = Config.train_val_split,
+                                                             pre_shuffle = True)
+        images = [np.asarray(Image.open(path).convert('RGB')) for path in val_images[:n_images]]
+        return np.stack(images), np.asarray(val_labels[:n_images])
+    rng = np.random.RandomState(seed)
+    return rng.randint(0, 256, size = (n_images, *image_shape, 3)).astype(np.uint8), None
+
+
+def explicit_embeddings(embed, image, overlap, batch_size):
+    p = Config.patch_size
+    patches = extract_patches_numpy(image, size=(p, p), overlap = overlap)
+    if (p != 227):
+        patches = np.stack([np.asarray(Image.fromarray(x).resize((227, 227), Image.BILINEAR)) for x in patches])
+    patches = patches.astype(np.float32)
+    return np.concatenate([embed(patches[i : i + batch_size]) for i in range(0, patches.shape[0], batch_size)])
+
+
+def cosine(a, b):
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return float(np.mean(np.sum(a * b, axis=1)))
+
+
+def compare(model_type, images, labels, overlaps, batch_size, threads):
+    Config.model_type = model_type
+    checkpoint = os.path.join(tempfile.mkdtemp(), 'weights')
+
+    # explicit patches
+    tf.reset_default_graph()
+    data_loader = PlaceholderLoader(Config)
+    model = create_model(data_loader, Config)
+    explicit, ms_explicit = {}, {}
+    with tf.Session(config=cpu_session_config(threads)) as sess:
+        sess.run(tf.global_variables_initializer())
+        model.load(sess)
+        model.saver.save(sess, checkpoint)
+        heads = {name: head_weights(sess, name) for name in ['logits_mi', 'logits_si', 'hash']}
+        embed = lambda x: sess.run(model.embedding, feed_dict={data_loader.x: x, model.is_training: False})
+        explicit_embeddings(embed, images[0], overlaps[0], batch_size)
+        for overlap in overlaps:
+            start = time.perf_counter()
+            explicit[overlap] = [explicit_embeddings(embed, image, overlap, batch_size) for image in images]
+            ms_explicit[overlap] = (time.perf_counter() - start) * 1000 / len(images)
+
+    # one fully-convolutional pass per image
+    tf.reset_default_graph()
+    data_loader = PlaceholderLoader(Config, input_shape = dense_input_shape(Config, images.shape[1:3]))
+    model = create_model(data_loader, Config)
+    rows = []
+    with tf.Session(config=cpu_session_config(threads)) as sess:
+        sess.run(tf.global_variables_initializer())
+        model.saver.restore(sess, checkpoint)
+        evaluator = DenseEvaluator(sess, data_loader, model, Config, images.shape[1:3])
+        evaluator.embed(images[:1], overlaps[0])
+        for overlap in overlaps:
+            start = time.perf_counter()
+            dense = [evaluator.embed(image[np.newaxis], overlap)[0] for image in images]
+            ms_dense = (time.perf_counter() - start) * 1000 / len(images)
+
+            pred_explicit = np.asarray([bag_probabilities(x, heads, Config.pooling).argmax() for x in explicit[overlap]])
+            pred_dense = np.asarray([bag_probabilities(x, heads, Config.pooling).argmax() for x in dense])
+            similarity = np.mean([cosine(a, b) for a, b in zip(explicit[overlap], dense)])
+
+            row = [model_type, overlap, dense[0].shape[0], ms_explicit[overlap], ms_dense, ms_explicit[overlap] / ms_dense,
+                   float(np.mean(pred_explicit == pred_dense)), float(similarity)]
+            if (labels is not None):
+                row += [float(np.mean(pred_explicit == labels)), float(np.mean(pred_dense == labels))]
+            rows.append(row)
+    return rows
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Explicit patches against fully-convolutional bag evaluation')
+    argparser.add_argument('--backbones', nargs='+', default=['ResNet18', 'ResNet50'])
+    argparser.add_argument('--overlaps', type=float, nargs='+', default=[0, 0.25, 0.5])
+    argparser.add_argument('--n_images', type=int, default=5)
+    argparser.add_argument('--image_size', type=int, nargs=2, default=[1536, 2048], help='Synthetic image h w')
+    argparser.add_argument('--dataset', action='store_true', help='Validation images instead of synthetic ones')
+    argparser.add_argument('--batch_size', type=int, default=64, help='Explicit patches per forward pass')
+    argparser.add_argument('--threads', type=int, default=0)
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    images, labels = load_images(args.n_images, tuple(args.image_size), args.dataset)
+    rows = []
+    for model_type in args.backbones:
+        rows += compare(model_type, images, labels, args.overlaps, args.batch_size, args.threads)
+
+    headers = ['backbone', 'overlap', 'patches', 'ms/image explicit', 'ms/image dense', 'speedup',
+               'agreement', 'cosine']
+    if (labels is not None):
+        headers += ['acc explicit', 'acc dense']
+    print_table(headers, rows)
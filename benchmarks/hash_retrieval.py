@@ -0,0 +1,65 @@
+import argparse
+import time
+
+import numpy as np
+
+from utils.hash_index import HashIndex, MultiIndexHash, binarize, pack_codes, top_k
+
+
+# Query latency and recall@k of Hamming search over packed hash codes (linear popcount scan
+# and multi-index hashing) against brute-force cosine search over the float embeddings
+# Synthetic clustered embeddings stand in for patch embeddings, codes are the signs of a
+# random projection (in place of a trained hash layer), recall is against the cosine k-NN:
+#   python -m benchmarks.hash_retrieval --sizes 10000 100000 1000000
+
+def clustered_embeddings(n, dim, n_clusters = 100, spread = 0.5, seed = 1):
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(n_clusters, dim).astype(np.float32)
+    x = centers[rng.randint(0, n_clusters, size=n)] + spread * rng.randn(n, dim).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def time_queries(search, queries):
+    results = []
+    start = time.perf_counter()
+    for q in queries:
+        results.append(search(q))
+    return (time.perf_counter() - start) / len(queries) * 1000, results
+
+
+def recall(found, truth):
+    return np.mean([len(np.intersect1d(f, t)) / len(t) for f, t in zip(found, truth)])
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Hamming retrieval vs float cosine search')
+    argparser.add_argument('--sizes', type=int, nargs='+', default=[10**4, 10**5, 10**6], help='Indexed patches')
+    argparser.add_argument('--dim', type=int, default=128, help='Embedding size')
+    argparser.add_argument('--bits', type=int, default=64, help='Hash code length')
+    argparser.add_argument('--k', type=int, default=10)
+    argparser.add_argument('--n_queries', type=int, default=100)
+    args = argparser.parse_args()
+
+    rng = np.random.RandomState(0)
+    projection = rng.randn(args.dim, args.bits).astype(np.float32)
+
+    print("n_indexed  method     ms/query  recall@{}  candidates".format(args.k))
+    for n in args.sizes:
+        x = clustered_embeddings(n + args.n_queries, args.dim)
+        database, queries = x[:n], x[n:]
+
+        index = HashIndex(args.bits)
+        index.add_image('synthetic', -1, patch_codes = pack_codes(binarize(database @ projection)),
+                        positions = np.zeros((n, 2), dtype=np.int32))
+        query_codes = pack_codes(binarize(queries @ projection))
+        mih = MultiIndexHash(index)
+
+        cosine_ms, truth = time_queries(lambda q: top_k(-(database @ q), args.k), queries)
+        linear_ms, linear = time_queries(lambda q: index.search(q, args.k)[0], query_codes)
+        mih_ms, mih_results = time_queries(lambda q: mih.search(q, args.k), query_codes)
+
+        rows = [('cosine', cosine_ms, 1.0, n),
+                ('hamming', linear_ms, recall(linear, truth), n),
+                ('mih', mih_ms, recall([r[0] for r in mih_results], truth), np.mean([r[2] for r in mih_results]))]
+        for method, ms, r, candidates in rows:
+            print("{:<10} {:<10} {:>8.3f}  {:>9.3f}  {:>10.0f}".format(n, method, ms, r, candidates))
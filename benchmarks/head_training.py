@@ -0,0 +1,61 @@
+import argparse
+import logging
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from benchmarks.common import cpu_session_config
+from dataloaders.EmbeddingLoader import EmbeddingLoader
+from models.MIHead import MIHead
+from utils.embedding_store import EmbeddingStoreWriter
+
+from config import Config
+
+
+# Bags per second of head-only training (EmbeddingLoader + MIHead) on a synthetic
+# embedding store shaped like the BACH dataset (400 images of 70 patches)
+
+def write_synthetic_store(store_dir, n_images, n_patches, dim, seed = 1):
+    rng = np.random.RandomState(seed)
+    writer = EmbeddingStoreWriter(store_dir, n_images * n_patches, dim, dtype = Config.embedding_dtype)
+    positions = np.zeros((n_patches, 2), dtype=np.int32)
+    for i in range(n_images):
+        label = i % Config.num_classes
+        writer.add('image_{}.png'.format(i), label, rng.randn(n_patches, dim) + label, positions)
+    writer.close()
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Head-only training throughput')
+    argparser.add_argument('--dim', type=int, default=2048, help='2048 for ResNet50_MI, 512 for ResNet18_MI')
+    argparser.add_argument('--n_images', type=int, default=400)
+    argparser.add_argument('--n_patches', type=int, default=70)
+    argparser.add_argument('--steps', type=int, default=500)
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        write_synthetic_store(store_dir, args.n_images, args.n_patches, args.dim)
+        Config.embedding_store_dir = store_dir
+        Config.train_head_only = True
+
+        data_loader = EmbeddingLoader(Config)
+        model = MIHead(data_loader, Config)
+
+        with tf.Session(config=cpu_session_config()) as sess:
+            sess.run(tf.global_variables_initializer())
+            data_loader.initialize(sess, train = True)
+            for _ in range(10):
+                sess.run(model.train_step, feed_dict={model.is_training: True})
+
+            start = time.perf_counter()
+            for _ in range(args.steps):
+                sess.run(model.train_step, feed_dict={model.is_training: True})
+            elapsed = time.perf_counter() - start
+
+    print("Head-only training: {:.1f} steps/s, {:.1f} bags/s (batch_size {}, {} patches per bag, dim {})".format(
+        args.steps / elapsed, args.steps * Config.batch_size / elapsed, Config.batch_size,
+        Config.n_random_patches, args.dim))
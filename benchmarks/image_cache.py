@@ -0,0 +1,62 @@
+import argparse
+import tempfile
+import time
+import os
+
+import numpy as np
+from PIL import Image
+from multiprocessing.pool import ThreadPool
+
+from benchmarks.common import peak_rss_mb, print_table
+from utils.image_cache import DecodedImageCache, decode_png
+
+
+# Reads per second of the decoded image cache of DatasetFileLoader (Config.image_cache_mb) at
+# budgets given as fractions of the decoded dataset, on synthetic PNGs read in shuffled epochs
+# by a pool of threads (like the parallel map calls of the loader). Budget 0 is the previous
+# decode on every read. The first epoch fills the cache, the table is over the later ones:
+#   python -m benchmarks.image_cache --n_images 40 --budgets 0 0.25 0.5 1
+
+def synthetic_pngs(directory, n_images, h, w, seed = 1):
+    rng = np.random.RandomState(seed)
+    # smooth noise, compresses like a stained image rather than like white noise
+    base = rng.randint(0, 256, size = (h // 16, w // 16, 3), dtype = np.uint8)
+    paths = []
+    for i in range(n_images):
+        image = Image.fromarray(np.roll(base, i, axis = 1)).resize((w, h), Image.BILINEAR)
+        paths.append(os.path.join(directory, '{}.png'.format(i)))
+        image.save(paths[-1])
+    return paths
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Decoded image cache')
+    argparser.add_argument('--n_images', type=int, default=40)
+    argparser.add_argument('--image_size', type=int, nargs=2, default=[1536, 2048])
+    argparser.add_argument('--budgets', type=float, nargs='+', default=[0, 0.25, 0.5, 1])
+    argparser.add_argument('--n_epochs', type=int, default=3)
+    argparser.add_argument('--workers', type=int, default=8)
+    args = argparser.parse_args()
+
+    paths = synthetic_pngs(tempfile.mkdtemp(), args.n_images, *args.image_size)
+    dataset_mb = args.n_images * args.image_size[0] * args.image_size[1] * 3 / 2**20
+    print("Dataset: {} images, {:.0f} MB decoded".format(args.n_images, dataset_mb))
+
+    rng = np.random.RandomState(1)
+    rows = []
+    with ThreadPool(args.workers) as pool:
+        for budget in args.budgets:
+            # a small margin so that a budget of 1 holds the whole dataset
+            cache = DecodedImageCache(budget * dataset_mb * 1.01, decode = decode_png)
+            pool.map(cache.read, rng.permutation(paths))
+            cache.reset_stats()
+            start = time.perf_counter()
+            for _ in range(args.n_epochs):
+                pool.map(cache.read, rng.permutation(paths))
+            seconds = time.perf_counter() - start
+            stats = cache.stats()
+            rows.append([budget, stats['budget_mb'], args.n_images * args.n_epochs / seconds, stats['hit_rate'],
+                         stats['misses'], stats['evictions'], stats['mb'], peak_rss_mb()])
+
+    print_table(['budget', 'budget MB', 'images/s', 'hit rate', 'misses', 'evictions', 'cached MB',
+                 'peak RSS (MB)'], rows)
@@ -0,0 +1,93 @@
+import argparse
+import tempfile
+import time
+import os
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from benchmarks.common import cpu_session_config, print_table
+from utils.image_pyramid import ImagePyramid, build_image_pyramid
+from utils.img_utils import get_images_pathlist_labels
+
+from config import Config
+
+
+# Decode cost and epoch time of whole image loading (train_on_patches = False): decoding the
+# full resolution PNG and resizing it to 227 x 227 every epoch, against reading the nearest
+# pyramid level in png and raw format. Runs the same read + resize tf.data pipeline as
+# DatasetFileLoader over synthetic H&E-like images, or the dataset with --dataset:
+#   python -m benchmarks.image_pyramid --n_images 64
+
+def synthetic_images(directory, n, h = 1536, w = 2048, seed = 1):
+    # smooth color blobs compress like stained tissue, unlike uniform noise
+    rng = np.random.RandomState(seed)
+    paths = []
+    for i in range(n):
+        small = rng.randint(120, 256, size=(h // 64, w // 64, 3), dtype=np.uint8)
+        image = Image.fromarray(small).resize((w, h), Image.BICUBIC)
+        path = os.path.join(directory, 'image_{}.png'.format(i))
+        image.save(path)
+        paths.append(path)
+    return paths
+
+
+def epoch_time(paths, decode, threads, n_epochs = 2):
+    # images/s and seconds per epoch of read + decode + resize, after a warm-up epoch
+    graph = tf.Graph()
+    with graph.as_default():
+        dataset = tf.data.Dataset.from_tensor_slices(paths).repeat()
+        dataset = dataset.map(lambda p: tf.cast(tf.image.resize_images(decode(p), [227, 227]), tf.float32),
+                              num_parallel_calls = threads)
+        dataset = dataset.batch(Config.batch_size).prefetch(1)
+        batch = dataset.make_one_shot_iterator().get_next()
+        n_batches = len(paths) // Config.batch_size
+
+        with tf.Session(graph=graph, config=cpu_session_config(threads)) as sess:
+            for _ in range(n_batches):
+                sess.run(batch)
+            start = time.perf_counter()
+            for _ in range(n_batches * n_epochs):
+                sess.run(batch)
+            seconds = (time.perf_counter() - start) / n_epochs
+    return seconds, n_batches * Config.batch_size / seconds
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Image pyramid vs resize-per-epoch loading')
+    argparser.add_argument('--n_images', type=int, default=64)
+    argparser.add_argument('--dataset', action='store_true', help='Use the dataset images instead of synthetic ones')
+    argparser.add_argument('--threads', type=int, default=Config.num_parallel_cores)
+    args = argparser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if (args.dataset):
+            paths = list(get_images_pathlist_labels()[0][:args.n_images])
+        else:
+            paths = synthetic_images(directory, args.n_images)
+
+        rows = []
+        h, w = np.asarray(Image.open(paths[0])).shape[:2]
+        decode_png = lambda p: tf.image.decode_png(tf.read_file(p), channels = 3)
+        seconds, images_per_s = epoch_time(paths, decode_png, args.threads)
+        rows.append(['full resolution png', h * w / 1e6, seconds, images_per_s,
+                     sum(os.path.getsize(p) for p in paths) / len(paths) / 2**20])
+
+        for format in ['png', 'raw']:
+            store_dir = os.path.join(directory, 'pyramid_' + format)
+            build_image_pyramid(paths, store_dir, levels = Config.pyramid_levels, format = format,
+                                num_workers = args.threads)
+            pyramid = ImagePyramid(store_dir)
+            level = pyramid.level_for((227, 227))
+            lh, lw = pyramid.level_shape(level)
+            level_paths = list(pyramid.paths(paths, level))
+            if (format == 'raw'):
+                decode = lambda p: tf.reshape(tf.decode_raw(tf.read_file(p), tf.uint8), [lh, lw, 3])
+            else:
+                decode = decode_png
+            seconds, images_per_s = epoch_time(level_paths, decode, args.threads)
+            rows.append(['level 1/{} {}'.format(level, format), lh * lw / 1e6, seconds, images_per_s,
+                         sum(os.path.getsize(p) for p in level_paths) / len(level_paths) / 2**20])
+
+    print_table(['path', 'Mpixels decoded/image', 's/epoch', 'images/s', 'MB/image on disk'], rows)
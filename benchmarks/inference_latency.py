@@ -0,0 +1,62 @@
+import argparse
+import logging
+
+import tensorflow as tf
+
+from benchmarks.common import BACKBONES, cpu_session_config, random_bags, time_runs, print_table
+from dataloaders.PlaceholderLoader import PlaceholderLoader
+from optimize_graph import get_inference_io
+from utils.graph_utils import optimize_for_inference
+from run import create_model
+
+from config import Config
+
+
+# CPU latency of the training graph run in inference mode (is_training fed as False)
+# against the optimized inference graph (folded batch norms, no training branches)
+# Note: resnet_v2 builds slim.batch_norm with is_training=True, so the ResNet50 baseline
+# normalizes with batch moments and its outputs differ from the moving-statistics graph
+
+def benchmark_backbone(model_type, n_patches, n_runs):
+    Config.model_type = model_type
+    images, bag_index = random_bags(Config.batch_size, n_patches)
+
+    tf.reset_default_graph()
+    data_loader = PlaceholderLoader(Config)
+    model = create_model(data_loader, Config)
+    input_names, output_names = get_inference_io(data_loader, model)
+
+    with tf.Session(config=cpu_session_config()) as sess:
+        sess.run(tf.global_variables_initializer())
+        feed = data_loader.feed_dict(images, bag_index)
+        feed[model.is_training] = False
+        baseline = sess.run(model.out, feed_dict=feed)
+        base_ms, base_std = time_runs(lambda: sess.run(model.out, feed_dict=feed), n_runs=n_runs)
+
+        n_nodes = len(sess.graph.as_graph_def().node)
+        graph_def = optimize_for_inference(sess, input_names, output_names,
+                                           training_flag_name = model.is_training.op.name)
+
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        out = graph.get_tensor_by_name(output_names[0] + ':0')
+        feed = {graph.get_tensor_by_name(input_names[0] + ':0'): images,
+                graph.get_tensor_by_name(input_names[1] + ':0'): bag_index}
+        with tf.Session(graph=graph, config=cpu_session_config()) as sess:
+            optimized = sess.run(out, feed_dict=feed)
+            opt_ms, opt_std = time_runs(lambda: sess.run(out, feed_dict=feed), n_runs=n_runs)
+
+    max_diff = float(abs(baseline - optimized).max())
+    return [model_type, n_nodes, len(graph_def.node), base_ms, base_std, opt_ms, opt_std, base_ms / opt_ms, max_diff]
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='CPU latency of training vs optimized inference graphs')
+    argparser.add_argument('--n_patches', type=int, default=20, help='Patches per bag')
+    argparser.add_argument('--n_runs', type=int, default=20, help='Timed runs per graph')
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    rows = [benchmark_backbone(m, args.n_patches, args.n_runs) for m in BACKBONES]
+    print_table(['backbone', 'nodes', 'nodes opt', 'ms', 'std', 'ms opt', 'std opt', 'speedup', 'max |diff|'], rows)
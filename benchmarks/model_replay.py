@@ -0,0 +1,60 @@
+import argparse
+import logging
+import tempfile
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from benchmarks.common import BACKBONES, cpu_session_config, time_runs, print_table
+from dataloaders.DatasetFileLoader import DatasetFileLoader
+from dataloaders.ReplayLoader import ReplayLoader
+from record_batches import record_batches
+from run import create_model
+
+from config import Config
+
+
+# Training step time of ResNet18_MI, ResNet50_MI and ResNeXt_MI on batches replayed from
+# memory (ReplayLoader, model compute only) against the live DatasetFileLoader pipeline.
+# The batches are recorded once (record_batches.py) and shared by all models; every setting
+# is timed --repeats times, the spread of the means across repeats is the run-to-run noise.
+# Requires the dataset:
+#   python -m benchmarks.model_replay --n_batches 20 --repeats 3
+
+def step_times(model_type, input, path, n_runs, repeats, threads):
+    Config.model_type = model_type
+    tf.reset_default_graph()
+    data_loader = ReplayLoader(Config, path) if input == 'replay' else DatasetFileLoader(Config)
+    model = create_model(data_loader, Config)
+    with tf.Session(config=cpu_session_config(threads)) as sess:
+        sess.run(tf.global_variables_initializer())
+        data_loader.initialize(sess, train = True)
+        step = lambda: sess.run(model.train_step, feed_dict={model.is_training: True})
+        means = [time_runs(step, n_runs = n_runs)[0] for _ in range(repeats)]
+    return np.mean(means), np.std(means)
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Model step time on replayed against live batches')
+    argparser.add_argument('--n_batches', type=int, default=20, help='batches recorded')
+    argparser.add_argument('--n_runs', type=int, default=20, help='timed steps per repeat')
+    argparser.add_argument('--repeats', type=int, default=3)
+    argparser.add_argument('--threads', type=int, default=0)
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'batches.bin')
+        record_batches(Config, path, args.n_batches, threads = args.threads)
+
+        for model_type in BACKBONES:
+            pipeline_ms, pipeline_std = step_times(model_type, 'pipeline', path, args.n_runs, args.repeats,
+                                                   args.threads)
+            replay_ms, replay_std = step_times(model_type, 'replay', path, args.n_runs, args.repeats, args.threads)
+            rows.append([model_type + '_MI', pipeline_ms, pipeline_std, replay_ms, replay_std,
+                         Config.batch_size * 1000 / replay_ms])
+
+    print_table(['model', 'pipeline step (ms)', 'spread', 'replay step (ms)', 'spread', 'replay bags/s'], rows)
@@ -0,0 +1,49 @@
+import argparse
+import time
+
+import tensorflow as tf
+
+from benchmarks.common import cpu_session_config, print_table
+from dataloaders.DatasetFileLoader import DatasetFileLoader
+from dataloaders.MultiScaleLoader import MultiScaleLoader
+
+from config import Config
+
+
+# Input pipeline throughput of multi-magnification bags (MultiScaleLoader, all levels of an
+# image read in one map call) against single scale random crops (DatasetFileLoader)
+# Requires the dataset and the image pyramid of build_image_pyramid.py:
+#   python -m benchmarks.multi_scale --levels 1 2 4
+
+def loader_throughput(loader_class, n_batches, threads):
+    tf.reset_default_graph()
+    data_loader = loader_class(Config)
+    x, _, _, _ = data_loader.get_input()
+    with tf.Session(config=cpu_session_config(threads)) as sess:
+        data_loader.initialize(sess, train = True)
+        sess.run(x)
+        n_patches = 0
+        start = time.perf_counter()
+        for _ in range(n_batches):
+            n_patches += sess.run(x).shape[0]
+        seconds = time.perf_counter() - start
+    return n_batches * Config.batch_size / seconds, n_patches / seconds
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Multi-scale bag loading throughput')
+    argparser.add_argument('--levels', type=int, nargs='+', default=[1, 2, 4])
+    argparser.add_argument('--n_batches', type=int, default=50)
+    argparser.add_argument('--threads', type=int, default=Config.num_parallel_cores)
+    args = argparser.parse_args()
+
+    Config.patch_generation_scheme = 'random_crops'
+    rows = []
+    bags_per_s, patches_per_s = loader_throughput(DatasetFileLoader, args.n_batches, args.threads)
+    rows.append(['single scale', bags_per_s, patches_per_s])
+
+    Config.multi_scale_levels = args.levels
+    bags_per_s, patches_per_s = loader_throughput(MultiScaleLoader, args.n_batches, args.threads)
+    rows.append(['levels {}'.format(args.levels), bags_per_s, patches_per_s])
+
+    print_table(['bags', 'bags/s', 'patches/s'], rows)
@@ -0,0 +1,66 @@
+import argparse
+import logging
+
+import numpy as np
+import tensorflow as tf
+
+from benchmarks.common import cpu_session_config, random_bags, time_runs, print_table
+from dataloaders.PlaceholderLoader import PlaceholderLoader
+from models.ResNet18_MI import ResNet18_MI
+from utils.activation_cache import COMPRESSION_DTYPES
+
+from config import Config
+
+
+# Training step time of ResNet18_MI with the full backbone against the trainable suffix fed
+# from cached activations at each block boundary, with the disk cost of the cache for the
+# whole dataset (400 images of 70 sequential patches) per compression
+
+STAGES = ['conv1', 'conv2_x', 'conv3_x', 'conv4_x']
+
+
+def step_ms(loader, feed, n_runs):
+    model = ResNet18_MI(loader, Config)
+    with tf.Session(config=cpu_session_config()) as sess:
+        sess.run(tf.global_variables_initializer())
+        feed = dict(feed, **{model.is_training: True})
+        return time_runs(lambda: sess.run(model.train_step, feed_dict=feed), n_runs=n_runs)[0], model
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Partial freezing with cached activations')
+    argparser.add_argument('--n_runs', type=int, default=10)
+    argparser.add_argument('--n_images', type=int, default=400)
+    argparser.add_argument('--patches_per_image', type=int, default=70)
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+    Config.model_type = 'ResNet18'
+
+    images, bag_index = random_bags(Config.batch_size, Config.n_random_patches)
+    labels = np.zeros(bag_index.shape[0], dtype=np.int32)
+    mi_labels = np.zeros(Config.batch_size, dtype=np.int32)
+
+    tf.reset_default_graph()
+    loader = PlaceholderLoader(Config)
+    full_ms, model = step_ms(loader, loader.feed_dict(images, bag_index, labels, mi_labels), args.n_runs)
+    shapes = {stage: model.stage_outputs[stage].shape.as_list()[1:] for stage in STAGES}
+
+    n_patches = args.n_images * args.patches_per_image
+    rows = [['full backbone', full_ms, 1.0] + ['-'] * len(COMPRESSION_DTYPES)]
+    for stage in STAGES:
+        tf.reset_default_graph()
+        loader = PlaceholderLoader(Config, input_shape = shapes[stage])
+        loader.cached_stage = stage
+        activations = np.random.rand(bag_index.shape[0], *shapes[stage]).astype(np.float32)
+        ms, _ = step_ms(loader, loader.feed_dict(activations, bag_index, labels, mi_labels), args.n_runs)
+
+        disk = []
+        for compression, dtype in COMPRESSION_DTYPES.items():
+            size = n_patches * np.prod(shapes[stage]) * np.dtype(dtype).itemsize
+            if (compression == 'uint8'):
+                size += n_patches * shapes[stage][-1] * 4
+            disk.append(size / 2**30)
+        rows.append(['frozen until ' + stage, ms, full_ms / ms] + disk)
+
+    print_table(['training', 'ms/step', 'speedup'] + ['GB ' + c for c in COMPRESSION_DTYPES], rows)
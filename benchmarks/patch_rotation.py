@@ -0,0 +1,98 @@
+import argparse
+import subprocess
+import json
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+from benchmarks.common import cpu_session_config, time_runs, train_curve, print_table
+from utils.img_utils import random_dihedral
+from utils.rotation import rotate_images_by, dihedral_images
+
+from config import Config
+
+
+# Patch rotation augmentation of patch_augment: uniform arbitrary angles with
+# tf.contrib.image.rotate (the previous and default Config.patch_rotation = 'arbitrary')
+# against the 8 dihedral transforms (index permutations), with and without a small residual
+# angle. Throughput on a batch of patches in the graph and in NumPy (ProcessPoolLoader
+# workers), and the fraction of zero filled (black corner) pixels. With --train_epochs, each
+# mode also trains from scratch in its own process (requires the dataset):
+#   python -m benchmarks.patch_rotation --n_patches 80
+#   python -m benchmarks.patch_rotation --train_epochs 20
+
+MODES = [('arbitrary', 'NEAREST', 0), ('arbitrary', 'BILINEAR', 0), ('dihedral', 'NEAREST', 0),
+         ('dihedral', 'NEAREST', 10), ('dihedral', 'BILINEAR', 10)]
+
+
+def rotate_graph(x, mode, interpolation, residual):
+    if (mode == 'dihedral'):
+        return random_dihedral(x, residual, interpolation = interpolation)
+    angles = tf.random_uniform([tf.shape(x)[0]], 0, 360) * np.pi / 180
+    return tf.contrib.image.rotate(x, angles, interpolation = interpolation)
+
+
+def rotate_numpy(patches, mode, interpolation, residual, rng):
+    n = patches.shape[0]
+    if (mode == 'dihedral'):
+        dihedral_images(patches, rng.randint(0, 8, size = n))
+        if (residual > 0):
+            rotate_images_by(patches, rng.uniform(-residual, residual, size = n), interpolation)
+    else:
+        rotate_images_by(patches, rng.uniform(0, 360, size = n), interpolation)
+    return patches
+
+
+def worker(args):
+    Config.patch_rotation, Config.interpolation, Config.patch_rotation_residual = \
+        args.mode.split(':')[0], args.mode.split(':')[1], float(args.mode.split(':')[2])
+    curve = train_curve(Config, args.train_epochs, threads = args.threads)
+    print(json.dumps({'curve': curve}))
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Dihedral against arbitrary angle patch rotation')
+    argparser.add_argument('--n_patches', type=int, default=80)
+    argparser.add_argument('--n_runs', type=int, default=20)
+    argparser.add_argument('--train_epochs', type=int, default=0)
+    argparser.add_argument('--threads', type=int, default=0)
+    argparser.add_argument('--mode', default=None, help=argparse.SUPPRESS)
+    args = argparser.parse_args()
+
+    if (args.mode is not None):
+        worker(args)
+        sys.exit(0)
+
+    rng = np.random.RandomState(1)
+    patches = rng.randint(0, 256, size = (args.n_patches, 227, 227, 3), dtype = np.uint8)
+    white = np.full_like(patches, 255)
+
+    rows = []
+    for mode, interpolation, residual in MODES:
+        with tf.Graph().as_default():
+            x = tf.placeholder(tf.uint8, shape = (None, 227, 227, 3))
+            rotated = rotate_graph(x, mode, interpolation, residual)
+            with tf.Session(config=cpu_session_config(args.threads)) as sess:
+                ms_graph, _ = time_runs(lambda: sess.run(rotated, feed_dict = {x: patches}), n_runs = args.n_runs)
+                black = np.mean(sess.run(rotated, feed_dict = {x: white}) == 0)
+        ms_numpy, _ = time_runs(lambda: rotate_numpy(patches, mode, interpolation, residual, rng), n_warmup = 1,
+                                n_runs = max(1, args.n_runs // 4))
+        rows.append([mode, interpolation, residual, ms_graph, args.n_patches / ms_graph * 1000, ms_numpy,
+                     args.n_patches / ms_numpy * 1000, black])
+
+    print_table(['rotation', 'interpolation', 'residual', 'ms graph', 'patches/s graph', 'ms numpy',
+                 'patches/s numpy', 'black fraction'], rows)
+
+    if (args.train_epochs > 0):
+        print()
+        rows = []
+        for mode, interpolation, residual in MODES:
+            cmd = [sys.executable, '-m', 'benchmarks.patch_rotation', '--mode',
+                   '{}:{}:{}'.format(mode, interpolation, residual), '--train_epochs', str(args.train_epochs),
+                   '--threads', str(args.threads)]
+            curve = json.loads(subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout.decode()
+                               .strip().splitlines()[-1])['curve']
+            seconds, accuracies = zip(*curve)
+            rows.append([mode, interpolation, residual, seconds[-1], max(accuracies), accuracies[-1]])
+        print_table(['rotation', 'interpolation', 'residual', 'train (s)', 'best val acc', 'final val acc'], rows)
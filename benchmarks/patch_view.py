@@ -0,0 +1,69 @@
+import argparse
+
+import numpy as np
+import tensorflow as tf
+
+from benchmarks.common import time_runs, print_table
+from utils.img_utils import extract_patches_from_tensor
+from utils.numpy_ops import patch_view, plan_patch_grid
+
+
+# Patch extraction of an in-memory dataset: tf.extract_image_patches in a session (the
+# previous DatasetLoader path, every patch copied) against the strided NumPy views of
+# utils.numpy_ops.patch_view, and the views materialized into a contiguous array.
+# 'extra MB' is the memory allocated besides the images (the zero padded copy for 'SAME'
+# grids that overhang the border, nothing for 'VALID'):
+#   python -m benchmarks.patch_view --n_images 20 --overlaps 0 0.5
+
+def tf_patches(images, size, overlap):
+    with tf.Graph().as_default():
+        x = tf.placeholder(tf.uint8, shape=images.shape)
+        patches, _ = extract_patches_from_tensor(x, size=(size, size), overlap = overlap)
+        with tf.Session() as sess:
+            return sess.run(patches, feed_dict={x: images})
+
+
+def view_extra_mb(view, images, stride):
+    # size of the zero padded copy when the view is not on the images themselves
+    if (np.shares_memory(view, images)):
+        return 0.0
+    n, rows, cols, size_h, size_w, c = view.shape
+    return n * ((rows - 1) * stride + size_h) * ((cols - 1) * stride + size_w) * c * view.itemsize / 2**20
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Strided NumPy patch views')
+    argparser.add_argument('--n_images', type=int, default=20)
+    argparser.add_argument('--image_size', type=int, nargs=2, default=[1536, 2048])
+    argparser.add_argument('--patch_size', type=int, default=227)
+    argparser.add_argument('--overlaps', type=float, nargs='+', default=[0, 0.25, 0.5])
+    argparser.add_argument('--n_runs', type=int, default=5)
+    args = argparser.parse_args()
+
+    rng = np.random.RandomState(1)
+    images = rng.randint(0, 256, size=(args.n_images, *args.image_size, 3), dtype=np.uint8)
+    p = args.patch_size
+
+    rows = []
+    for overlap in args.overlaps:
+        patches = tf_patches(images, p, overlap)
+        ms_tf, _ = time_runs(lambda: tf_patches(images, p, overlap), n_warmup = 1, n_runs = args.n_runs)
+        for padding in ['SAME', 'VALID']:
+            view = patch_view(images, (p, p), overlap, padding)
+            n_patches = view.shape[1] * view.shape[2]
+            if (padding == 'SAME'):
+                assert np.array_equal(view.reshape(patches.shape), patches)
+            ms_view, _ = time_runs(lambda: patch_view(images, (p, p), overlap, padding), n_runs = args.n_runs)
+            ms_copy, _ = time_runs(lambda: np.ascontiguousarray(patch_view(images, (p, p), overlap, padding)),
+                                   n_warmup = 1, n_runs = args.n_runs)
+            rows.append([overlap, padding, n_patches, ms_tf if padding == 'SAME' else '', patches.nbytes / 2**20,
+                         ms_view, view_extra_mb(view, images, int((1 - overlap) * p)), ms_copy])
+
+    print_table(['overlap', 'padding', 'patches/image', 'ms tf', 'tf MB', 'ms view', 'extra MB', 'ms materialized'],
+                rows)
+
+    print()
+    plans = [[n, *plan_patch_grid(args.image_size, n)] for n in [20, 50, 70, 100, 200]]
+    ms_plan, _ = time_runs(lambda: plan_patch_grid(args.image_size, 70))
+    print_table(['target patches', 'patch size', 'patches'], plans)
+    print("plan_patch_grid: {:.3f} ms".format(ms_plan))
@@ -0,0 +1,83 @@
+import argparse
+import tempfile
+import random
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from benchmarks.common import time_runs, peak_rss_mb, print_table
+from utils.img_utils import rotate_images, pre_augment_images
+
+
+# Rotation pre-augmentation of an in-memory dataset: the previous loop of one session.run
+# per image (tf.image.rot90 fed through a placeholder, a new list of rotated copies) against
+# the NumPy engine of utils.rotation behind utils.img_utils.rotate_images, which groups the
+# images by rotation and rotates them in place. The large set is 'scale' times the small one,
+# optionally a memory mapped .npy file. 90 / 270 degree rotations need square images:
+#   python -m benchmarks.pre_augment --n_images 400 --scale 10 --image_size 512 512
+#   python -m benchmarks.pre_augment --image_size 768 1024 --angles 0 180 --memmap
+
+def session_rotate_images(images, angles):
+    # the previous utils.img_utils.rotate_images
+    X_rotate = []
+    angles = np.array(angles) / 90
+    tf.reset_default_graph()
+    X = tf.placeholder(tf.as_dtype(images.dtype), shape = (images.shape[1], images.shape[2], 3))
+    k = tf.placeholder(tf.int32)
+    tf_img = tf.image.rot90(X, k = k)
+    with tf.Session() as sess:
+        for img in images:
+            X_rotate.append(sess.run(tf_img, feed_dict = {X: img, k: random.choice(angles)}))
+    return np.array(X_rotate, dtype = images.dtype)
+
+
+def synthetic_images(n_images, h, w, path = None, seed = 1):
+    shape = (n_images, h, w, 3)
+    if (path is None):
+        images = np.empty(shape, dtype = np.uint8)
+    else:
+        images = np.lib.format.open_memmap(path, mode = 'w+', dtype = np.uint8, shape = shape)
+    rng = np.random.RandomState(seed)
+    for start in range(0, n_images, 100):
+        stop = min(start + 100, n_images)
+        images[start:stop] = rng.randint(0, 256, size = (stop - start, h, w, 3), dtype = np.uint8)
+    return images
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Vectorized rotation pre-augmentation')
+    argparser.add_argument('--n_images', type=int, default=400)
+    argparser.add_argument('--scale', type=int, default=10)
+    argparser.add_argument('--image_size', type=int, nargs=2, default=[512, 512])
+    argparser.add_argument('--angles', type=int, nargs='+', default=[0, 90, 180, 270])
+    argparser.add_argument('--free_angles', type=float, nargs='+', default=[-10, -5, 5, 10],
+                           help='angles of the arbitrary angle rotation (pre_augment_images), on a subset')
+    argparser.add_argument('--memmap', action='store_true', help='memory map the large set (.npy in a temp dir)')
+    argparser.add_argument('--skip_session', action='store_true', help='do not time the session loop')
+    argparser.add_argument('--n_runs', type=int, default=3)
+    args = argparser.parse_args()
+
+    h, w = args.image_size
+    directory = tempfile.mkdtemp()
+    rows = []
+    for n_images in [args.n_images, args.n_images * args.scale]:
+        path = os.path.join(directory, 'images.npy') if (args.memmap and n_images > args.n_images) else None
+        images = synthetic_images(n_images, h, w, path)
+        dataset_mb = images.nbytes / 2**20
+
+        ms_session = ''
+        if (not args.skip_session and n_images == args.n_images):
+            ms_session, _ = time_runs(lambda: session_rotate_images(images, args.angles), n_warmup = 0,
+                                      n_runs = 1)
+        ms_numpy, _ = time_runs(lambda: rotate_images(images, args.angles), n_warmup = 0, n_runs = args.n_runs)
+        subset = images[:min(n_images, 50)]
+        ms_free, _ = time_runs(lambda: pre_augment_images(subset, args.free_angles), n_warmup = 0,
+                               n_runs = args.n_runs)
+        rows.append([n_images, dataset_mb, 'yes' if path else 'no', ms_session and ms_session / 1000,
+                     ms_numpy / 1000, n_images / (ms_numpy / 1000), subset.shape[0] / (ms_free / 1000),
+                     peak_rss_mb()])
+        del images, subset
+
+    print_table(['images', 'dataset MB', 'memmap', 'session (s)', 'numpy (s)', 'numpy img/s', 'free angle img/s',
+                 'peak RSS (MB)'], rows)
@@ -0,0 +1,64 @@
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.common import print_table
+from benchmarks.image_cache import synthetic_pngs
+from utils.img_utils import get_images_pathlist_labels
+from utils.bag_producer import BagProducer
+
+from config import Config
+
+
+# Scaling of the process-pool bag producer of ProcessPoolLoader (PIL decode, patching, resize
+# and rotation in NumPy, written into a shared-memory ring) with the number of worker
+# processes. The consumer copies the batches out of the slots like the training dataset does, so the
+# rate is the one the producer can sustain for the model:
+#   python -m benchmarks.process_pool --workers 1 2 4 8 16 32
+#   python -m benchmarks.process_pool --synthetic --n_images 64
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Process-pool bag producer scaling')
+    argparser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    argparser.add_argument('--n_batches', type=int, default=50)
+    argparser.add_argument('--n_images', type=int, default=80)
+    argparser.add_argument('--synthetic', action='store_true', help='synthetic PNGs instead of the dataset')
+    argparser.add_argument('--image_size', type=int, nargs=2, default=[Config.image_h, Config.image_w])
+    argparser.add_argument('--scheme', default=Config.patch_generation_scheme)
+    argparser.add_argument('--slots', type=int, default=Config.producer_slots)
+    args = argparser.parse_args()
+
+    if (args.synthetic):
+        paths = synthetic_pngs(tempfile.mkdtemp(), args.n_images, *args.image_size)
+    else:
+        paths = list(get_images_pathlist_labels()[0][:args.n_images])
+    n = len(paths)
+    params = {'batch_size': Config.batch_size, 'patch_size': Config.patch_size, 'n_patches': Config.n_random_patches,
+              'scheme': args.scheme, 'overlap': Config.patches_overlap, 'size': 227, 'n_times_90': 0,
+              'random_rotation': Config.random_rotation_patches, 'rotation': Config.patch_rotation,
+              'residual_angle': Config.patch_rotation_residual, 'interpolation': Config.interpolation,
+              'mode': Config.mode}
+
+    rows = []
+    for workers in args.workers:
+        producer = BagProducer(paths, np.zeros(n, dtype=np.int64), np.arange(n), params,
+                               (*args.image_size, 3), n_workers = workers, n_slots = max(args.slots, workers))
+        batches = producer.batches()
+        # the first batches include the worker start up
+        for _ in range(min(workers, 4)):
+            next(batches)
+        n_patches = 0
+        start = time.perf_counter()
+        for _ in range(args.n_batches):
+            n_patches += next(batches)[0].shape[0]
+        seconds = time.perf_counter() - start
+        ring_mb = producer.ring.nbytes / 2**20
+        batches.close()
+        producer.close()
+        rows.append([workers, args.n_batches / seconds, n_patches / seconds, ring_mb])
+
+    for row in rows:
+        row.append(row[1] / rows[0][1])
+    print_table(['workers', 'batches/s', 'patches/s', 'ring MB', 'speed-up'], rows)
@@ -0,0 +1,110 @@
+import argparse
+import logging
+import time
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from benchmarks.common import cpu_session_config, print_table
+from dataloaders.PlaceholderLoader import PlaceholderLoader
+from utils.img_utils import get_images_pathlist_labels, split_train_val
+from utils.numpy_ops import extract_patches_numpy, mi_pool_numpy, dense_numpy
+from utils.quantization import calibration_patches, backbone_graph_def, head_weights, convert_to_tflite, TFLiteBackbone
+from run import create_model
+
+from config import Config
+
+
+# Bag-level accuracy and CPU latency of int8 TFLite backbones against float32 for the
+# MI models, evaluated on the validation split used by DatasetFileLoader
+
+def load_val_bags(config, n_images = None):
+    _, _, _, val_images, val_labels, _ = split_train_val(*get_images_pathlist_labels(),
+                                                         ratio = config.train_val_split,
+                                                         pre_shuffle = True)
+    if (n_images is not None):
+        val_images, val_labels = val_images[:n_images], val_labels[:n_images]
+
+    p = config.patch_size
+    for path, label in zip(val_images, val_labels):
+        image = np.asarray(Image.open(path).convert('RGB'))
+        patches = extract_patches_numpy(image, size=(p, p), overlap = config.patches_overlap)
+        if (p != 227):
+            patches = np.stack([np.asarray(Image.fromarray(x).resize((227, 227), Image.BILINEAR)) for x in patches])
+        yield patches.astype(np.float32), label
+
+
+def bag_prediction(embeddings, heads, pooling):
+    if (heads['logits_mi'] is not None):
+        pooled = mi_pool_numpy(embeddings, np.zeros(embeddings.shape[0], dtype=np.int64), pooling)
+        return int(np.argmax(dense_numpy(pooled, *heads['logits_mi']), axis=-1)[0])
+    # SI only models: majority vote over the patches
+    votes = np.argmax(dense_numpy(embeddings, *heads['logits_si']), axis=-1)
+    return int(np.bincount(votes).argmax())
+
+
+def evaluate_backbone(model_type, checkpoint_dir, calibration, bags, threads):
+    Config.model_type = model_type
+    Config.checkpoint_dir = checkpoint_dir
+
+    tf.reset_default_graph()
+    data_loader = PlaceholderLoader(Config)
+    model = create_model(data_loader, Config)
+    with tf.Session(config=cpu_session_config(threads)) as sess:
+        sess.run(tf.global_variables_initializer())
+        model.load(sess)
+        graph_def, input_name, output_name = backbone_graph_def(sess, data_loader, model)
+        heads = {'logits_mi': head_weights(sess, 'logits_mi'), 'logits_si': head_weights(sess, 'logits_si')}
+
+    int8_model = convert_to_tflite(graph_def, input_name, output_name, calibration_images = calibration)
+    int8_backbone = TFLiteBackbone(model_content = int8_model, num_threads = threads)
+
+    results = {'float32': [], 'int8': []}
+    times = {'float32': [], 'int8': []}
+    labels = []
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        x = graph.get_tensor_by_name(input_name + ':0')
+        embedding = graph.get_tensor_by_name(output_name + ':0')
+        with tf.Session(graph=graph, config=cpu_session_config(threads)) as sess:
+            float_backbone = lambda images: sess.run(embedding, feed_dict={x: images})
+            for patches, label in bags:
+                labels.append(label)
+                for name, backbone in [('float32', float_backbone), ('int8', int8_backbone.predict)]:
+                    start = time.perf_counter()
+                    embeddings = backbone(patches)
+                    times[name].append((time.perf_counter() - start) * 1000)
+                    results[name].append(bag_prediction(embeddings, heads, Config.pooling))
+
+    labels = np.asarray(labels)
+    acc = {k: float(np.mean(np.asarray(v) == labels)) for k, v in results.items()}
+    # the first bag includes allocation and warm-up
+    ms = {k: float(np.mean(v[1:] if len(v) > 1 else v)) for k, v in times.items()}
+    agreement = float(np.mean(np.asarray(results['float32']) == np.asarray(results['int8'])))
+
+    return [model_type, len(labels), acc['float32'], acc['int8'], acc['float32'] - acc['int8'],
+            agreement, ms['float32'], ms['int8'], ms['float32'] / ms['int8'], len(int8_model) / 2**20]
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='int8 post-training quantization evaluation')
+    argparser.add_argument('--resnet18_checkpoint', default=Config.checkpoint_dir)
+    argparser.add_argument('--resnet50_checkpoint', default=Config.checkpoint_dir)
+    argparser.add_argument('--calibration_batches', type=int, default=10,
+                           help='Training batches of patches used to calibrate activation ranges')
+    argparser.add_argument('--n_val_images', type=int, default=None)
+    argparser.add_argument('--threads', type=int, default=4)
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    calibration = calibration_patches(Config, n_batches = args.calibration_batches)
+
+    rows = []
+    for model_type, checkpoint_dir in [('ResNet18', args.resnet18_checkpoint), ('ResNet50', args.resnet50_checkpoint)]:
+        bags = load_val_bags(Config, args.n_val_images)
+        rows.append(evaluate_backbone(model_type, checkpoint_dir, calibration, bags, args.threads))
+
+    print_table(['backbone', 'bags', 'acc fp32', 'acc int8', 'acc drop', 'agreement',
+                 'ms/bag fp32', 'ms/bag int8', 'speedup', 'int8 MB'], rows)
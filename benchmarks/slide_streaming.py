@@ -0,0 +1,67 @@
+import argparse
+import subprocess
+import resource
+import tempfile
+import json
+import time
+import sys
+import os
+
+import numpy as np
+
+from utils.slide_tiler import SlideTileReader, predict_slide, write_synthetic_slide
+
+
+# Peak RSS and tiles/s of the streaming whole-slide tiler against the slide size, on
+# synthetic pyramidal tiled TIFFs written by write_synthetic_slide. Each slide is read in
+# its own process so that peak RSS is per slide. The backbone is replaced by a fixed random
+# projection of the tile colour statistics, so the numbers are those of reading, decoding
+# and online pooling (predict_slide.py runs the same loop with the real model):
+#   python -m benchmarks.slide_streaming --sizes 8192 16384 32768 65536
+
+def stand_in_embed(dim = 512, seed = 1):
+    projection = np.random.RandomState(seed).randn(6, dim).astype(np.float32)
+    def embed(tiles):
+        x = tiles.reshape(tiles.shape[0], -1, tiles.shape[-1]).astype(np.float32)
+        return np.concatenate([x.mean(axis=1), x.std(axis=1)], axis=1) @ projection
+    return embed
+
+
+def worker(args):
+    reader = SlideTileReader(args.slide, read_ahead = args.read_ahead, num_workers = args.workers)
+    rng = np.random.RandomState(0)
+    heads = {'logits_mi': (rng.randn(512, 4).astype(np.float32), np.zeros(4, dtype=np.float32))}
+    start = time.perf_counter()
+    _, n_tiles = predict_slide(reader, stand_in_embed(), heads, batch_size = args.batch_size)
+    seconds = time.perf_counter() - start
+    print(json.dumps({'tiles': n_tiles, 'tiles_per_s': n_tiles / seconds,
+                      'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Streaming whole-slide tiler benchmark')
+    argparser.add_argument('--sizes', type=int, nargs='+', default=[8192, 16384, 32768], help='Slide side in pixels')
+    argparser.add_argument('--read_ahead', type=int, default=16)
+    argparser.add_argument('--workers', type=int, default=4)
+    argparser.add_argument('--batch_size', type=int, default=64)
+    argparser.add_argument('--keep', default=None, help='Directory to keep the synthetic slides in')
+    argparser.add_argument('--slide', default=None, help=argparse.SUPPRESS)
+    args = argparser.parse_args()
+
+    if (args.slide is not None):
+        worker(args)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = args.keep or directory
+        print("side (px)  file (MB)  tiles    tiles/s  peak RSS (MB)")
+        for size in args.sizes:
+            path = os.path.join(directory, 'synthetic_{}.tif'.format(size))
+            if (not os.path.exists(path)):
+                write_synthetic_slide(path, size, size)
+            cmd = [sys.executable, '-m', 'benchmarks.slide_streaming', '--slide', path,
+                   '--read_ahead', str(args.read_ahead), '--workers', str(args.workers),
+                   '--batch_size', str(args.batch_size)]
+            r = json.loads(subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout.decode().strip().splitlines()[-1])
+            print("{:<10} {:>9.0f}  {:>7}  {:>7.0f}  {:>13.0f}".format(size, os.path.getsize(path) / 2**20, r['tiles'],
+                                                                      r['tiles_per_s'], r['peak_rss_mb']))
@@ -0,0 +1,51 @@
+import argparse
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.common import print_table
+from benchmarks.image_cache import synthetic_pngs
+from utils.stain_norm import estimate, normalize, dataset_target, normalize_dataset
+
+
+# Pixels per second of the offline stain normalization (build_stain_normalized.py) on
+# synthetic PNGs: the normalization of one decoded image by chunk size, then the whole
+# dataset stage (decode, estimate, normalize, encode) by number of worker processes:
+#   python -m benchmarks.stain_norm --n_images 32 --workers 1 2 4 8
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Stain normalization throughput')
+    argparser.add_argument('--n_images', type=int, default=32)
+    argparser.add_argument('--image_size', type=int, nargs=2, default=[1536, 2048])
+    argparser.add_argument('--chunks', type=int, nargs='+', default=[2**16, 2**18, 2**20, 2**22])
+    argparser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    argparser.add_argument('--downsample', type=int, default=8)
+    args = argparser.parse_args()
+
+    paths = synthetic_pngs(tempfile.mkdtemp(), args.n_images, *args.image_size)
+    image = np.asarray(Image.open(paths[0]).convert('RGB'))
+    n_pixels = image.shape[0] * image.shape[1]
+
+    rows = []
+    for method in ['macenko', 'reinhard']:
+        target = dataset_target(paths[:4], method, args.downsample)
+        start = time.perf_counter()
+        params = estimate(image, method, args.downsample)
+        estimate_ms = (time.perf_counter() - start) * 1000
+        for chunk_pixels in args.chunks:
+            start = time.perf_counter()
+            normalize(image, method, params, target, chunk_pixels)
+            rows.append([method, chunk_pixels, estimate_ms, n_pixels / (time.perf_counter() - start) / 1e6])
+    print_table(['method', 'chunk pixels', 'estimate (ms)', 'normalize Mpx/s'], rows)
+
+    rows = []
+    for method in ['macenko', 'reinhard']:
+        target = dataset_target(paths[:4], method, args.downsample)
+        for workers in args.workers:
+            stats = normalize_dataset(paths, tempfile.mkdtemp(), method, target, downsample = args.downsample,
+                                      num_workers = workers)
+            rows.append([method, workers, stats['pixels'] / stats['seconds'] / 1e6,
+                         stats['pixels'] / stats['normalize_seconds'] / 1e6])
+    print_table(['method', 'workers', 'stage Mpx/s', 'normalize Mpx/s per worker'], rows)
@@ -0,0 +1,106 @@
+import time
+START = time.perf_counter()
+
+import argparse
+import subprocess
+import resource
+import json
+import sys
+import os
+
+import numpy as np
+
+
+# Cold start, peak RSS and images/s of the TFLite bag runner against the TF session path
+# Each path runs in its own process (so RSS and import cost are isolated):
+#   python -m benchmarks.tflite_deploy --model_dir checkpoints/tflite
+# Only numpy is imported at module level, tensorflow is imported by the TF path only
+
+def synthetic_images(n, h = 1536, w = 2048, seed = 1):
+    rng = np.random.RandomState(seed)
+    return [rng.randint(0, 256, size=(h, w, 3), dtype=np.uint8) for _ in range(n)]
+
+
+def run_tflite(model_dir, images, workers, threads):
+    from utils.tflite_runner import TFLiteBagRunner
+    runner = TFLiteBagRunner(model_dir, num_workers = workers, threads_per_worker = threads)
+    runner.predict(images[:1])
+    cold_start = time.perf_counter() - START
+
+    start = time.perf_counter()
+    runner.predict(images)
+    elapsed = time.perf_counter() - start
+    runner.close()
+    return cold_start, elapsed
+
+
+def run_tf(model_dir, images, workers, threads):
+    import tensorflow as tf
+    from utils.graph_utils import load_graph_def
+    from utils.numpy_ops import extract_patches_numpy
+
+    with open(os.path.join(model_dir, 'metadata.json')) as f:
+        metadata = json.load(f)
+    graph_info = metadata['tf_graph']
+    p = metadata['patch_size']
+
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(load_graph_def(os.path.join(model_dir, graph_info['path'])), name='')
+    x = graph.get_tensor_by_name(graph_info['inputs'][0] + ':0')
+    bi = graph.get_tensor_by_name(graph_info['inputs'][1] + ':0')
+    out = graph.get_tensor_by_name(graph_info['outputs'][0] + ':0')
+    sess = tf.Session(graph=graph, config=tf.ConfigProto(device_count = {'GPU': 0},
+                                                         intra_op_parallelism_threads = workers * threads))
+
+    def predict(image):
+        patches = extract_patches_numpy(image, size=(p, p), overlap = metadata['patches_overlap']).astype(np.float32)
+        return sess.run(out, feed_dict={x: patches, bi: np.zeros(patches.shape[0], dtype=np.int64)})
+
+    predict(images[0])
+    cold_start = time.perf_counter() - START
+
+    start = time.perf_counter()
+    for image in images:
+        predict(image)
+    elapsed = time.perf_counter() - start
+    sess.close()
+    return cold_start, elapsed
+
+
+def worker(args):
+    start = time.perf_counter()
+    images = synthetic_images(args.n_images)
+    generation = time.perf_counter() - start
+
+    run = run_tflite if args.worker == 'tflite' else run_tf
+    cold_start, elapsed = run(args.model_dir, images, args.workers, args.threads)
+    print(json.dumps({'path': args.worker,
+                      'cold_start_s': cold_start - generation,
+                      'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                      'images_per_s': len(images) / elapsed}))
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='TFLite bag runner vs TF session benchmark')
+    argparser.add_argument('--model_dir', default='checkpoints/tflite', help='Directory written by export_tflite.py')
+    argparser.add_argument('--n_images', type=int, default=8)
+    argparser.add_argument('--workers', type=int, default=4, help='Images processed concurrently')
+    argparser.add_argument('--threads', type=int, default=1, help='Threads per interpreter')
+    argparser.add_argument('--worker', choices=['tflite', 'tf'], default=None, help=argparse.SUPPRESS)
+    args = argparser.parse_args()
+
+    if (args.worker is not None):
+        worker(args)
+        sys.exit(0)
+
+    rows = []
+    for path in ['tf', 'tflite']:
+        cmd = [sys.executable, '-m', 'benchmarks.tflite_deploy', '--worker', path, '--model_dir', args.model_dir,
+               '--n_images', str(args.n_images), '--workers', str(args.workers), '--threads', str(args.threads)]
+        output = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout.decode().strip().splitlines()
+        rows.append(json.loads(output[-1]))
+
+    print("path     cold start (s)  peak RSS (MB)  images/s")
+    for r in rows:
+        print("{:<8} {:>14.2f}  {:>13.1f}  {:>8.2f}".format(r['path'], r['cold_start_s'], r['peak_rss_mb'], r['images_per_s']))
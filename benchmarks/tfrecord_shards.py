@@ -0,0 +1,76 @@
+import argparse
+import tempfile
+import time
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from benchmarks.common import cpu_session_config, print_table
+from benchmarks.image_cache import synthetic_pngs
+from utils.img_utils import get_images_pathlist_labels
+from utils.tfrecord_shards import write_shards, worker_shards, interleaved_records, parse_example
+
+
+# Decoded images per second of per-file PNG reads (the DatasetFileLoader reader, one
+# decode_png per image in a parallel map) against the sharded raw uint8 TFRecords of
+# TFRecordLoader (parallel interleaved shard readers), at 1, 4 and 16 parallel readers.
+# A local directory stands in for the shared storage, the OS page cache is warmed by a
+# first pass so both are read from memory unless the dataset exceeds it:
+#   python -m benchmarks.tfrecord_shards --n_images 80
+#   python -m benchmarks.tfrecord_shards --synthetic --n_images 64 --image_size 1536 2048
+
+def png_dataset(paths, readers):
+    return tf.data.Dataset.from_tensor_slices(np.asarray(paths)).map(
+        lambda path: tf.image.decode_png(tf.read_file(path), channels = 3), num_parallel_calls = readers)
+
+
+def tfrecord_dataset(shard_dir, readers):
+    shards, _ = worker_shards(shard_dir)
+    return interleaved_records(shards, readers).map(lambda r: parse_example(r)[0], num_parallel_calls = readers)
+
+
+def images_per_second(dataset, n_images, threads):
+    image = dataset.prefetch(4).make_initializable_iterator()
+    next_image = image.get_next()
+    with tf.Session(config=cpu_session_config(threads)) as sess:
+        for run in range(2):
+            # the first pass warms the page cache
+            sess.run(image.initializer)
+            start = time.perf_counter()
+            for _ in range(n_images):
+                sess.run(next_image)
+            seconds = time.perf_counter() - start
+    return n_images / seconds
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Sharded TFRecords against per-file PNG reads')
+    argparser.add_argument('--n_images', type=int, default=80)
+    argparser.add_argument('--synthetic', action='store_true', help='synthetic PNGs instead of the dataset')
+    argparser.add_argument('--image_size', type=int, nargs=2, default=[1536, 2048])
+    argparser.add_argument('--n_shards', type=int, default=16)
+    argparser.add_argument('--readers', type=int, nargs='+', default=[1, 4, 16])
+    argparser.add_argument('--threads', type=int, default=0)
+    args = argparser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    if (args.synthetic):
+        paths = synthetic_pngs(directory, args.n_images, *args.image_size)
+    else:
+        paths = get_images_pathlist_labels()[0][:args.n_images]
+    n = len(paths)
+    shard_dir = os.path.join(directory, 'shards')
+    write_shards(paths, np.zeros(n, dtype=np.int64), np.arange(n), shard_dir, n_shards = args.n_shards,
+                 num_workers = 4)
+    png_mb = sum(os.path.getsize(p) for p in paths) / 2**20
+    shard_mb = sum(os.path.getsize(os.path.join(shard_dir, f)) for f in os.listdir(shard_dir)) / 2**20
+    print("{} images, PNG {:.0f} MB, shards {:.0f} MB".format(n, png_mb, shard_mb))
+
+    rows = []
+    for readers in args.readers:
+        for source, dataset in [('png', png_dataset(paths, readers)), ('tfrecord', tfrecord_dataset(shard_dir, readers))]:
+            rate = images_per_second(dataset, n, args.threads)
+            rows.append([readers, source, rate, rate * (png_mb if source == 'png' else shard_mb) / n])
+
+    print_table(['readers', 'source', 'images/s', 'MB/s read'], rows)
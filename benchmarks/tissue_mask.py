@@ -0,0 +1,86 @@
+import argparse
+import logging
+import time
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from benchmarks.common import cpu_session_config, print_table
+from benchmarks.quantization_eval import bag_prediction
+from dataloaders.PlaceholderLoader import PlaceholderLoader
+from utils.img_utils import get_images_pathlist_labels, split_train_val
+from utils.numpy_ops import extract_patches_numpy
+from utils.quantization import backbone_graph_def, head_weights
+from utils.tissue_mask import TissueIndex
+from run import create_model
+
+from config import Config
+
+
+# Backbone compute saved by skipping background tiles and its effect on bag accuracy,
+# for the trained model in Config.checkpoint_dir on the validation split of DatasetFileLoader
+# Requires the index of build_tissue_index.py. Each validation bag is classified with all
+# sequential tiles and with the tiles above each tissue threshold only:
+#   python -m benchmarks.tissue_mask --thresholds 0.25 0.5 0.75
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Tissue mask compute savings and bag accuracy')
+    argparser.add_argument('--thresholds', type=float, nargs='+', default=[0.25, 0.5, 0.75])
+    argparser.add_argument('--n_val_images', type=int, default=None)
+    argparser.add_argument('--threads', type=int, default=4)
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    index = TissueIndex.load(Config.tissue_index_path)
+    index.check(Config.patch_size, Config.patches_overlap)
+    _, _, _, val_images, val_labels, _ = split_train_val(*get_images_pathlist_labels(),
+                                                         ratio = Config.train_val_split,
+                                                         pre_shuffle = True)
+    if (args.n_val_images is not None):
+        val_images, val_labels = val_images[:args.n_val_images], val_labels[:args.n_val_images]
+
+    tf.reset_default_graph()
+    data_loader = PlaceholderLoader(Config)
+    model = create_model(data_loader, Config)
+    with tf.Session(config=cpu_session_config(args.threads)) as sess:
+        sess.run(tf.global_variables_initializer())
+        model.load(sess)
+        graph_def, input_name, output_name = backbone_graph_def(sess, data_loader, model)
+        heads = {'logits_mi': head_weights(sess, 'logits_mi'), 'logits_si': head_weights(sess, 'logits_si')}
+
+    p = Config.patch_size
+    thresholds = [0.0] + args.thresholds
+    predictions = {t: [] for t in thresholds}
+    kept = {t: 0 for t in thresholds}
+    seconds = {t: 0.0 for t in thresholds}
+
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        x = graph.get_tensor_by_name(input_name + ':0')
+        embedding = graph.get_tensor_by_name(output_name + ':0')
+        with tf.Session(graph=graph, config=cpu_session_config(args.threads)) as sess:
+            for path, label in zip(val_images, val_labels):
+                image = np.asarray(Image.open(path).convert('RGB'))
+                patches = extract_patches_numpy(image, size=(p, p), overlap = Config.patches_overlap)
+                if (p != 227):
+                    patches = np.stack([np.asarray(Image.fromarray(z).resize((227, 227), Image.BILINEAR))
+                                        for z in patches])
+                patches = patches.astype(np.float32)
+
+                for t in thresholds:
+                    keep = index.keep_tiles([path], t)[0]
+                    start = time.perf_counter()
+                    embeddings = sess.run(embedding, feed_dict={x: patches[keep]})
+                    seconds[t] += time.perf_counter() - start
+                    kept[t] += int(keep.sum())
+                    predictions[t].append(bag_prediction(embeddings, heads, Config.pooling))
+
+    labels = np.asarray(val_labels)
+    total = kept[0.0]
+    rows = [[t, kept[t] / len(labels), 1 - kept[t] / total, 1 - seconds[t] / seconds[0.0],
+             float(np.mean(np.asarray(predictions[t]) == labels)),
+             float(np.mean(np.asarray(predictions[t]) == labels) - np.mean(np.asarray(predictions[0.0]) == labels))]
+            for t in thresholds]
+    print_table(['threshold', 'tiles/bag', 'tiles skipped', 'time saved', 'bag acc', 'acc change'], rows)
@@ -0,0 +1,63 @@
+import argparse
+import subprocess
+import json
+import time
+import sys
+
+import tensorflow as tf
+
+from benchmarks.common import cpu_session_config, peak_rss_mb, print_table
+from dataloaders.DatasetFileLoader import DatasetFileLoader
+
+from config import Config
+
+
+# Memory and throughput of the DatasetFileLoader training pipeline with uint8 patches up to
+# the model input (Config.pipeline_dtype = 'uint8', cast and normalized in the graph by
+# BaseModel.input_layer) against the previous float32 cast before prefetch. Each dtype runs
+# in its own process so that peak RSS is per pipeline. Requires the dataset:
+#   python -m benchmarks.uint8_pipeline --n_batches 50
+
+TRAIN_PREFETCH = 10
+
+
+def worker(args):
+    Config.pipeline_dtype = args.dtype
+    Config.patch_generation_scheme = args.scheme
+    data_loader = DatasetFileLoader(Config)
+    x, _, _, _ = data_loader.get_input()
+    with tf.Session(config=cpu_session_config(args.threads)) as sess:
+        data_loader.initialize(sess, train = True)
+        # let the prefetch buffer fill before timing
+        batch_bytes = sess.run(x).nbytes
+        time.sleep(2)
+        n_patches = 0
+        start = time.perf_counter()
+        for _ in range(args.n_batches):
+            n_patches += sess.run(x).shape[0]
+        seconds = time.perf_counter() - start
+    print(json.dumps({'batch_mb': batch_bytes / 2**20, 'bags_per_s': args.n_batches * Config.batch_size / seconds,
+                      'patches_per_s': n_patches / seconds, 'peak_rss_mb': peak_rss_mb()}))
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='uint8 against float32 input pipeline')
+    argparser.add_argument('--n_batches', type=int, default=50)
+    argparser.add_argument('--scheme', default=Config.patch_generation_scheme)
+    argparser.add_argument('--threads', type=int, default=Config.num_parallel_cores)
+    argparser.add_argument('--dtype', default=None, help=argparse.SUPPRESS)
+    args = argparser.parse_args()
+
+    if (args.dtype is not None):
+        worker(args)
+        sys.exit(0)
+
+    rows = []
+    for dtype in ['float32', 'uint8']:
+        cmd = [sys.executable, '-m', 'benchmarks.uint8_pipeline', '--dtype', dtype, '--n_batches', str(args.n_batches),
+               '--scheme', args.scheme, '--threads', str(args.threads)]
+        r = json.loads(subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout.decode().strip().splitlines()[-1])
+        rows.append([dtype, r['batch_mb'], r['batch_mb'] * TRAIN_PREFETCH, r['bags_per_s'], r['patches_per_s'],
+                     r['peak_rss_mb']])
+
+    print_table(['pipeline', 'MB/batch', 'prefetch MB', 'bags/s', 'patches/s', 'peak RSS (MB)'], rows)
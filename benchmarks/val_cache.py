@@ -0,0 +1,59 @@
+import argparse
+import subprocess
+import tempfile
+import json
+import time
+import sys
+
+import tensorflow as tf
+
+from benchmarks.common import cpu_session_config, peak_rss_mb, print_table
+from dataloaders.DatasetFileLoader import DatasetFileLoader
+
+from config import Config
+
+
+# Validation epoch time of DatasetFileLoader without the validation cache (every epoch reads,
+# decodes, tiles and resizes the validation images) and with it in memory or on disk
+# (Config.val_cache). The first cached epoch includes filling the cache. Each setting runs in
+# its own process with an empty cache directory. Requires the dataset:
+#   python -m benchmarks.val_cache --n_epochs 3
+
+def worker(args):
+    Config.val_cache = args.cache
+    Config.val_cache_dir = tempfile.mkdtemp()
+    data_loader = DatasetFileLoader(Config)
+    x, _, _, _ = data_loader.get_input()
+    epochs = []
+    with tf.Session(config=cpu_session_config(args.threads)) as sess:
+        for _ in range(args.n_epochs):
+            start = time.perf_counter()
+            data_loader.initialize(sess, train = False)
+            for _ in range(data_loader.num_iterations_val):
+                sess.run(x)
+            epochs.append(time.perf_counter() - start)
+    cache_mb = data_loader.val_cache.nbytes / 2**20 if data_loader.val_cache is not None else 0
+    print(json.dumps({'epochs_s': epochs, 'cache_mb': cache_mb, 'peak_rss_mb': peak_rss_mb()}))
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Validation cache of DatasetFileLoader')
+    argparser.add_argument('--n_epochs', type=int, default=3)
+    argparser.add_argument('--threads', type=int, default=Config.num_parallel_cores)
+    argparser.add_argument('--cache', default=None, help=argparse.SUPPRESS)
+    args = argparser.parse_args()
+
+    if (args.cache is not None):
+        worker(args)
+        sys.exit(0)
+
+    rows = []
+    for cache in ['none', 'memory', 'disk']:
+        cmd = [sys.executable, '-m', 'benchmarks.val_cache', '--cache', cache, '--n_epochs', str(args.n_epochs),
+               '--threads', str(args.threads)]
+        r = json.loads(subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout.decode().strip().splitlines()[-1])
+        later = r['epochs_s'][1:] or r['epochs_s']
+        rows.append([cache, r['epochs_s'][0], sum(later) / len(later), sum(r['epochs_s']), r['cache_mb'],
+                     r['peak_rss_mb']])
+
+    print_table(['val cache', 'epoch 1 (s)', 'later epochs (s)', 'total (s)', 'cache MB', 'peak RSS (MB)'], rows)
@@ -0,0 +1,39 @@
+import argparse
+import logging
+import pprint
+
+from extract_embeddings import extract_features
+from utils.activation_cache import ActivationCacheWriter, cache_disk_bytes
+
+from config import Config
+
+
+# run this script from the root directory to cache the activations of the trained ResNet18
+# backbone in Config.checkpoint_dir at the end of stage Config.freeze_until, for every
+# un-augmented sequential patch, into Config.activation_cache_dir
+
+def build_activation_cache(config, chunk_size = 64):
+    if (config.freeze_until == 'none'):
+        raise ValueError("Config.freeze_until must name the stage to cache, e.g. 'conv3_x'")
+
+    metadata = {'model_type': config.model_type, 'checkpoint_dir': config.checkpoint_dir,
+                'stage': config.freeze_until,
+                'patch_size': config.patch_size, 'patches_overlap': config.patches_overlap}
+    make_writer = lambda n, shape: ActivationCacheWriter(config.activation_cache_dir, n, shape,
+                                                         compression = config.activation_cache_compression,
+                                                         metadata = metadata)
+    extract_features(config, lambda model: model.stage_outputs[config.freeze_until], make_writer, chunk_size)
+
+    size = cache_disk_bytes(config.activation_cache_dir)
+    logging.info(f"Activation cache written to: {pprint.pformat(config.activation_cache_dir)}")
+    logging.info(f"Activation cache disk size (MB): {pprint.pformat(size / 2**20)}")
+    return size
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Cache backbone activations at a block boundary')
+    argparser.add_argument('--chunk_size', type=int, default=64, help='Patches per forward pass')
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+    build_activation_cache(Config, args.chunk_size)
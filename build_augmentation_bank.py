@@ -0,0 +1,81 @@
+import argparse
+import logging
+import pprint
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from dataloaders.DatasetFileLoader import DatasetFileLoader
+from utils.augmentation_bank import AugmentationBankWriter
+from utils.img_utils import get_images_pathlist_labels, split_train_val
+
+from config import Config
+
+
+# run this script from the root directory to precompute Config.augmentation_bank_variants
+# augmented bags per training image into Config.augmentation_bank_dir (AugmentationBankLoader).
+# The bags come from the DatasetFileLoader training pipeline itself (crops, color jitter,
+# rotation as configured), run until every image has K of them
+
+def build_augmentation_bank(config, bank_dir, n_variants, threads = 0):
+    data_loader = DatasetFileLoader(config)
+    x, _, _, bi = data_loader.get_input()
+
+    # the training split of the loader
+    if (config.train_on_subset):
+        images_labels = get_images_pathlist_labels(n = int(config.subset_size/4))
+    else:
+        images_labels = get_images_pathlist_labels()
+    paths, labels, bag_index, _, _, _ = split_train_val(*images_labels, ratio = config.train_val_split,
+                                                        pre_shuffle = True)
+
+    writer = None
+    n_bags = 0
+    session_config = tf.ConfigProto(intra_op_parallelism_threads = threads, inter_op_parallelism_threads = threads)
+    with tf.Session(config = session_config) as sess:
+        data_loader.initialize(sess, train = True)
+        while (writer is None or not writer.complete):
+            images, batch_bi = sess.run([x, bi])
+            # batch_size bags of contiguous patches, the same number per bag
+            bags = np.split(images, config.batch_size)
+            if (writer is None):
+                writer = AugmentationBankWriter(bank_dir, paths, labels, bag_index, n_variants, bags[0].shape,
+                                                metadata = augmentation_params(config))
+            for bag_bi, bag in zip(batch_bi[::bags[0].shape[0]], bags):
+                writer.add(bag_bi, bag)
+            n_bags += len(bags)
+    writer.close()
+    return n_bags
+
+
+def augmentation_params(config):
+    # everything the stored bags depend on, checked against the Config by AugmentationBankLoader
+    return {'train_on_subset': config.train_on_subset, 'subset_size': config.subset_size,
+            'train_val_split': config.train_val_split,
+            'patch_size': config.patch_size, 'n_random_patches': config.n_random_patches,
+            'patch_generation_scheme': config.patch_generation_scheme, 'patch_rotation': config.patch_rotation,
+            'random_rotation_patches': config.random_rotation_patches, 'random_brightness': config.random_brightness,
+            'random_contrast': config.random_contrast, 'random_saturation': config.random_saturation,
+            'random_hue': config.random_hue, 'pipeline_dtype': 'uint8',
+            'patches_overlap': config.patches_overlap, 'patch_rotation_residual': config.patch_rotation_residual,
+            'interpolation': config.interpolation, 'stain_normalization': config.stain_normalization,
+            'tissue_threshold': config.tissue_threshold if config.use_tissue_mask else None}
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Precompute the augmentation bank')
+    argparser.add_argument('--variants', type=int, default=Config.augmentation_bank_variants)
+    argparser.add_argument('--out_dir', default=Config.augmentation_bank_dir)
+    argparser.add_argument('--threads', type=int, default=0)
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    # the bank is uint8 whatever the training pipeline dtype
+    Config.pipeline_dtype = 'uint8'
+    start = time.perf_counter()
+    n_bags = build_augmentation_bank(Config, args.out_dir, args.variants, args.threads)
+    logging.info(f"Augmentation bank of {pprint.pformat(args.variants)} variants written to "
+                 f"{pprint.pformat(args.out_dir)} in {pprint.pformat(time.perf_counter() - start)} s "
+                 f"({pprint.pformat(n_bags)} bags augmented)")
@@ -0,0 +1,53 @@
+import argparse
+import logging
+import pprint
+import csv
+
+import tensorflow as tf
+
+from extract_embeddings import extract_features
+from utils.hash_index import HashIndexWriter
+
+from config import Config
+
+
+# run this script from the root directory to build the retrieval index of a model trained
+# with the hashing head (Config.hash_bits > 0) in Config.checkpoint_dir:
+#   python build_hash_index.py --manifest images.csv --output data/hash_index.npz
+# The manifest is a CSV file with a 'path' column and an optional 'label' column,
+# without manifest the whole dataset is indexed. Every image gets one bag code and one
+# code per sequential patch (Config.patch_size, Config.patches_overlap)
+
+def read_manifest(manifest):
+    with open(manifest, newline='') as f:
+        rows = list(csv.DictReader(f))
+    paths = [row['path'] for row in rows]
+    labels = [int(row['label']) if row.get('label', '') != '' else -1 for row in rows]
+    return paths, labels
+
+
+def build_hash_index(config, output, manifest = None, chunk_size = 64):
+    if (config.hash_bits <= 0):
+        raise ValueError("Config.hash_bits must be > 0, the model has no hashing head")
+
+    checkpoint = tf.train.latest_checkpoint(config.checkpoint_dir)
+    if (checkpoint is None):
+        raise ValueError(f"No checkpoint found in {config.checkpoint_dir}")
+    hash_weights = (tf.train.load_variable(checkpoint, 'network/hash/weights'),
+                    tf.train.load_variable(checkpoint, 'network/hash/biases'))
+
+    paths, labels = read_manifest(manifest) if manifest is not None else (None, None)
+    make_writer = lambda n, shape: HashIndexWriter(output, hash_weights, pooling = config.pooling)
+    extract_features(config, lambda model: model.embedding, make_writer, chunk_size, paths = paths, labels = labels)
+    logging.info(f"Hash index written to: {pprint.pformat(output)}")
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Build the Hamming retrieval index of bag and patch hash codes')
+    argparser.add_argument('--manifest', default=None, help='CSV file with path (and label) columns')
+    argparser.add_argument('-o', '--output', default='data/hash_index.npz')
+    argparser.add_argument('--chunk_size', type=int, default=64, help='Patches per forward pass')
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+    build_hash_index(Config, args.output, manifest = args.manifest, chunk_size = args.chunk_size)
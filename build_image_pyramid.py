@@ -0,0 +1,31 @@
+import argparse
+import logging
+import pprint
+
+from utils.img_utils import get_images_pathlist_labels
+from utils.image_pyramid import build_image_pyramid
+from utils.stain_norm import stain_normalized_paths
+
+from config import Config
+
+
+# run this script from the root directory to write the downscaled levels
+# (Config.pyramid_levels) of every dataset image into Config.image_pyramid_dir, from the
+# stain normalized images of Config.stain_normalized_dir when Config.stain_normalization is set
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Build the multi-resolution image pyramid store')
+    argparser.add_argument('--workers', type=int, default=Config.num_parallel_cores)
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    paths, _, _ = get_images_pathlist_labels()
+    source_dir = None
+    if (Config.stain_normalization != 'none'):
+        source_dir = Config.stain_normalized_dir
+        paths = stain_normalized_paths(paths, source_dir, Config.stain_normalization)
+    build_image_pyramid(paths, Config.image_pyramid_dir, levels = Config.pyramid_levels,
+                        format = Config.pyramid_format, num_workers = args.workers,
+                        stain_normalization = Config.stain_normalization, source_dir = source_dir)
+    logging.info(f"Image pyramid written to: {pprint.pformat(Config.image_pyramid_dir)}")
@@ -0,0 +1,51 @@
+import argparse
+import logging
+import pprint
+
+import numpy as np
+from PIL import Image
+
+from utils.img_utils import get_images_pathlist_labels
+from utils.stain_norm import estimate, dataset_target, normalize_dataset
+
+from config import Config
+
+
+# run this script from the root directory to stain normalize the whole dataset once into
+# Config.stain_normalized_dir, read instead of the original PNGs with
+# Config.stain_normalization = 'macenko' or 'reinhard'. The reference is a given image, or
+# by default the standard H&E stain matrix (macenko) / the median statistics of the dataset
+# (reinhard)
+
+def main(config, method, reference = None, num_workers = 1, chunk_pixels = 2**20):
+    paths, _, _ = get_images_pathlist_labels()
+    if (reference is not None):
+        target = estimate(np.asarray(Image.open(reference).convert('RGB')), method, config.stain_estimate_downsample)
+    else:
+        target = dataset_target(paths, method, config.stain_estimate_downsample, num_workers)
+
+    stats = normalize_dataset(paths, config.stain_normalized_dir, method, target,
+                              downsample = config.stain_estimate_downsample, chunk_pixels = chunk_pixels,
+                              num_workers = num_workers)
+
+    logging.info(f"{pprint.pformat(len(paths))} images normalized ({method}) into: "
+                 f"{pprint.pformat(config.stain_normalized_dir)}")
+    logging.info(f"Throughput (decode, normalize, encode), Mpixels/s: "
+                 f"{pprint.pformat(stats['pixels'] / stats['seconds'] / 1e6)}")
+    logging.info(f"Normalization only, Mpixels/s per worker: "
+                 f"{pprint.pformat(stats['pixels'] / stats['normalize_seconds'] / 1e6)}")
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Stain normalize the dataset')
+    argparser.add_argument('--method', choices=['macenko', 'reinhard'], default='macenko')
+    argparser.add_argument('--reference', default=None, help='reference image of the target staining')
+    argparser.add_argument('--out_dir', default=None, help='Overrides Config.stain_normalized_dir')
+    argparser.add_argument('--workers', type=int, default=1)
+    argparser.add_argument('--chunk_pixels', type=int, default=2**20)
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+    if (args.out_dir is not None):
+        Config.stain_normalized_dir = args.out_dir
+    main(Config, args.method, args.reference, args.workers, args.chunk_pixels)
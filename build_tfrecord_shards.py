@@ -0,0 +1,42 @@
+import argparse
+import logging
+import pprint
+import os
+
+from utils.img_utils import get_images_pathlist_labels, split_train_val
+from utils.tfrecord_shards import write_shards, read_manifest
+
+from config import Config
+
+
+# run this script from the root directory to write the train / val splits of the dataset
+# (the PNG directories, or a CSV manifest of path,label[,bag_index]) into
+# Config.tfrecord_shards sharded TFRecord files each under Config.tfrecord_dir/train and /val,
+# the split is the one of the other loaders (Config.train_val_split, pre-shuffled)
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Write the dataset as sharded TFRecords')
+    argparser.add_argument('--manifest', default=None, help='CSV with path and label columns')
+    argparser.add_argument('--out_dir', default=Config.tfrecord_dir)
+    argparser.add_argument('--n_shards', type=int, default=Config.tfrecord_shards)
+    argparser.add_argument('--workers', type=int, default=Config.num_parallel_cores)
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    if (args.manifest is not None):
+        images_labels = read_manifest(args.manifest)
+    else:
+        images_labels = get_images_pathlist_labels()
+
+    train_images, train_labels, train_bi, val_images, val_labels, val_bi = split_train_val(
+        *images_labels,
+        ratio = Config.train_val_split,
+        pre_shuffle = True)
+
+    for split, (paths, labels, bag_index) in [('train', (train_images, train_labels, train_bi)),
+                                              ('val', (val_images, val_labels, val_bi))]:
+        write_shards(paths, labels, bag_index, os.path.join(args.out_dir, split), n_shards = args.n_shards,
+                     num_workers = args.workers)
+        logging.info(f"{split}: {pprint.pformat(len(paths))} images in {pprint.pformat(args.n_shards)} shards")
+    logging.info(f"TFRecord shards written to: {pprint.pformat(args.out_dir)}")
@@ -0,0 +1,40 @@
+import argparse
+import logging
+import pprint
+
+import numpy as np
+
+from utils.img_utils import get_images_pathlist_labels
+from utils.tissue_mask import build_tissue_index
+
+from config import Config
+
+
+# run this script from the root directory to compute the low resolution tissue masks and
+# the tissue fraction of every sequential tile (Config.patch_size, Config.patches_overlap)
+# of the dataset into Config.tissue_index_path, used with Config.use_tissue_mask = True
+
+def main(config, report_threshold = None):
+    paths, _, _ = get_images_pathlist_labels()
+    index = build_tissue_index(paths, config.patch_size, config.patches_overlap,
+                               downsample = config.tissue_mask_downsample,
+                               saturation_threshold = config.tissue_saturation_threshold)
+    index.save(config.tissue_index_path)
+
+    # the index stores fractions only, training applies Config.tissue_threshold
+    threshold = config.tissue_threshold if report_threshold is None else report_threshold
+    skipped = 1 - index.keep_tiles(paths, threshold).mean()
+    logging.info(f"Tissue index written to: {pprint.pformat(config.tissue_index_path)}")
+    logging.info(f"Mean tissue fraction of the tiles: {pprint.pformat(float(np.mean(index.tile_fractions)))}")
+    logging.info(f"Fraction of tiles below the threshold {threshold}: {pprint.pformat(skipped)}")
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Build the tissue mask index of the dataset')
+    argparser.add_argument('--report_threshold', type=float, default=None,
+                           help='threshold of the logged skipped-tile fraction only (default Config.tissue_threshold), '
+                                'not stored in the index: training uses Config.tissue_threshold')
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+    main(Config, args.report_threshold)
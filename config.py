@@ -11,7 +11,13 @@ class Config:
     
     # DataLoader parameters
     dataloader_type = 'DatasetFileLoader'
-    available_dataloader_types = {'DatasetLoader', 'DatasetFileLoader'}
+    available_dataloader_types = {'DatasetLoader', 'DatasetFileLoader', 'TFRecordLoader', 'ProcessPoolLoader',
+                                  'AugmentationBankLoader', 'ReplayLoader'}
+
+    # DatasetLoader (images in memory): how the host arrays are fed to tf.data, 'generator' and
+    # 'placeholder' keep them out of the graph, 'constant' embeds them (2GB GraphDef limit)
+    dataset_feed = 'generator'
+    available_dataset_feeds = {'generator', 'placeholder', 'constant'}
 
     # Dataset parameters
     num_classes = 4
@@ -20,6 +26,28 @@ class Config:
     image_w = 2048
     channels = 3
 
+    # Input pipeline: images and patches stay uint8 through batching and prefetch, the models
+    # cast them to float32 and normalize them at their input (BaseModel.input_layer).
+    # pipeline_dtype 'float32' casts in the loaders instead (4x the prefetch memory)
+    pipeline_dtype = 'uint8'
+    available_pipeline_dtypes = {'uint8', 'float32'}
+
+    # 'none' keeps the 0-255 pixel values, 'unit' scales to [0, 1], 'standardize' subtracts
+    # input_mean and divides by input_std (per channel, 0-255 scale, ImageNet statistics)
+    input_normalization = 'none'
+    available_input_normalizations = {'none', 'unit', 'standardize'}
+    input_mean = [123.68, 116.78, 103.94]
+    input_std = [58.40, 57.12, 57.38]
+
+    # Image pyramid (DatasetFileLoader, whole image training): downscaled copies of the images
+    # written once with build_image_pyramid.py, the level nearest to the input size is read
+    # instead of the full resolution PNG. pyramid_format 'raw' trades disk for decode time
+    use_image_pyramid = False
+    image_pyramid_dir = 'data/pyramid'
+    pyramid_levels = [1, 2, 4, 8]
+    pyramid_format = 'png'
+    available_pyramid_formats = {'png', 'raw'}
+
     # Augmentation
 
     #  This is pre-augmentation random rotations for images (applied before patching)
@@ -29,6 +57,12 @@ class Config:
     
     # Rotation for patches: If True, random roations are done on patches
     random_rotation_patches = True
+    # 'arbitrary': uniform angle in [0, 360) (interpolated, black corners), 'dihedral': one of the
+    # 8 rotations by 90 degrees / flips (index permutations), followed by a uniform residual angle
+    # in [-patch_rotation_residual, patch_rotation_residual] degrees when it is > 0
+    patch_rotation = 'arbitrary'
+    available_patch_rotations = {'arbitrary', 'dihedral'}
+    patch_rotation_residual = 0
     interpolation = 'NEAREST' 
     available_interpolation = {'NEAREST', 'BILINEAR'} 
     
@@ -58,6 +92,80 @@ class Config:
     
     n_random_patches = 20  # use this one as a generic n_patches for types 2 and 3
     random_seed = 1
+
+    # Sharded TFRecords (TFRecordLoader): the train / val splits written once with
+    # build_tfrecord_shards.py as raw uint8 pixels in tfrecord_shards files each, read by
+    # tfrecord_readers interleaved parallel readers. Worker tfrecord_worker_index of
+    # tfrecord_num_workers reads every tfrecord_num_workers-th shard (e.g. one worker per node)
+    tfrecord_dir = 'data/tfrecords'
+    tfrecord_shards = 16
+    tfrecord_readers = 4
+    tfrecord_shuffle_buffer = 16
+    tfrecord_worker_index = 0
+    tfrecord_num_workers = 1
+
+    # Recorded batches (ReplayLoader): replay_n_batches batches of the DatasetFileLoader training
+    # pipeline recorded once with record_batches.py into replay_batches_path, then replayed from
+    # memory to time the model alone
+    replay_batches_path = 'data/recorded_batches.bin'
+    replay_n_batches = 50
+
+    # Augmentation bank (AugmentationBankLoader): augmentation_bank_variants augmented bags per
+    # training image (crops, color jitter and rotation of the DatasetFileLoader pipeline)
+    # precomputed with build_augmentation_bank.py into a uint8 store, each epoch then reads one
+    # random variant per image and does no augmentation work
+    augmentation_bank_dir = 'data/augmentation_bank'
+    augmentation_bank_variants = 8
+
+    # Process-pool producer (ProcessPoolLoader): producer_workers processes decode, patch and
+    # augment the training bags in NumPy (outside of the training process GIL) into a
+    # shared-memory ring of producer_slots batch slots copied out by the training dataset
+    producer_workers = 8
+    producer_slots = 16
+
+    # Decoded image cache (DatasetFileLoader): decoded images are kept in memory up to
+    # image_cache_mb (least recently used evicted past it) and shared by the parallel readers,
+    # 0 decodes every image on every read
+    image_cache_mb = 0
+
+    # Validation cache (DatasetFileLoader): the validation batches (no augmentation, fixed tiling)
+    # are materialized in the first validation epoch and replayed in the following ones.
+    # 'auto' keeps them in memory up to val_cache_budget_mb and spills them to val_cache_dir past
+    # it, the cache is keyed on the patch size, overlap, resize target, ... of the batches
+    val_cache = 'auto'
+    available_val_caches = {'none', 'memory', 'disk', 'auto'}
+    val_cache_dir = 'data/val_cache'
+    val_cache_budget_mb = 2048
+
+    # Stain normalization (DatasetFileLoader, ProcessPoolLoader): the images are normalized once
+    # with build_stain_normalized.py ('macenko' or 'reinhard', stain parameters estimated per
+    # image on a 1/stain_estimate_downsample subsampling) into stain_normalized_dir, which is
+    # then read instead of the original PNGs. 'none' reads the originals
+    stain_normalization = 'none'
+    available_stain_normalizations = {'none', 'macenko', 'reinhard'}
+    stain_normalized_dir = 'data/stain_normalized'
+    stain_estimate_downsample = 8
+
+    # Preprocessing cache: with use_preprocess_cache, run.py looks up the enabled offline stages
+    # (stain normalization, image pyramid, tissue index) in preprocess_cache_dir by the content
+    # of the images, the stage parameters and the stage code, builds the missing ones and points
+    # the loaders at them, so runs and experiments with the same stage settings share them.
+    # Least recently used entries are evicted past preprocess_cache_mb (manage_preprocess_cache.py),
+    # except those used within preprocess_cache_lease_hours (in use by a concurrent run, keep it
+    # above the longest training run)
+    use_preprocess_cache = False
+    preprocess_cache_dir = 'data/preprocess_cache'
+    preprocess_cache_mb = 20480
+    preprocess_cache_lease_hours = 48
+
+    # Tissue masks (DatasetFileLoader): build the index once with build_tissue_index.py,
+    # sequential tiles with a tissue fraction below tissue_threshold are then skipped and
+    # random crops are drawn among positions above it
+    use_tissue_mask = False
+    tissue_index_path = 'data/tissue_index.npz'
+    tissue_threshold = 0.5
+    tissue_mask_downsample = 16
+    tissue_saturation_threshold = 0.07
     
     
     # Training parameters
@@ -76,6 +184,35 @@ class Config:
     pooling = 'average'
     available_pooling_functions = {'average', 'max', 'lse'}
 
+    # Multi-magnification bags (MultiScaleLoader): instances are patches at these image
+    # pyramid levels (1 = full resolution, 2 = 1/2, ...) around the same centres, pooled per
+    # scale then fused with scale_fusion ('concat' of the per-scale vectors, 'average' or 'max').
+    # Empty for single scale bags. Requires the pyramid of build_image_pyramid.py
+    multi_scale_levels = []
+    scale_fusion = 'concat'
+    available_scale_fusions = {'concat', 'average', 'max'}
+
+    # Head-only training: the MI / SI heads are trained on patch embeddings extracted once
+    # with extract_embeddings.py from a trained backbone (see EmbeddingLoader and MIHead)
+    train_head_only = False
+    embedding_store_dir = 'data/embeddings'
+    embedding_dtype = 'float16'
+
+    # Partial freezing (ResNet18 only): the stages up to freeze_until are frozen and their
+    # output activations on un-augmented sequential patches are cached once with
+    # build_activation_cache.py, training then runs only the remaining stages on the cache
+    freeze_until = 'none'
+    available_freeze_stages = {'none', 'conv1', 'conv2_x', 'conv3_x', 'conv4_x'}
+    activation_cache_dir = 'data/activation_cache'
+    activation_cache_compression = 'float16'
+    available_activation_cache_compressions = {'none', 'float16', 'uint8'}
+
+    # Hashing head (Deep Multiple Instance Hashing): a tanh layer of hash_bits units between the
+    # pooled bag vector / patch embeddings and the logits, its signs are the binary codes indexed
+    # by build_hash_index.py for similar-case retrieval. 0 disables the head
+    hash_bits = 0
+    hash_quantization_weight = 0.1
+
     # Optimizer parameters
     optimizer_type = 'Adam'
     available_optimizers = {'Adam', 'GradientDescentOptimizer', 'MomentumOptimizer'}
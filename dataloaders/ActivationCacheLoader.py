@@ -0,0 +1,19 @@
+from dataloaders.EmbeddingLoader import EmbeddingLoader
+from utils.activation_cache import ActivationCache
+
+
+class ActivationCacheLoader(EmbeddingLoader):
+    """
+
+    Loading bags of cached backbone activations (see build_activation_cache.py)
+    Used when the backbone is frozen up to Config.freeze_until: the cache holds the
+    activations of un-augmented sequential patches at that block boundary, and the model
+    only builds the trainable suffix on top of them
+
+    """
+
+    def open_store(self):
+        store = ActivationCache(self.config.activation_cache_dir)
+        # the model reads this to build only the stages after the cached boundary
+        self.cached_stage = store.metadata['stage']
+        return store
@@ -0,0 +1,112 @@
+import tensorflow as tf
+import numpy as np
+
+from dataloaders.DatasetFileLoader import DatasetFileLoader
+from utils.img_utils import get_images_pathlist_labels, split_train_val, cast_pixels
+from utils.augmentation_bank import AugmentationBank
+from utils.numpy_ops import patch_positions
+from build_augmentation_bank import augmentation_params
+
+import logging
+import pprint
+import random
+import json
+
+
+class AugmentationBankLoader(DatasetFileLoader):
+    """
+
+    Training bags read from the precomputed augmentation bank (see build_augmentation_bank.py)
+    Each epoch takes one of the K stored variants of every training image at random, the bags
+    are already cropped, color jittered and rotated, so training does no augmentation work.
+    Validation is the DatasetFileLoader pipeline (deterministic, no augmentation)
+
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.pixel_dtype = tf.as_dtype(self.config.pipeline_dtype)
+        self.n_times_90 = int(random.choice(np.array(self.config.rotation_angles, dtype=np.int16) / 90))
+        self.rng = np.random.RandomState(self.config.random_seed)
+        # validation reads the full resolution PNGs without the optional DatasetFileLoader tables
+        self.tissue_keep = None
+        self.tissue_crops = None
+        self.pyramid = None
+        self.image_cache = None
+        self.val_cache = None
+
+        self.bank = AugmentationBank(self.config.augmentation_bank_dir)
+
+        if (config.train_on_subset):
+            images_labels = get_images_pathlist_labels(n = int(self.config.subset_size/4))
+        else:
+            images_labels = get_images_pathlist_labels()
+
+        _, _, _, val_images, val_labels, val_bi = split_train_val(
+            *images_labels,
+            ratio = self.config.train_val_split,
+            pre_shuffle = True)
+
+        self.check_bank(val_images)
+
+        logging.info(f"Augmentation bank: {pprint.pformat(len(self.bank))} images X "
+                     f"{pprint.pformat(self.bank.n_variants)} variants, {pprint.pformat(self.bank.nbytes / 2**30)} GB")
+        logging.info(f"Number of Training Images and Labels: {pprint.pformat(len(self.bank))}")
+        logging.info(f"Number of    Val   Images and Labels: {pprint.pformat(val_labels.shape[0])}")
+
+        p = self.config.patch_size
+        self.config.patch_count = len(patch_positions((self.config.image_h, self.config.image_w), (p, p),
+                                                      self.config.patches_overlap))
+
+        # training dataset
+
+        bag_shape = self.bank.bag_shape
+        self.train_dataset = tf.data.Dataset.from_generator(lambda: self.bank.epoch(self.rng),
+                                                            (tf.uint8, tf.int32, tf.int64),
+                                                            (tf.TensorShape(bag_shape), tf.TensorShape([]),
+                                                             tf.TensorShape([]))).repeat()
+        self.train_dataset = self.train_dataset.batch(self.config.batch_size)
+        self.train_dataset = self.train_dataset.map(self.flatten_bags,
+                                                    num_parallel_calls = self.config.num_parallel_cores)
+        self.train_dataset = self.train_dataset.prefetch(2)
+
+        self.iterator = tf.data.Iterator.from_structure(self.train_dataset.output_types,
+                                                        self.train_dataset.output_shapes)
+
+        self.training_init_op = self.iterator.make_initializer(self.train_dataset)
+
+        # validation dataset
+
+        self.val_dataset = self.make_val_dataset(val_images, val_labels, val_bi, repeat = True).prefetch(1)
+
+        self.val_init_op = self.iterator.make_initializer(self.val_dataset)
+
+        self.len_x_train = len(self.bank)
+        self.num_iterations_train = self.len_x_train // self.config.batch_size
+
+        self.len_x_val = val_labels.shape[0]
+        self.num_iterations_val = self.len_x_val // self.config.batch_size
+
+    def check_bank(self, val_images):
+        # the bank must come from the same training split and augmentation settings
+        # as read back from metadata.json (tuples become lists)
+        expected = json.loads(json.dumps(augmentation_params(self.config)))
+        stored = {k: self.bank.metadata.get(k) for k in expected}
+        if (stored != expected):
+            changed = {k: (stored[k], expected[k]) for k in expected if stored[k] != expected[k]}
+            raise ValueError(f"The augmentation bank was built with other settings (bank, Config): {changed}, "
+                             f"run build_augmentation_bank.py again")
+        leaked = np.intersect1d(self.bank.paths, val_images)
+        if (len(leaked) > 0):
+            raise ValueError(f"{len(leaked)} validation images are in the augmentation bank (e.g. {leaked[0]}), "
+                             f"run build_augmentation_bank.py again")
+
+    def flatten_bags(self, bags, labels, bag_index):
+        # batch of bags --> batch of patches, one label per patch (per bag for mi_branch)
+        n_patches = self.bank.bag_shape[0]
+        images = cast_pixels(tf.reshape(bags, shape = (-1, *self.bank.bag_shape[1:])), self.pixel_dtype)
+        mi_labels = labels
+        bag_index = tf.reshape(tf.tile(bag_index[:, tf.newaxis], [1, n_patches]), shape = (-1,))
+        if (self.config.mode != 'mi_branch'):
+            labels = tf.reshape(tf.tile(labels[:, tf.newaxis], [1, n_patches]), shape = (-1,))
+        return images, labels, mi_labels, bag_index
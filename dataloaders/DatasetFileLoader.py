@@ -2,12 +2,19 @@ import tensorflow as tf
 import numpy as np
 import pandas as pd
 from PIL import Image
-from utils.img_utils import get_images_pathlist_labels, extract_patches_from_tensor, split_train_val
+from utils.img_utils import get_images_pathlist_labels, extract_patches_from_tensor, split_train_val, cast_pixels, resize_patches, random_dihedral
+from utils.tissue_mask import TissueIndex
+from utils.image_pyramid import ImagePyramid
+from utils.val_cache import ValidationCache
+from utils.image_cache import DecodedImageCache, decode_png
+from utils.stain_norm import stain_normalized_paths, stain_metadata
 import logging
 import pprint
 import random
 from math import pi
 from datetime import datetime
+import hashlib
+import os
 
 
 class DatasetFileLoader:
@@ -25,15 +32,14 @@ class DatasetFileLoader:
         # Get the paths of PNG images and the labels, whether a subset or not
         
         if (config.train_on_subset):
-            train_images, train_labels, train_bi, val_images, val_labels, val_bi = split_train_val(
-                *get_images_pathlist_labels(n = int(self.config.subset_size/4)),
-                ratio = self.config.train_val_split, 
-                pre_shuffle = True)
+            images_labels = get_images_pathlist_labels(n = int(self.config.subset_size/4))
         else:
-            train_images, train_labels, train_bi, val_images, val_labels, val_bi = split_train_val(
-                *get_images_pathlist_labels(),
-                ratio = self.config.train_val_split, 
-                pre_shuffle = True)
+            images_labels = get_images_pathlist_labels()
+
+        train_images, train_labels, train_bi, val_images, val_labels, val_bi = split_train_val(
+            *images_labels,
+            ratio = self.config.train_val_split, 
+            pre_shuffle = True)
                 
         logging.info(f"Number of Training Images and Labels: {pprint.pformat(train_labels.shape[0])}")
         logging.info(f"Number of    Val   Images and Labels: {pprint.pformat(val_labels.shape[0])}")
@@ -47,6 +53,47 @@ class DatasetFileLoader:
         self.config.patch_count = self.get_patch_count(train_images[0])
         
         logging.info(f"Precomputed number of patches per image: {pprint.pformat(self.config.patch_count)}")
+
+        # images and patches stay uint8 up to the model input (see Config.pipeline_dtype)
+        self.pixel_dtype = tf.as_dtype(self.config.pipeline_dtype)
+
+        # one rotation of the training images for the whole run (pre-augmentation)
+        self.n_times_90 = int(random.choice(np.array(self.config.rotation_angles, dtype=np.int16) / 90))
+
+        # tissue masks: sequential tiles below the threshold are dropped, random crops are
+        # sampled among tissue-rich positions only (see build_tissue_index.py)
+        self.tissue_keep = None
+        self.tissue_crops = None
+        if (self.config.use_tissue_mask):
+            self.init_tissue_tables(*images_labels, val_bi)
+
+        # stain normalized copies of the images (see build_stain_normalized.py), the tissue
+        # index above stays keyed on the original paths
+        if (self.config.stain_normalization != 'none'):
+            train_images = stain_normalized_paths(train_images, self.config.stain_normalized_dir,
+                                                  self.config.stain_normalization)
+            val_images = stain_normalized_paths(val_images, self.config.stain_normalized_dir,
+                                                self.config.stain_normalization)
+            logging.info(f"Stain normalization: {pprint.pformat(self.config.stain_normalization)}")
+
+        # whole image training: read the pyramid level nearest to the 227 x 227 input
+        # instead of decoding the full resolution image (see build_image_pyramid.py)
+        self.pyramid = None
+        if (self.config.use_image_pyramid and not self.config.train_on_patches):
+            self.pyramid = ImagePyramid(self.config.image_pyramid_dir)
+            self.pyramid.check_source(self.config.stain_normalization, self.config.stain_normalized_dir)
+            self.pyramid_level = self.pyramid.level_for((227, 227))
+            train_images = self.pyramid.paths(train_images, self.pyramid_level)
+            val_images = self.pyramid.paths(val_images, self.pyramid_level)
+            logging.info(f"Image pyramid level: 1/{pprint.pformat(self.pyramid_level)}, "
+                         f"shape {pprint.pformat(self.pyramid.level_shape(self.pyramid_level))}")
+        
+        # decoded images cache shared by the training and validation readers (parallel map
+        # calls), least recently used images evicted past image_cache_mb
+        self.image_cache = None
+        if (self.config.image_cache_mb > 0):
+            self.image_cache = DecodedImageCache(self.config.image_cache_mb, decode = self.decode_image)
+            logging.info(f"Decoded image cache budget (MB): {pprint.pformat(self.config.image_cache_mb)}")
         
         # training dataset
         n = train_images.shape[0]
@@ -82,19 +129,21 @@ class DatasetFileLoader:
         
         # validation dataset
         
-        self.val_dataset = tf.data.Dataset.from_tensor_slices((val_images, val_labels, val_labels, val_bi)).repeat()
-        
-        self.val_dataset = self.val_dataset.map(self.read_images,
-                                                    num_parallel_calls = self.config.num_parallel_cores)
-        
-        self.val_dataset = self.val_dataset.map(self.preprocess_val,
-                                                    num_parallel_calls = self.config.num_parallel_cores)
-
-        self.val_dataset = self.val_dataset.batch(self.config.batch_size)
-
-        if (self.config.train_on_patches):
-            self.val_dataset = self.val_dataset.map(
-                self.get_patches_val, num_parallel_calls = self.config.num_parallel_cores)                
+        self.val_cache = None
+        if (self.config.val_cache == 'none'):
+            self.val_dataset = self.make_val_dataset(val_images, val_labels, val_bi, repeat = True)
+        else:
+            # the validation batches are deterministic: the un-repeated pipeline is run once to
+            # fill the cache (see initialize), the iterator then replays the cached batches
+            self.val_cache = ValidationCache(self.val_cache_params(val_images), self.config.val_cache_dir,
+                                             mode = self.config.val_cache, budget_mb = self.config.val_cache_budget_mb)
+            fill_dataset = self.make_val_dataset(val_images, val_labels, val_bi, repeat = False)
+            self.val_fill_iterator = fill_dataset.make_initializable_iterator()
+            self.val_fill_next = self.val_fill_iterator.get_next()
+            self.val_dataset = tf.data.Dataset.from_generator(self.val_cache.batches, fill_dataset.output_types,
+                                                              fill_dataset.output_shapes).repeat()
+            logging.info(f"Validation cache: {pprint.pformat(self.val_cache.dir)}, "
+                         f"complete: {pprint.pformat(self.val_cache.complete)}")
         self.val_dataset = self.val_dataset.prefetch(1)
                 
         self.val_init_op = self.iterator.make_initializer(self.val_dataset)
@@ -109,23 +158,87 @@ class DatasetFileLoader:
         print("Iterations Val: ", self.num_iterations_val)
         
     
+    def make_val_dataset(self, val_images, val_labels, val_bi, repeat = True):
+        val_dataset = tf.data.Dataset.from_tensor_slices((val_images, val_labels, val_labels, val_bi))
+        if (repeat):
+            val_dataset = val_dataset.repeat()
+        
+        val_dataset = val_dataset.map(self.read_images,
+                                      num_parallel_calls = self.config.num_parallel_cores)
+        
+        val_dataset = val_dataset.map(self.preprocess_val,
+                                      num_parallel_calls = self.config.num_parallel_cores)
+
+        val_dataset = val_dataset.batch(self.config.batch_size)
+
+        if (self.config.train_on_patches):
+            val_dataset = val_dataset.map(
+                self.get_patches_val, num_parallel_calls = self.config.num_parallel_cores)
+        return val_dataset
+
+    def val_cache_params(self, val_images):
+        # everything the validation batches depend on, a change of any of them is a new cache:
+        # the image files (paths, sizes and modification times, so that images regenerated in
+        # place, e.g. normalized again, are a new cache), the stain normalization and the tissue index
+        stats = [(str(p), os.stat(str(p)).st_size, os.stat(str(p)).st_mtime_ns) for p in np.asarray(val_images)]
+        stain = None
+        if (self.config.stain_normalization != 'none'):
+            stain = stain_metadata(self.config.stain_normalized_dir)
+        tissue = None
+        if (self.tissue_keep is not None):
+            tissue = dict(self.tissue_params, threshold = self.config.tissue_threshold,
+                          mtime = os.stat(self.config.tissue_index_path).st_mtime_ns)
+        return {'images': hashlib.sha1(repr(stats).encode()).hexdigest(), 'stain_normalization': stain,
+                'train_on_patches': self.config.train_on_patches, 'patch_size': self.config.patch_size,
+                'overlap': self.config.patches_overlap, 'resize': [227, 227],
+                'pipeline_dtype': self.config.pipeline_dtype, 'batch_size': self.config.batch_size,
+                'mode': self.config.mode, 'pyramid_level': self.pyramid_level if self.pyramid is not None else None,
+                'tissue_index': tissue}
+
+    def fill_val_cache(self, sess):
+        # one pass of the un-repeated validation pipeline, the first validation epoch
+        sess.run(self.val_fill_iterator.initializer)
+        while (True):
+            try:
+                self.val_cache.add(*sess.run(self.val_fill_next))
+            except tf.errors.OutOfRangeError:
+                break
+        self.val_cache.close()
+        logging.info(f"Validation cache filled: {pprint.pformat(self.val_cache.nbytes / 2**20)} MB, "
+                     f"on disk: {pprint.pformat(self.val_cache.on_disk)}")
+
     def read_images(self, image_path, label, mi_label, bag_index):
-        image = tf.image.decode_png(tf.read_file(image_path), channels = 3)
+        if (self.image_cache is not None):
+            image = tf.py_func(self.image_cache.read, [image_path], tf.uint8, stateful = True)
+        elif (self.pyramid is not None):
+            image = self.read_pyramid_level(image_path, self.pyramid_level)
+        else:
+            image = tf.image.decode_png(tf.read_file(image_path), channels = 3)
         image.set_shape([None, None, 3])
         
         return image, label, mi_label, bag_index
         
     
+    def read_pyramid_level(self, level_path, level):
+        if (self.pyramid.format == 'raw'):
+            h, w = self.pyramid.level_shape(level)
+            return tf.reshape(tf.decode_raw(tf.read_file(level_path), tf.uint8), [h, w, 3])
+        return tf.image.decode_png(tf.read_file(level_path), channels = 3)
+
+    def decode_image(self, path):
+        # NumPy decode of the image cache, same output as read_images
+        if (self.pyramid is not None and self.pyramid.format == 'raw'):
+            return np.fromfile(path, dtype=np.uint8).reshape(*self.pyramid.level_shape(self.pyramid_level), 3)
+        return decode_png(path)
+
     def preprocess_train(self, image, label, mi_label, bag_index):
         # Rotation is done (for patching mode --> pre-augment whole images, else --> augment)
         
-        n_times_90 = int(random.choice(np.array(self.config.rotation_angles, dtype=np.int16) / 90))
-        image = tf.image.rot90(image, k = n_times_90)
+        image = tf.image.rot90(image, k = self.n_times_90)
         
         # If not in patching mode, make sure size is 227 
         if (not self.config.train_on_patches):
-            image = tf.image.resize_images(image, [227, 227])
-            image = tf.cast(image, dtype=tf.float32)
+            image = cast_pixels(tf.image.resize_images(image, [227, 227]), self.pixel_dtype)
 
         
         logging.info(f"Shape of image: {pprint.pformat(tf.shape(image))}")
@@ -138,8 +251,7 @@ class DatasetFileLoader:
         
         # If not in patching mode, make sure size is 227 
         if (not self.config.train_on_patches):
-            image = tf.image.resize_images(image, [227, 227])
-            image = tf.cast(image, dtype=tf.float32)
+            image = cast_pixels(tf.image.resize_images(image, [227, 227]), self.pixel_dtype)
 
         
         return image, tf.cast(label, tf.int32), tf.cast(mi_label, tf.int32), bag_index
@@ -150,7 +262,12 @@ class DatasetFileLoader:
         p = self.config.patch_size
         c = self.config.channels
         
-        if (self.config.patch_generation_scheme == 'random_crops'):
+        if (self.config.patch_generation_scheme == 'random_crops' and self.tissue_crops is not None):
+            images = tf.reshape(
+                tf.map_fn(lambda z: self.tissue_random_crops(z[0], z[1], n_patches),
+                          (images, bag_index), dtype = images.dtype),
+                shape=[-1, p, p, c])
+        elif (self.config.patch_generation_scheme == 'random_crops'):
             images = tf.reshape(
                 tf.map_fn(
                     lambda z: tf.stack([tf.random_crop(
@@ -180,13 +297,22 @@ class DatasetFileLoader:
             if (self.config.mode != 'mi_branch'):
                 labels = tf.reshape(tf.map_fn(lambda x: tf.tile([x], [n_patches]), labels), shape=(-1,))
                                 
+        keep = None
+        # the tile fractions are those of the un-rotated images
+        if (self.config.patch_generation_scheme == 'sequential_full' and self.tissue_keep is not None
+                and self.n_times_90 == 0):
+            keep = tf.reshape(tf.gather(self.tissue_keep, bag_index), shape=(-1,))
+
         bag_index = tf.reshape(tf.map_fn(lambda x: tf.tile([x], [n_patches]), bag_index), shape=(-1,))
         
         images = tf.reshape(images, shape=(-1, p, p, c))
+
+        if (keep is not None):
+            images, labels, bag_index = self.drop_background(images, labels, bag_index, keep)
         
-        images = tf.image.resize_images(images, [227, 227])
+        images = resize_patches(images, [227, 227], self.pixel_dtype)
         
-        return tf.cast(images, dtype = tf.float32), labels, mi_labels, bag_index
+        return images, labels, mi_labels, bag_index
     
     def get_patches_val(self, images, labels, mi_labels, bag_index):
         p = self.config.patch_size
@@ -201,34 +327,94 @@ class DatasetFileLoader:
         if (self.config.mode != 'mi_branch'):
             labels = tf.reshape(tf.map_fn(lambda x: tf.tile([x], [n_patches]), labels), shape=(-1,))       
             
+        keep = None
+        if (self.tissue_keep is not None):
+            keep = tf.reshape(tf.gather(self.tissue_keep, bag_index), shape=(-1,))
+
         bag_index = tf.reshape(tf.map_fn(lambda x: tf.tile([x], [n_patches]), bag_index), shape=(-1,))       
         images = tf.reshape(images, shape=(-1, p, p, c))
-        images = tf.image.resize_images(images, [227, 227])
+
+        if (keep is not None):
+            images, labels, bag_index = self.drop_background(images, labels, bag_index, keep)
+
+        images = resize_patches(images, [227, 227], self.pixel_dtype)
         
-        return tf.cast(images, dtype = tf.float32), labels, mi_labels, bag_index
+        return images, labels, mi_labels, bag_index
     
     
+    def init_tissue_tables(self, paths, labels, bag_index, val_bi):
+        # tables indexed by bag index (bag_index is a range over the image list)
+        index = TissueIndex.load(self.config.tissue_index_path)
+        index.check(self.config.patch_size, self.config.patches_overlap)
+        paths_by_bag = np.empty(len(paths), dtype=object)
+        paths_by_bag[bag_index] = paths
+
+        keep = index.keep_tiles(paths_by_bag, self.config.tissue_threshold)
+        self.tissue_keep = tf.constant(keep)
+        if (self.config.patch_generation_scheme == 'random_crops'):
+            self.tissue_crops = tf.constant(index.crop_grids(paths_by_bag, self.config.tissue_threshold,
+                                                             self.config.patch_size, self.n_times_90))
+        self.tissue_downsample = index.params['downsample']
+        self.tissue_params = index.params
+
+        skipped = 1 - keep[val_bi].mean()
+        logging.info(f"Tissue threshold: {pprint.pformat(self.config.tissue_threshold)}")
+        logging.info(f"Fraction of sequential tiles skipped as background (backbone compute saved): {pprint.pformat(skipped)}")
+
+    def tissue_random_crops(self, image, bag_index, n_patches):
+        # random crops whose top-left corner is drawn among the tissue-rich grid cells,
+        # jittered within the cell
+        p = self.config.patch_size
+        d = self.tissue_downsample
+        cells = tf.where(tf.gather(self.tissue_crops, bag_index))
+        # one draw for the cell and the jitter (two ops with the same seed give correlated streams)
+        draw = tf.random_uniform([n_patches, 3], seed = self.config.random_seed)
+        n_cells = tf.shape(cells, out_type = tf.int64)[0]
+        picks = tf.minimum(tf.cast(draw[:, 0] * tf.cast(n_cells, tf.float32), tf.int64), n_cells - 1)
+        jitter = tf.minimum(tf.cast(draw[:, 1:] * d, tf.int64), d - 1)
+        limits = tf.cast(tf.shape(image)[:2] - p, tf.int64)
+        corners = tf.minimum(tf.gather(cells, picks) * d + jitter, limits)
+        return tf.map_fn(lambda o: tf.slice(image, [o[0], o[1], 0], [p, p, self.config.channels]),
+                         corners, dtype = image.dtype)
+
+    def drop_background(self, images, labels, bag_index, keep):
+        images = tf.boolean_mask(images, keep)
+        bag_index = tf.boolean_mask(bag_index, keep)
+        if (self.config.mode != 'mi_branch'):
+            labels = tf.boolean_mask(labels, keep)
+        return images, labels, bag_index
+
     def patch_augment(self, images, labels, mi_labels, bag_index):
         
-        # color augmentation for patches
-        if (self.config.random_brightness):
-            images = tf.image.random_brightness(images, 0.5)
-        if (self.config.random_contrast):
-            images = tf.image.random_contrast(images, 0.75, 1)
-        if (self.config.random_saturation):
-            images = tf.image.random_saturation(images, 0.75, 1)
-        if (self.config.random_hue):
-            images = tf.image.random_hue(images, 0.05)
+        images = self.color_augment(images)
             
         # rotation augmentation for patches
-        if (self.config.random_rotation_patches):
+        if (self.config.random_rotation_patches and self.config.patch_rotation == 'dihedral'):
+            images = random_dihedral(images, self.config.patch_rotation_residual,
+                                     interpolation = self.config.interpolation, seed = self.config.random_seed)
+        elif (self.config.random_rotation_patches):
             to_radian = lambda x: x * pi / 180
             degree_angles = tf.random_uniform(shape = [tf.shape(images)[0]],
                                               minval = 0, maxval = 360, seed = self.config.random_seed)
             images = tf.contrib.image.rotate(
                 images, to_radian(degree_angles), interpolation = self.config.interpolation)
             
-        return tf.cast(images, dtype = tf.float32), labels, mi_labels, bag_index
+        return images, labels, mi_labels, bag_index
+
+    def color_augment(self, images):
+        # color augmentation for patches, on 0-255 floats, rounded back to the pipeline dtype
+        if (self.config.random_brightness or self.config.random_contrast or
+                self.config.random_saturation or self.config.random_hue):
+            images = tf.cast(images, dtype = tf.float32)
+        if (self.config.random_brightness):
+            images = tf.image.random_brightness(images, 0.5)
+        if (self.config.random_contrast):
+            images = tf.image.random_contrast(images, 0.75, 1)
+        if (self.config.random_saturation):
+            images = tf.image.random_saturation(images, 0.75, 1)
+        if (self.config.random_hue):
+            images = tf.image.random_hue(images, 0.05)
+        return cast_pixels(images, self.pixel_dtype)
         
     
     def get_patch_count(self, image_path):
@@ -244,9 +430,13 @@ class DatasetFileLoader:
             
     
     def initialize(self, sess, train = True):
+        if (self.image_cache is not None):
+            logging.info(f"Decoded image cache: {pprint.pformat(self.image_cache.stats())}")
         if (train):
             sess.run(self.training_init_op)
         else:
+            if (self.val_cache is not None and not self.val_cache.complete):
+                self.fill_val_cache(sess)
             sess.run(self.val_init_op)
     
     def get_input(self):
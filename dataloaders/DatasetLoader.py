@@ -1,7 +1,8 @@
 import tensorflow as tf
 import numpy as np
 
-from utils.img_utils import read_images_labels, get_patches_from_images_tensor, split_train_val, pre_augment_images, rotate_images
+from utils.img_utils import read_images_labels, split_train_val, pre_augment_images, rotate_images, cast_pixels, resize_patches
+from utils.numpy_ops import patch_view, needs_padding, PatchGrid
 
 import logging
 import pprint
@@ -9,136 +10,190 @@ import random
 
 class DatasetLoader:
     """
-    
-    Loading images using the Dataset API
+
+    Loading images held in memory (NumPy arrays), whole images or bags of patches
+    The arrays stay in host memory and are never embedded in the graph (Config.dataset_feed):
+      'generator'    one bag (or image) per element is handed to tf.data as a view of the
+                     host buffers, no copy of the dataset is made
+      'placeholder'  the arrays are fed through placeholders when the dataset is initialized
+      'constant'     from_tensor_slices on the arrays, which become GraphDef constants
+                     (2GB limit, slow graph construction and .meta writes), for comparison
     Two Datasets are initialized, one for training and one for validation
-    
+
     """
 
-    def __init__(self, config):
+    def __init__(self, config, images_labels = None):
+        """
+        :param images_labels: optional (images, labels, bag_index) arrays instead of the PNG images
+        """
         self.config = config
-        
+        self.pixel_dtype = tf.as_dtype(self.config.pipeline_dtype)
+        self.rng = np.random.RandomState(self.config.random_seed)
+        self.feeds = {}
+
         # Read the PNG images from disk, whether a subset or not
-        
-        if (config.train_on_subset):
-            images, labels = read_images_labels(n = int(self.config.subset_size/4))
-        else:
-            images, labels = read_images_labels()
-        
+
+        if (images_labels is None):
+            if (config.train_on_subset):
+                images_labels = read_images_labels(n = int(self.config.subset_size/4))
+            else:
+                images_labels = read_images_labels()
+
         # Split training data (since reading is sequential in terms of classes)
-        
-        train_images, train_labels, val_images, val_labels = split_train_val(images,
-                                                 labels,
-                                                 ratio = self.config.train_val_split, 
-                                                 pre_shuffle = True)
-
-        del images, labels
-        
-        # Extract patches on the fly in case training is on image patches
-        
-        
+
+        train_images, train_labels, train_bi, val_images, val_labels, val_bi = split_train_val(
+            *images_labels,
+            ratio = self.config.train_val_split,
+            pre_shuffle = True)
+
+        del images_labels
+
+        # Extract the patches once, a bag of patches per image in case training is on image patches
+
         if (config.train_on_patches):
             train_images = rotate_images(train_images,
                                               angles = self.config.rotation_angles)
-            
-            train_images, train_labels = DatasetLoader.convert_to_patches_repeat_labels(train_images,
-                                                                          train_labels,
-                                                                          self.config.patch_size)
-
-            val_images, val_labels = DatasetLoader.convert_to_patches_repeat_labels(val_images,
-                                                                          val_labels,
-                                                                          self.config.patch_size)
-            
-            logging.info(f"Shape of train images after getting all patches:{pprint.pformat(train_images.shape)}")
-            
-            logging.info(f"Shape of val images after getting all patches: {pprint.pformat(val_images.shape)}")
-                
+
+            # the generator feed pads one bag at a time, the other feeds need the whole padded grid
+            per_bag = self.config.dataset_feed == 'generator'
+            train_images = DatasetLoader.convert_to_bags(train_images, train_labels, self.config.patch_size, per_bag)
+            val_images = DatasetLoader.convert_to_bags(val_images, val_labels, self.config.patch_size, per_bag)
+            self.config.patch_count = train_images.shape[1] * train_images.shape[2]
+
+            logging.info(f"Shape of train bags after getting all patches:{pprint.pformat(train_images.shape)}")
+
+            logging.info(f"Shape of val bags after getting all patches: {pprint.pformat(val_images.shape)}")
+
         logging.info(f"Number of Training Images and Labels: {pprint.pformat(train_labels.shape[0])}")
         logging.info(f"Number of    Val   Images and Labels: {pprint.pformat(val_labels.shape[0])}")
-        
+        logging.info(f"Dataset feed: {pprint.pformat(self.config.dataset_feed)}")
+
+        # host buffers
+        self.train = (train_images, train_labels.astype(np.int32), train_bi.astype(np.int64))
+        self.val = (val_images, val_labels.astype(np.int32), val_bi.astype(np.int64))
+
         # training dataset
-        n = train_images.shape[0]
-        
-        self.train_dataset = tf.data.Dataset.from_tensor_slices((train_images, train_labels))
-        self.train_dataset = self.train_dataset.map(self.preprocess_train,
-                                                    num_parallel_calls = self.config.num_parallel_cores)
-
-        self.train_dataset = self.train_dataset.shuffle(n, reshuffle_each_iteration = False)
-        self.train_dataset = self.train_dataset.batch(self.config.batch_size)
+
+        self.train_dataset = self.make_dataset(*self.train, train = True)
         self.train_dataset = self.train_dataset.prefetch(1)
 
         self.iterator = tf.data.Iterator.from_structure(self.train_dataset.output_types,
                                                            self.train_dataset.output_shapes)
-        
+
         self.training_init_op = self.iterator.make_initializer(self.train_dataset)
-        
+
         # validation dataset
-        
-        self.val_dataset = tf.data.Dataset.from_tensor_slices((val_images, val_labels))
-        self.val_dataset = self.val_dataset.map(self.preprocess_val,
-                                                    num_parallel_calls = self.config.num_parallel_cores)
 
-        self.val_dataset = self.val_dataset.batch(self.config.batch_size)
+        self.val_dataset = self.make_dataset(*self.val, train = False)
         self.val_dataset = self.val_dataset.prefetch(1)
-                
+
         self.val_init_op = self.iterator.make_initializer(self.val_dataset)
-        
+
         self.len_x_train = train_labels.shape[0]
         self.len_x_val = val_labels.shape[0]
 
         self.num_iterations_train = self.len_x_train // self.config.batch_size
         self.num_iterations_val = self.len_x_val // self.config.batch_size
-        
-        del train_images, train_labels, val_images, val_labels
-        
-    
-    
-    def preprocess_train(self, image, label):
-        #img = tf.random_crop(image, [224, 224, 3])
-        img = tf.image.resize_image_with_crop_or_pad(image, 224, 224)
+
+
+    def make_dataset(self, images, labels, bag_index, train = True):
+        feed = self.config.dataset_feed
+        if (feed == 'generator'):
+            dataset = tf.data.Dataset.from_generator(lambda: self.generate(images, labels, bag_index, train),
+                                                     (tf.as_dtype(images.dtype), tf.int32, tf.int64),
+                                                     (tf.TensorShape(images.shape[1:]), tf.TensorShape([]),
+                                                      tf.TensorShape([])))
+        else:
+            if (feed == 'placeholder'):
+                with tf.variable_scope('dataset_feed'):
+                    x = tf.placeholder(tf.as_dtype(images.dtype), shape=(None, *images.shape[1:]))
+                    y = tf.placeholder(tf.int32, shape=(None,))
+                    bi = tf.placeholder(tf.int64, shape=(None,))
+                self.feeds[train] = {x: images, y: labels, bi: bag_index}
+                dataset = tf.data.Dataset.from_tensor_slices((x, y, bi))
+            else:
+                dataset = tf.data.Dataset.from_tensor_slices((images, labels, bag_index))
+            if (train):
+                dataset = dataset.shuffle(labels.shape[0], seed = self.config.random_seed,
+                                          reshuffle_each_iteration = True)
+
+        dataset = dataset.map(self.preprocess_train if train else self.preprocess_val,
+                              num_parallel_calls = self.config.num_parallel_cores)
+        dataset = dataset.batch(self.config.batch_size)
+        if (self.config.train_on_patches):
+            dataset = dataset.map(self.flatten_bags, num_parallel_calls = self.config.num_parallel_cores)
+        return dataset
+
+    def generate(self, images, labels, bag_index, train = True):
+        order = self.rng.permutation(labels.shape[0]) if train else range(labels.shape[0])
+        for i in order:
+            yield images[i], labels[i], bag_index[i]
+
+
+    def preprocess_train(self, image, label, bag_index):
         if (not self.config.train_on_patches):
+            #img = tf.random_crop(image, [224, 224, 3])
+            image = tf.image.resize_image_with_crop_or_pad(image, 224, 224)
             n_times_90 = int(random.choice([np.array(self.config.rotation_angles, dtype=np.int16) / 90]))
-            img = tf.image.rot90(img, k = n_times_90)
-        return tf.cast(img, tf.float32), tf.cast(label, tf.int64)
-    
-    
-    def preprocess_val(self, image, label):
-            img = tf.image.resize_image_with_crop_or_pad(image, 224, 224)
-            return tf.cast(img, tf.float32), tf.cast(label, tf.int64)
-    
-    
-    def preprocess_patched_train(self, image, label):
-        # to be implemented if needed
-        return
-        
-    
-    def preprocess_patched_val(self, image, label):
-        # to be implemented if needed
-        return
-    
+            image = tf.image.rot90(image, k = n_times_90)
+        return cast_pixels(image, self.pixel_dtype), label, label, bag_index
+
+
+    def preprocess_val(self, image, label, bag_index):
+        if (not self.config.train_on_patches):
+            image = tf.image.resize_image_with_crop_or_pad(image, 224, 224)
+        return cast_pixels(image, self.pixel_dtype), label, label, bag_index
+
+
+    def flatten_bags(self, images, labels, mi_labels, bag_index):
+        # batch of bags (patch grids) --> batch of patches, one label per patch (per bag for mi_branch)
+        p = self.config.patch_size
+        images = resize_patches(tf.reshape(images, shape=(-1, p, p, self.config.channels)), [227, 227],
+                                self.pixel_dtype)
+        n_patches = tf.shape(images)[0] // tf.shape(bag_index)[0]
+        bag_index = tf.reshape(tf.tile(bag_index[:, tf.newaxis], [1, n_patches]), shape=(-1,))
+        if (self.config.mode != 'mi_branch'):
+            labels = tf.reshape(tf.tile(labels[:, tf.newaxis], [1, n_patches]), shape=(-1,))
+        return images, labels, mi_labels, bag_index
+
     @staticmethod
-    def convert_to_patches_repeat_labels(images, labels, patch_size, train = True):
-        
-        patches, n_patches = get_patches_from_images_tensor(images, size=(patch_size, patch_size))
-        
-        logging.info(f"Shape of patches: {pprint.pformat(patches.shape)}")
+    def convert_to_bags(images, labels, patch_size, per_bag = False):
+        # n_images X rows X cols X p X p X c view of the images
+        grid, _ = DatasetLoader.convert_to_patches_repeat_labels(images, labels, patch_size, per_bag = per_bag)
+        return grid
+
+    @staticmethod
+    def convert_to_patches_repeat_labels(images, labels, patch_size, train = True, per_bag = False):
+
+        # the patch grids are strided views of the images (utils.numpy_ops.patch_view), the
+        # patches are only copied when they are handed to tf.data, one bag at a time.
+        # When the 'SAME' grid overhangs the border, patch_view pads (copies) the images:
+        # per_bag pads each image when its bag is read instead of the whole dataset here
+        size = (patch_size, patch_size)
+        if (per_bag):
+            grid = PatchGrid(images, size = size)
+        else:
+            if (needs_padding(images.shape[1:3], size)):
+                logging.info(f"Patch grid overhangs the images: padded copy of the dataset "
+                             f"({pprint.pformat(images.nbytes / 2**20)} MB before padding)")
+            grid = patch_view(images, size = size)
+        n_patches = grid.shape[1] * grid.shape[2]
+
+        logging.info(f"Shape of patches: {pprint.pformat(grid.shape)}")
         logging.info(f"Shape of labels: {pprint.pformat(labels.shape)}")
-        logging.info(f"Number of patches extracted: {pprint.pformat(n_patches)}")        
-            
+        logging.info(f"Number of patches extracted: {pprint.pformat(n_patches)}")
+
         # repeat labels for patches
-        labels = np.asarray([l for l in labels for _ in range(n_patches)])
+        labels = np.repeat(labels, n_patches)
         logging.info(f"Shape of labels after patching (repeat): {pprint.pformat(labels.shape)}")
-                                                     
-        # squeeze 1st and 2nd dimensions via reshape (this) or sampling (later)
-        images = tf.reshape(patches, shape=(-1, *patches.shape[2:]))
-        
-        return images, labels
-    
+
+        return grid, labels
+
     def initialize(self, sess, train = True):
         if (train):
-            sess.run(self.training_init_op)
+            sess.run(self.training_init_op, feed_dict = self.feeds.get(True))
         else:
-            sess.run(self.val_init_op)
+            sess.run(self.val_init_op, feed_dict = self.feeds.get(False))
 
     def get_input(self):
-        return self.iterator.get_next()
\ No newline at end of file
+        return self.iterator.get_next()
@@ -0,0 +1,102 @@
+import tensorflow as tf
+import numpy as np
+
+from utils.img_utils import split_train_val
+from utils.embedding_store import EmbeddingStore
+
+import logging
+import pprint
+
+
+class EmbeddingLoader:
+    """
+
+    Loading bags of patch embeddings from an EmbeddingStore (see extract_embeddings.py)
+    Used for head-only training: the whole store is held in memory and batches are built
+    by indexing NumPy arrays, so thousands of bags per second are served
+    Training bags are random subsets of n_random_patches patches, validation bags hold all patches
+
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.store = self.open_store()
+
+        image_index = np.arange(len(self.store))
+        if (config.train_on_subset):
+            image_index = np.concatenate([image_index[self.store.labels == c][:int(self.config.subset_size/4)]
+                                          for c in np.unique(self.store.labels)])
+
+        # same split as DatasetFileLoader, the bag index is the image index in the store
+        _, _, self.train_bags, _, _, self.val_bags = split_train_val(
+            self.store.paths[image_index], self.store.labels[image_index], image_index,
+            ratio = self.config.train_val_split,
+            pre_shuffle = True)
+
+        logging.info(f"Number of Training Bags: {pprint.pformat(self.train_bags.shape[0])}")
+        logging.info(f"Number of    Val   Bags: {pprint.pformat(self.val_bags.shape[0])}")
+        logging.info(f"Embedding dimension: {pprint.pformat(self.store.dim)}")
+
+        self.config.patch_count = int(self.store.counts[0])
+        self.rng = np.random.RandomState(self.config.random_seed)
+
+        output_types = (tf.float32, tf.int32, tf.int32, tf.int64)
+        output_shapes = (tf.TensorShape([None, *np.atleast_1d(self.store.dim)]), tf.TensorShape([None]),
+                         tf.TensorShape([None]), tf.TensorShape([None]))
+
+        self.train_dataset = tf.data.Dataset.from_generator(lambda: self.generate(train = True),
+                                                            output_types, output_shapes).prefetch(10)
+
+        self.iterator = tf.data.Iterator.from_structure(self.train_dataset.output_types,
+                                                        self.train_dataset.output_shapes)
+
+        self.training_init_op = self.iterator.make_initializer(self.train_dataset)
+
+        self.val_dataset = tf.data.Dataset.from_generator(lambda: self.generate(train = False),
+                                                          output_types, output_shapes).prefetch(1)
+
+        self.val_init_op = self.iterator.make_initializer(self.val_dataset)
+
+        self.len_x_train = self.train_bags.shape[0]
+        self.num_iterations_train = self.len_x_train // self.config.batch_size
+
+        self.len_x_val = self.val_bags.shape[0]
+        self.num_iterations_val = self.len_x_val // self.config.batch_size
+
+    def open_store(self):
+        return EmbeddingStore(self.config.embedding_store_dir)
+
+    def get_bag(self, i, train = True):
+        embeddings, _ = self.store.get(i)
+        if (train and self.config.n_random_patches < embeddings.shape[0]):
+            embeddings = embeddings[np.sort(self.rng.choice(embeddings.shape[0], self.config.n_random_patches,
+                                                            replace = False))]
+        return embeddings
+
+    def generate(self, train = True):
+        bs = self.config.batch_size
+        while True:
+            bags = self.rng.permutation(self.train_bags) if train else self.val_bags
+            for start in range(0, len(bags) - bs + 1, bs):
+                batch = bags[start : start + bs]
+                embeddings = [self.get_bag(i, train) for i in batch]
+                counts = [e.shape[0] for e in embeddings]
+                mi_labels = self.store.labels[batch].astype(np.int32)
+
+                x = np.concatenate(embeddings).astype(np.float32)
+                bag_index = np.repeat(batch, counts).astype(np.int64)
+                if (self.config.mode != 'mi_branch'):
+                    labels = np.repeat(mi_labels, counts)
+                else:
+                    labels = mi_labels
+
+                yield x, labels, mi_labels, bag_index
+
+    def initialize(self, sess, train = True):
+        if (train):
+            sess.run(self.training_init_op)
+        else:
+            sess.run(self.val_init_op)
+
+    def get_input(self):
+        return self.iterator.get_next()
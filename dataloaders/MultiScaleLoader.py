@@ -0,0 +1,164 @@
+import tensorflow as tf
+import numpy as np
+
+from dataloaders.DatasetFileLoader import DatasetFileLoader
+from utils.img_utils import get_images_pathlist_labels, split_train_val, cast_pixels, resize_patches
+from utils.image_pyramid import ImagePyramid
+from utils.numpy_ops import patch_positions
+
+import logging
+import pprint
+import random
+
+
+class MultiScaleLoader(DatasetFileLoader):
+    """
+
+    Loading multi-magnification bags from the image pyramid (see build_image_pyramid.py)
+    Each instance is a patch_size patch taken at one of the pyramid levels in
+    Config.multi_scale_levels (e.g. 1, 2, 4 for 1x, 1/2 and 1/4), the patches of the
+    different scales are centred on the same points of the image, so they show the same
+    region at decreasing magnification. The levels of an image are read in one map call
+    and all the patches of a level are cut with a single crop_and_resize.
+
+    get_input returns the usual (x, y, y_mi, bi), the scale of each instance (index into
+    multi_scale_levels) is in self.scale_index for BaseModel.mi_pool_layer
+    Training bags hold n_random_patches // n_scales centres, so the number of instances
+    per bag (and the backbone cost) is the same as single scale training
+
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+        self.pyramid = ImagePyramid(self.config.image_pyramid_dir)
+        # the levels are the stain normalized images when the normalization is enabled
+        self.pyramid.check_source(self.config.stain_normalization, self.config.stain_normalized_dir)
+        self.levels = sorted(self.config.multi_scale_levels)
+        missing = set(self.levels) - set(self.pyramid.levels)
+        if (len(missing) > 0):
+            raise ValueError(f"Levels {sorted(missing)} are not in the image pyramid {self.pyramid.levels}")
+        self.n_scales = len(self.levels)
+        self.scale_index = None
+        self.pixel_dtype = tf.as_dtype(self.config.pipeline_dtype)
+        # the levels are read by read_pyramid_level, without the caches of DatasetFileLoader
+        self.image_cache = None
+        self.val_cache = None
+
+        if (config.train_on_subset):
+            images_labels = get_images_pathlist_labels(n = int(self.config.subset_size/4))
+        else:
+            images_labels = get_images_pathlist_labels()
+
+        train_images, train_labels, train_bi, val_images, val_labels, val_bi = split_train_val(
+            *images_labels,
+            ratio = self.config.train_val_split,
+            pre_shuffle = True)
+
+        logging.info(f"Number of Training Images and Labels: {pprint.pformat(train_labels.shape[0])}")
+        logging.info(f"Number of    Val   Images and Labels: {pprint.pformat(val_labels.shape[0])}")
+        logging.info(f"Multi-scale levels: {pprint.pformat(self.levels)}")
+
+        self.n_times_90 = int(random.choice(np.array(self.config.rotation_angles, dtype=np.int16) / 90))
+        self.n_centres = max(1, self.config.n_random_patches // self.n_scales)
+
+        # centres of the sequential tiles of the finest level, in full resolution pixels
+        p = self.config.patch_size
+        h, w = self.pyramid.metadata['image_h'], self.pyramid.metadata['image_w']
+        finest = self.levels[0]
+        positions = patch_positions(self.pyramid.level_shape(finest), (p, p), self.config.patches_overlap)
+        self.sequential_centres = ((positions + p / 2) * finest).astype(np.float32)
+        self.config.patch_count = self.sequential_centres.shape[0] * self.n_scales
+
+        level_paths = lambda images: tuple(self.pyramid.paths(images, l) for l in self.levels)
+
+        # training dataset
+        n = train_images.shape[0]
+
+        self.train_dataset = tf.data.Dataset.from_tensor_slices((level_paths(train_images), train_labels,
+                                                                 train_labels, train_bi))
+        self.train_dataset = self.train_dataset.shuffle(n, reshuffle_each_iteration = True).repeat()
+        self.train_dataset = self.train_dataset.map(lambda *z: self.get_multiscale_patches(*z, train = True),
+                                                    num_parallel_calls = self.config.num_parallel_cores)
+        self.train_dataset = self.train_dataset.batch(self.config.batch_size)
+        self.train_dataset = self.train_dataset.map(self.flatten_bags,
+                                                    num_parallel_calls = self.config.num_parallel_cores)
+        self.train_dataset = self.train_dataset.map(lambda x, y, y_mi, bi, s: (*self.patch_augment(x, y, y_mi, bi), s),
+                                                    num_parallel_calls = self.config.num_parallel_cores)
+        self.train_dataset = self.train_dataset.prefetch(10)
+
+        self.iterator = tf.data.Iterator.from_structure(self.train_dataset.output_types,
+                                                        self.train_dataset.output_shapes)
+
+        self.training_init_op = self.iterator.make_initializer(self.train_dataset)
+
+        # validation dataset
+
+        self.val_dataset = tf.data.Dataset.from_tensor_slices((level_paths(val_images), val_labels,
+                                                               val_labels, val_bi)).repeat()
+        self.val_dataset = self.val_dataset.map(lambda *z: self.get_multiscale_patches(*z, train = False),
+                                                num_parallel_calls = self.config.num_parallel_cores)
+        self.val_dataset = self.val_dataset.batch(self.config.batch_size)
+        self.val_dataset = self.val_dataset.map(self.flatten_bags,
+                                                num_parallel_calls = self.config.num_parallel_cores)
+        self.val_dataset = self.val_dataset.prefetch(1)
+
+        self.val_init_op = self.iterator.make_initializer(self.val_dataset)
+
+        self.len_x_train = train_labels.shape[0]
+        self.num_iterations_train = self.len_x_train // self.config.batch_size
+
+        self.len_x_val = val_labels.shape[0]
+        self.num_iterations_val = self.len_x_val // self.config.batch_size
+
+    def get_multiscale_patches(self, level_paths, label, mi_label, bag_index, train = True):
+        p = self.config.patch_size
+        k = self.n_times_90 if train else 0
+        h, w = self.pyramid.metadata['image_h'], self.pyramid.metadata['image_w']
+        if (k % 2 == 1):
+            h, w = w, h
+
+        if (train and self.config.patch_generation_scheme == 'random_crops'):
+            # the patch of the finest level lies inside the image, coarser ones may be zero padded
+            half = p * self.levels[0] / 2
+            # one draw for both coordinates (two ops with the same seed give the same stream)
+            centres = half + tf.random_uniform([self.n_centres, 2], seed = self.config.random_seed) * \
+                      tf.constant([h - 2 * half, w - 2 * half], dtype = tf.float32)
+        else:
+            centres = tf.constant(self.sequential_centres)
+        n = tf.shape(centres)[0]
+
+        patches = []
+        for path, level in zip(level_paths, self.levels):
+            image = tf.image.rot90(self.read_pyramid_level(path, level), k = k)
+            lh, lw = self.pyramid.level_shape(level)
+            if (k % 2 == 1):
+                lh, lw = lw, lh
+            top_left = centres / level - p / 2
+            # crop_and_resize boxes are normalized so that y * (h - 1) is the pixel row,
+            # a box spanning p - 1 pixels samples an exact p x p crop
+            boxes = tf.concat([top_left[:, :1] / (lh - 1), top_left[:, 1:] / (lw - 1),
+                               (top_left[:, :1] + p - 1) / (lh - 1), (top_left[:, 1:] + p - 1) / (lw - 1)], axis = 1)
+            patches.append(tf.image.crop_and_resize(tf.expand_dims(tf.cast(image, tf.float32), 0), boxes,
+                                                    tf.zeros([n], dtype = tf.int32), [p, p]))
+
+        images = cast_pixels(tf.concat(patches, axis = 0), self.pixel_dtype)
+        scales = tf.reshape(tf.tile(tf.expand_dims(tf.range(self.n_scales, dtype = tf.int32), 1), [1, n]), (-1,))
+        bag_index = tf.fill([self.n_scales * n], bag_index)
+        if (self.config.mode != 'mi_branch'):
+            label = tf.fill([self.n_scales * n], tf.cast(label, tf.int32))
+
+        return images, tf.cast(label, tf.int32), tf.cast(mi_label, tf.int32), bag_index, scales
+
+    def flatten_bags(self, images, labels, mi_labels, bag_index, scales):
+        p = self.config.patch_size
+        c = self.config.channels
+        images = tf.reshape(images, shape = (-1, p, p, c))
+        images = resize_patches(images, [227, 227], self.pixel_dtype)
+        if (self.config.mode != 'mi_branch'):
+            labels = tf.reshape(labels, shape = (-1,))
+        return images, labels, mi_labels, tf.reshape(bag_index, shape = (-1,)), tf.reshape(scales, shape = (-1,))
+
+    def get_input(self):
+        x, y, y_mi, bi, self.scale_index = self.iterator.get_next()
+        return x, y, y_mi, bi
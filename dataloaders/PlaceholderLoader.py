@@ -0,0 +1,42 @@
+import tensorflow as tf
+
+
+class PlaceholderLoader:
+    """
+
+    Feeding bags of patches through placeholders
+    Used for inference, graph export and benchmarks where no dataset is on disk
+    Exposes the same get_input / initialize interface as the other loaders
+
+    """
+
+    def __init__(self, config, input_shape = None):
+        self.config = config
+
+        # shape of one instance, patches by default (or e.g. cached activations)
+        if (input_shape is None):
+            input_shape = (227, 227, self.config.channels)
+
+        with tf.variable_scope('placeholder_inputs'):
+            self.x = tf.placeholder(tf.float32, shape=(None, *input_shape), name='x')
+            self.y = tf.placeholder(tf.int32, shape=(None,), name='y')
+            self.y_mi = tf.placeholder(tf.int32, shape=(None,), name='y_mi')
+            self.bi = tf.placeholder(tf.int64, shape=(None,), name='bag_index')
+
+        self.num_iterations_train = 0
+        self.num_iterations_val = 0
+
+    def feed_dict(self, images, bag_index, labels = None, mi_labels = None):
+        feed = {self.x: images, self.bi: bag_index}
+        if (labels is not None):
+            feed[self.y] = labels
+        if (mi_labels is not None):
+            feed[self.y_mi] = mi_labels
+        return feed
+
+    def initialize(self, sess, train = True):
+        # nothing to initialize, inputs are fed by the caller
+        return
+
+    def get_input(self):
+        return self.x, self.y, self.y_mi, self.bi
@@ -0,0 +1,110 @@
+import tensorflow as tf
+import numpy as np
+from PIL import Image
+
+from dataloaders.DatasetFileLoader import DatasetFileLoader
+from utils.img_utils import get_images_pathlist_labels, split_train_val, cast_pixels
+from utils.bag_producer import BagProducer, bag_size
+from utils.stain_norm import stain_normalized_paths
+
+import logging
+import pprint
+import random
+import atexit
+
+
+class ProcessPoolLoader(DatasetFileLoader):
+    """
+
+    Training bags produced by a pool of worker processes (see utils.bag_producer)
+    Config.producer_workers processes decode the PNGs, cut, resize and rotate the patches in
+    NumPy and write whole batches into a shared-memory ring of Config.producer_slots slots,
+    the training dataset copies each batch out of its slot and frees the slot (from_generator
+    reads ahead of the training step). The batches follow one random permutation of the training images
+    per epoch, like DatasetFileLoader. Color augmentation stays in the graph (color_augment).
+    Validation is the DatasetFileLoader pipeline (deterministic, no augmentation)
+
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.pixel_dtype = tf.as_dtype(self.config.pipeline_dtype)
+        self.n_times_90 = int(random.choice(np.array(self.config.rotation_angles, dtype=np.int16) / 90))
+        # validation reads the full resolution PNGs without the optional DatasetFileLoader tables
+        self.tissue_keep = None
+        self.tissue_crops = None
+        self.pyramid = None
+        self.image_cache = None
+        self.val_cache = None
+
+        if (config.train_on_subset):
+            images_labels = get_images_pathlist_labels(n = int(self.config.subset_size/4))
+        else:
+            images_labels = get_images_pathlist_labels()
+
+        train_images, train_labels, train_bi, val_images, val_labels, val_bi = split_train_val(
+            *images_labels,
+            ratio = self.config.train_val_split,
+            pre_shuffle = True)
+
+        logging.info(f"Number of Training Images and Labels: {pprint.pformat(train_labels.shape[0])}")
+        logging.info(f"Number of    Val   Images and Labels: {pprint.pformat(val_labels.shape[0])}")
+
+        # stain normalized copies of the images (see build_stain_normalized.py)
+        if (self.config.stain_normalization != 'none'):
+            train_images = stain_normalized_paths(train_images, self.config.stain_normalized_dir,
+                                                  self.config.stain_normalization)
+            val_images = stain_normalized_paths(val_images, self.config.stain_normalized_dir,
+                                                self.config.stain_normalization)
+            logging.info(f"Stain normalization: {pprint.pformat(self.config.stain_normalization)}")
+
+        # the image shape comes from the PNG header: no TF session before the workers are forked
+        w, h = Image.open(train_images[0]).size
+        image_shape = (h, w, self.config.channels)
+        self.config.patch_count = bag_size(image_shape, self.config.patch_size, self.config.n_random_patches,
+                                           'sequential_full', self.config.patches_overlap)
+        logging.info(f"Precomputed number of patches per image: {pprint.pformat(self.config.patch_count)}")
+
+        params = {'batch_size': self.config.batch_size, 'patch_size': self.config.patch_size,
+                  'n_patches': self.config.n_random_patches, 'scheme': self.config.patch_generation_scheme,
+                  'overlap': self.config.patches_overlap, 'size': 227, 'n_times_90': self.n_times_90,
+                  'random_rotation': self.config.random_rotation_patches,
+                  'rotation': self.config.patch_rotation, 'residual_angle': self.config.patch_rotation_residual,
+                  'interpolation': self.config.interpolation, 'mode': self.config.mode}
+        self.producer = BagProducer(train_images, train_labels, train_bi, params, image_shape,
+                                    n_workers = self.config.producer_workers, n_slots = self.config.producer_slots,
+                                    seed = self.config.random_seed)
+        atexit.register(self.producer.close)
+
+        logging.info(f"Producer workers: {pprint.pformat(self.config.producer_workers)}, "
+                     f"ring: {pprint.pformat(self.config.producer_slots)} slots, "
+                     f"{pprint.pformat(self.producer.ring.nbytes / 2**20)} MB")
+
+        # training dataset
+
+        c = self.config.channels
+        self.train_dataset = tf.data.Dataset.from_generator(
+            self.producer.batches, (tf.uint8, tf.int32, tf.int32, tf.int64),
+            (tf.TensorShape([None, 227, 227, c]), tf.TensorShape([None]), tf.TensorShape([None]),
+             tf.TensorShape([None])))
+        self.train_dataset = self.train_dataset.map(
+            lambda x, y, y_mi, bi: (self.color_augment(cast_pixels(x, self.pixel_dtype)), y, y_mi, bi),
+            num_parallel_calls = self.config.num_parallel_cores)
+        self.train_dataset = self.train_dataset.prefetch(2)
+
+        self.iterator = tf.data.Iterator.from_structure(self.train_dataset.output_types,
+                                                        self.train_dataset.output_shapes)
+
+        self.training_init_op = self.iterator.make_initializer(self.train_dataset)
+
+        # validation dataset
+
+        self.val_dataset = self.make_val_dataset(val_images, val_labels, val_bi, repeat = True).prefetch(1)
+
+        self.val_init_op = self.iterator.make_initializer(self.val_dataset)
+
+        self.len_x_train = train_labels.shape[0]
+        self.num_iterations_train = self.len_x_train // self.config.batch_size
+
+        self.len_x_val = val_labels.shape[0]
+        self.num_iterations_val = self.len_x_val // self.config.batch_size
@@ -0,0 +1,72 @@
+import tensorflow as tf
+import numpy as np
+
+from utils.batch_recording import read_batches, FIELDS
+
+import logging
+import pprint
+
+
+class ReplayLoader:
+    """
+
+    Replaying batches recorded from another loader (see record_batches.py)
+    The recorded batches are loaded once into variables (host memory, outside the graph
+    definition and the checkpoints) and each get_input() step slices the next one out of
+    them, in the recorded order, with no tf.data pipeline, decoding or augmentation.
+    initialize() restarts the sequence, training and validation both replay the recording,
+    so the model step time is measured on the same inputs run after run
+    Exposes the same get_input / initialize interface as the other loaders
+
+    """
+
+    def __init__(self, config, path = None):
+        self.config = config
+        metadata, batches = read_batches(path or self.config.replay_batches_path)
+        if ((metadata['mode'] == 'mi_branch') != (self.config.mode == 'mi_branch')):
+            # the labels are per bag in mi_branch mode, per patch otherwise
+            raise ValueError(f"The batches were recorded in mode '{metadata['mode']}', "
+                             f"not compatible with mode '{self.config.mode}'")
+        self.config.patch_count = metadata['patch_count']
+        self.n_batches = len(batches)
+
+        # each field concatenated over the batches, with the offset of every batch
+        self.arrays, self.feeds = {}, {}
+        with tf.variable_scope('replay'):
+            for i, name in enumerate(FIELDS):
+                values = np.concatenate([batch[i] for batch in batches])
+                sizes = np.array([batch[i].shape[0] for batch in batches], dtype=np.int64)
+                placeholder = tf.placeholder(tf.as_dtype(values.dtype), shape=values.shape)
+                variable = tf.Variable(placeholder, trainable = False, collections = [], name = name)
+                self.feeds[placeholder] = values
+                self.arrays[name] = (variable, tf.constant(np.cumsum(sizes) - sizes), tf.constant(sizes))
+            self.step = tf.Variable(0, dtype = tf.int64, trainable = False, collections = [], name = 'step')
+        self.load_op = tf.group(*[variable.initializer for variable, _, _ in self.arrays.values()])
+        self.loaded = False
+        self.inputs = None
+
+        logging.info(f"Replayed batches: {pprint.pformat(self.n_batches)} from "
+                     f"{pprint.pformat(path or self.config.replay_batches_path)}, "
+                     f"{pprint.pformat(sum(v.nbytes for v in self.feeds.values()) / 2**20)} MB")
+        logging.info(f"Recorded with: {pprint.pformat(metadata)}")
+
+        self.num_iterations_train = self.n_batches
+        self.num_iterations_val = self.n_batches
+
+    def initialize(self, sess, train = True):
+        if (not self.loaded):
+            sess.run(self.load_op, feed_dict = self.feeds)
+            self.feeds = None
+            self.loaded = True
+        sess.run(self.step.initializer)
+
+    def get_input(self):
+        if (self.inputs is None):
+            # one step per session run, shared by the four outputs
+            i = tf.mod(tf.assign_add(self.step, 1) - 1, self.n_batches)
+            inputs = []
+            for variable, offsets, sizes in self.arrays.values():
+                # strided slice of the variable, the instance shape stays static
+                inputs.append(variable[offsets[i] : offsets[i] + sizes[i]])
+            self.inputs = tuple(inputs)
+        return self.inputs
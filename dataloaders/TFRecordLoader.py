@@ -0,0 +1,99 @@
+import tensorflow as tf
+import numpy as np
+
+from dataloaders.DatasetFileLoader import DatasetFileLoader
+from utils.tfrecord_shards import worker_shards, interleaved_records, parse_example, read_metadata
+from utils.numpy_ops import patch_positions
+
+import logging
+import pprint
+import random
+import os
+
+
+class TFRecordLoader(DatasetFileLoader):
+    """
+
+    Loading images from the sharded TFRecord store (see build_tfrecord_shards.py)
+    The train/ and val/ splits are written once, records hold raw uint8 pixels, so there is
+    no PNG decode. Config.tfrecord_readers shards are read in parallel and interleaved, and
+    worker Config.tfrecord_worker_index of Config.tfrecord_num_workers reads only its own
+    (every tfrecord_num_workers-th) shards, e.g. one worker per node.
+    From the decoded images on, the pipeline is the one of DatasetFileLoader
+
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.pixel_dtype = tf.as_dtype(self.config.pipeline_dtype)
+        self.n_times_90 = int(random.choice(np.array(self.config.rotation_angles, dtype=np.int16) / 90))
+        # not available on the records
+        self.tissue_keep = None
+        self.tissue_crops = None
+        self.pyramid = None
+        self.image_cache = None
+        self.val_cache = None
+
+        train_dir = os.path.join(self.config.tfrecord_dir, 'train')
+        val_dir = os.path.join(self.config.tfrecord_dir, 'val')
+        worker = (self.config.tfrecord_worker_index, self.config.tfrecord_num_workers)
+        train_shards, self.len_x_train = worker_shards(train_dir, *worker)
+        val_shards, self.len_x_val = worker_shards(val_dir, *worker)
+
+        logging.info(f"TFRecord shards (worker {worker[0]} of {worker[1]}): "
+                     f"{pprint.pformat(len(train_shards))} train, {pprint.pformat(len(val_shards))} val")
+        logging.info(f"Number of Training Images and Labels: {pprint.pformat(self.len_x_train)}")
+        logging.info(f"Number of    Val   Images and Labels: {pprint.pformat(self.len_x_val)}")
+
+        # same count as get_patch_count, from the stored image shape
+        p = self.config.patch_size
+        image_shape = read_metadata(train_dir)['image_shape']
+        self.config.patch_count = len(patch_positions(image_shape[:2], (p, p), self.config.patches_overlap))
+        logging.info(f"Precomputed number of patches per image: {pprint.pformat(self.config.patch_count)}")
+
+        # training dataset
+
+        self.train_dataset = interleaved_records(train_shards, self.config.tfrecord_readers, shuffle = True,
+                                                 seed = self.config.random_seed)
+        # shuffled as serialized records, a buffer of whole images
+        self.train_dataset = self.train_dataset.shuffle(self.config.tfrecord_shuffle_buffer,
+                                                        reshuffle_each_iteration = True).repeat()
+        self.train_dataset = self.train_dataset.map(self.parse_record,
+                                                    num_parallel_calls = self.config.num_parallel_cores)
+        self.train_dataset = self.train_dataset.map(self.preprocess_train,
+                                                    num_parallel_calls = self.config.num_parallel_cores)
+        self.train_dataset = self.train_dataset.batch(self.config.batch_size)
+        if (self.config.train_on_patches):
+            self.train_dataset = self.train_dataset.map(
+                self.get_patches_train, num_parallel_calls = self.config.num_parallel_cores)
+        self.train_dataset = self.train_dataset.map(self.patch_augment,
+                                                    num_parallel_calls = self.config.num_parallel_cores)
+        self.train_dataset = self.train_dataset.prefetch(10)
+
+        self.iterator = tf.data.Iterator.from_structure(self.train_dataset.output_types,
+                                                        self.train_dataset.output_shapes)
+
+        self.training_init_op = self.iterator.make_initializer(self.train_dataset)
+
+        # validation dataset
+
+        self.val_dataset = interleaved_records(val_shards, self.config.tfrecord_readers).repeat()
+        self.val_dataset = self.val_dataset.map(self.parse_record,
+                                                num_parallel_calls = self.config.num_parallel_cores)
+        self.val_dataset = self.val_dataset.map(self.preprocess_val,
+                                                num_parallel_calls = self.config.num_parallel_cores)
+        self.val_dataset = self.val_dataset.batch(self.config.batch_size)
+        if (self.config.train_on_patches):
+            self.val_dataset = self.val_dataset.map(
+                self.get_patches_val, num_parallel_calls = self.config.num_parallel_cores)
+        self.val_dataset = self.val_dataset.prefetch(1)
+
+        self.val_init_op = self.iterator.make_initializer(self.val_dataset)
+
+        self.num_iterations_train = self.len_x_train // self.config.batch_size
+        self.num_iterations_val = self.len_x_val // self.config.batch_size
+
+    def parse_record(self, serialized):
+        image, label, bag_index = parse_example(serialized)
+        image.set_shape([None, None, 3])
+        return image, label, label, bag_index
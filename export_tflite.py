@@ -0,0 +1,80 @@
+import argparse
+import logging
+import pprint
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from dataloaders.PlaceholderLoader import PlaceholderLoader
+from optimize_graph import get_inference_io
+from utils.graph_utils import optimize_for_inference, save_graph_def
+from utils.quantization import calibration_patches, backbone_graph_def, head_weights, convert_to_tflite
+from utils.tflite_runner import BACKBONE_FILE, HEAD_FILE, METADATA_FILE
+from utils.dirs import create_dirs
+from run import create_model
+
+from config import Config
+
+
+# run this script from the root directory to export the trained model in Config.checkpoint_dir
+# for utils.tflite_runner.TFLiteBagRunner:
+#   backbone.tflite       backbone (patch --> embedding), float32 or int8
+#   head.npz              weights of the logits_mi / logits_si heads (and of the hash / hash_mi layers)
+#   metadata.json         tiling and pooling parameters
+#   inference_graph.pb    optimized TF graph of the full model (for the TF session path)
+
+def export_tflite(config, output_dir, quantize = False, calibration_batches = 10):
+    create_dirs([output_dir])
+
+    tf.reset_default_graph()
+    data_loader = PlaceholderLoader(config)
+    model = create_model(data_loader, config)
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        model.load(sess)
+
+        graph_def, input_name, output_name = backbone_graph_def(sess, data_loader, model)
+
+        heads = {}
+        for name in ['logits_mi', 'logits_si', 'hash', 'hash_mi']:
+            weights = head_weights(sess, name)
+            if (weights is not None):
+                heads[name + '_weights'], heads[name + '_biases'] = weights
+
+        input_names, output_names = get_inference_io(data_loader, model)
+        full_graph_def = optimize_for_inference(sess, input_names, output_names,
+                                                training_flag_name = model.is_training.op.name)
+
+    calibration = calibration_patches(config, calibration_batches) if quantize else None
+    tflite_model = convert_to_tflite(graph_def, input_name, output_name, calibration_images = calibration)
+
+    with open(os.path.join(output_dir, BACKBONE_FILE), 'wb') as f:
+        f.write(tflite_model)
+    np.savez(os.path.join(output_dir, HEAD_FILE), **heads)
+    save_graph_def(full_graph_def, os.path.join(output_dir, 'inference_graph.pb'))
+
+    metadata = {'model_type': config.model_type,
+                'quantized': quantize,
+                'num_classes': config.num_classes,
+                'patch_size': config.patch_size,
+                'patches_overlap': config.patches_overlap,
+                'pooling': config.pooling,
+                'tf_graph': {'path': 'inference_graph.pb', 'inputs': input_names, 'outputs': output_names}}
+    with open(os.path.join(output_dir, METADATA_FILE), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+    logging.info(f"Exported TFLite model to: {pprint.pformat(output_dir)}")
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Export the backbone to TFLite and the MI head to NumPy')
+    argparser.add_argument('-o', '--output_dir', default='checkpoints/tflite')
+    argparser.add_argument('--int8', action='store_true', help='Quantize the backbone to int8')
+    argparser.add_argument('--calibration_batches', type=int, default=10)
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+    export_tflite(Config, args.output_dir, quantize = args.int8, calibration_batches = args.calibration_batches)
@@ -0,0 +1,75 @@
+import argparse
+import logging
+import pprint
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+from tqdm import tqdm
+
+from dataloaders.PlaceholderLoader import PlaceholderLoader
+from utils.img_utils import get_images_pathlist_labels
+from utils.numpy_ops import extract_patches_numpy, patch_positions
+from utils.embedding_store import EmbeddingStoreWriter
+from run import create_model
+
+from config import Config
+
+
+# run this script from the root directory to extract the patch embeddings of the trained
+# backbone in Config.checkpoint_dir (sequential tiling with Config.patch_size and
+# Config.patches_overlap) into Config.embedding_store_dir, for head-only training
+
+def extract_features(config, get_tensor, make_writer, chunk_size = 64, paths = None, labels = None):
+    """
+    Run the trained model over the sequential patches of every image and write a feature
+    tensor of each patch to a store
+    :param get_tensor: function model --> tensor to store (e.g. the embedding)
+    :param make_writer: function (n_patches_total, feature shape) --> store writer
+    :param paths, labels: images to process, by default the whole dataset
+    """
+    if (paths is None):
+        paths, labels, _ = get_images_pathlist_labels()
+    p = config.patch_size
+    counts = [len(patch_positions(Image.open(path).size[::-1], (p, p), config.patches_overlap)) for path in paths]
+
+    tf.reset_default_graph()
+    data_loader = PlaceholderLoader(config)
+    model = create_model(data_loader, config)
+    tensor = get_tensor(model)
+    writer = make_writer(int(np.sum(counts)), tensor.shape.as_list()[1:])
+
+    with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
+        sess.run(tf.global_variables_initializer())
+        model.load(sess)
+
+        for path, label in tqdm(zip(paths, labels), total=len(paths), desc="features"):
+            image = np.asarray(Image.open(path).convert('RGB'))
+            patches = extract_patches_numpy(image, size=(p, p), overlap = config.patches_overlap)
+            if (p != 227):
+                patches = np.stack([np.asarray(Image.fromarray(x).resize((227, 227), Image.BILINEAR)) for x in patches])
+
+            features = np.concatenate([sess.run(tensor, feed_dict={data_loader.x: patches[i : i + chunk_size],
+                                                                   model.is_training: False})
+                                       for i in range(0, patches.shape[0], chunk_size)])
+            writer.add(path, label, features, patch_positions(image.shape, (p, p), config.patches_overlap))
+
+    writer.close()
+
+
+def extract_embeddings(config, chunk_size = 64):
+    metadata = {'model_type': config.model_type, 'checkpoint_dir': config.checkpoint_dir,
+                'patch_size': config.patch_size, 'patches_overlap': config.patches_overlap}
+    make_writer = lambda n, shape: EmbeddingStoreWriter(config.embedding_store_dir, n, shape[0],
+                                                        dtype = config.embedding_dtype, metadata = metadata)
+    extract_features(config, lambda model: model.embedding, make_writer, chunk_size)
+    logging.info(f"Embedding store written to: {pprint.pformat(config.embedding_store_dir)}")
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Extract patch embeddings of a trained backbone')
+    argparser.add_argument('--chunk_size', type=int, default=64, help='Patches per forward pass')
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+    extract_embeddings(Config, args.chunk_size)
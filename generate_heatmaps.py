@@ -0,0 +1,119 @@
+import argparse
+import logging
+import pprint
+import time
+import os
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from dataloaders.PlaceholderLoader import PlaceholderLoader
+from predict_slide import slide_embedder
+from utils.img_utils import get_images_pathlist_labels
+from utils.numpy_ops import extract_patches_numpy, patch_positions, dense_numpy, softmax_numpy
+from utils.heatmap import HeatmapAccumulator, overlay_png
+from utils.quantization import head_weights
+from utils.slide_tiler import SlideTileReader, read_ahead_map, batch_tiles
+from utils.dirs import create_dirs
+from run import create_model
+
+from config import Config
+
+
+# run this script from the root directory to write the SI branch class probability maps of
+# images (PNG) or whole slides (tiled TIFF) with the trained model in Config.checkpoint_dir:
+#   python generate_heatmaps.py --dataset -o heatmaps
+#   python generate_heatmaps.py slide.tif --tissue_threshold 0.5 -o heatmaps
+# Sliding windows of Config.patch_size every (1 - Config.patches_overlap) * patch_size pixels
+# are classified in batches and stitched into a map with one cell per stride. For each input
+# <name>_heatmap.npy (cells X classes, float16) and <name>_overlay.png are written.
+# Images are decoded ahead of the model on reader threads, slides are streamed.
+
+SLIDE_EXTENSIONS = ('.tif', '.tiff', '.svs')
+
+
+def si_classifier(sess, data_loader, model):
+    heads = {name: head_weights(sess, name) for name in ['logits_si', 'hash']}
+    if (heads['logits_si'] is None):
+        raise ValueError("Heatmaps need the SI branch, train with mode 'si_branch' or 'si_mi_branch'")
+    embed = slide_embedder(sess, data_loader, model)
+
+    def classify(tiles):
+        x = embed(tiles)
+        if (heads['hash'] is not None):
+            x = np.tanh(dense_numpy(x, *heads['hash']))
+        return softmax_numpy(dense_numpy(x, *heads['logits_si']))
+    return classify
+
+
+def read_image_windows(path, size, overlap):
+    image = np.asarray(Image.open(path).convert('RGB'))
+    windows = extract_patches_numpy(image, size=(size, size), overlap = overlap)
+    return path, image, windows, patch_positions(image.shape, (size, size), overlap)
+
+
+def stitch(batches, accumulator, size, classify):
+    n = 0
+    for positions, tiles in batches:
+        accumulator.add(positions, size, classify(tiles))
+        n += tiles.shape[0]
+    return n
+
+
+def main(config, inputs, output_dir, batch_size = 64, level = 0, tissue_threshold = None, memmap = False):
+    create_dirs([output_dir])
+    p = config.patch_size
+    stride = int((1 - config.patches_overlap) * p)
+
+    tf.reset_default_graph()
+    data_loader = PlaceholderLoader(config)
+    model = create_model(data_loader, config)
+
+    slides = [path for path in inputs if path.lower().endswith(SLIDE_EXTENSIONS)]
+    images = [path for path in inputs if not path.lower().endswith(SLIDE_EXTENSIONS)]
+    name = lambda path: os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0])
+
+    with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
+        sess.run(tf.global_variables_initializer())
+        model.load(sess)
+        classify = si_classifier(sess, data_loader, model)
+
+        start, n_windows = time.perf_counter(), 0
+        for path, image, windows, positions in read_ahead_map(read_image_windows,
+                                                              ((path, p, config.patches_overlap) for path in images),
+                                                              read_ahead = 2, num_workers = 2):
+            accumulator = HeatmapAccumulator(image.shape[:2], stride, config.num_classes)
+            n_windows += stitch(((positions[i : i + batch_size], windows[i : i + batch_size])
+                                 for i in range(0, windows.shape[0], batch_size)), accumulator, p, classify)
+            accumulator.save(name(path) + '_heatmap.npy')
+            overlay_png(accumulator.probabilities(), image, name(path) + '_overlay.png')
+
+        for path in slides:
+            reader = SlideTileReader(path, level = level, tissue_threshold = tissue_threshold)
+            accumulator = HeatmapAccumulator((reader.height, reader.width), stride, config.num_classes,
+                                             path = name(path) if memmap else None)
+            n_windows += stitch(batch_tiles(reader.windows(p, stride), batch_size), accumulator, p, classify)
+            overlay_png(accumulator.probabilities(), reader.levels[-1].asarray()[..., :3], name(path) + '_overlay.png')
+            accumulator.save(name(path) + '_heatmap.npy')
+            reader.close()
+
+        seconds = time.perf_counter() - start
+        logging.info(f"Heatmaps written to: {pprint.pformat(output_dir)}")
+        logging.info(f"{len(inputs)} inputs, {n_windows} windows in {seconds:.1f} s ({n_windows / seconds:.1f} windows/s)")
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='SI branch probability heatmaps of images and whole slides')
+    argparser.add_argument('inputs', nargs='*', help='PNG images and / or tiled TIFF slides')
+    argparser.add_argument('--dataset', action='store_true', help='All the images of the dataset')
+    argparser.add_argument('-o', '--output_dir', default='heatmaps')
+    argparser.add_argument('--batch_size', type=int, default=64, help='Windows per forward pass')
+    argparser.add_argument('--level', type=int, default=0, help='Pyramid level of the slides')
+    argparser.add_argument('--tissue_threshold', type=float, default=None, help='Skip background windows of slides')
+    argparser.add_argument('--memmap', action='store_true', help='Accumulate slide maps on disk')
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+    inputs = list(args.inputs) + (list(get_images_pathlist_labels()[0]) if args.dataset else [])
+    main(Config, inputs, args.output_dir, args.batch_size, args.level, args.tissue_threshold, args.memmap)
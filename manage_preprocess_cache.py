@@ -0,0 +1,61 @@
+import argparse
+import logging
+import pprint
+import time
+
+from utils.preprocess_cache import PreprocessCache
+
+from config import Config
+
+
+# run this script from the root directory to inspect or prune the preprocessing cache
+# (Config.preprocess_cache_dir, see utils/preprocess_cache.py):
+#   python manage_preprocess_cache.py list
+#   python manage_preprocess_cache.py prune --max_mb 4096
+#   python manage_preprocess_cache.py prune --stage image_pyramid --unused_days 30
+
+def list_entries(cache):
+    entries = cache.entries()
+    print('{:<18} {:<18} {:>10} {:>10} {:>12}  {}'.format('stage', 'key', 'MB', 'build (s)', 'unused (d)',
+                                                        'parameters'))
+    for e in reversed(entries):
+        print('{:<18} {:<18} {:>10.1f} {:>10.1f} {:>12.1f}  {}'.format(
+            e['stage'], e['key'], e['nbytes'] / 2**20, e['build_seconds'], (time.time() - e['last_used']) / 86400,
+            e['params']))
+    print('{} entries, {:.1f} MB'.format(len(entries), sum(e['nbytes'] for e in entries) / 2**20))
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Inspect or prune the preprocessing cache')
+    argparser.add_argument('--cache_dir', default=Config.preprocess_cache_dir)
+    subparsers = argparser.add_subparsers(dest='command')
+    subparsers.required = True
+    subparsers.add_parser('list', help='entries, most recently used first')
+    prune_parser = subparsers.add_parser('prune', help='remove entries')
+    prune_parser.add_argument('--max_mb', type=float, default=None,
+                              help='evict least recently used entries down to this size')
+    prune_parser.add_argument('--lease_hours', type=float, default=Config.preprocess_cache_lease_hours,
+                              help='--max_mb keeps the entries used within this many hours')
+    prune_parser.add_argument('--stage', default=None, help='remove the entries of this stage')
+    prune_parser.add_argument('--unused_days', type=float, default=None,
+                              help='remove the entries unused for this many days')
+    prune_parser.add_argument('--all', action='store_true', help='remove every entry')
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    cache = PreprocessCache(args.cache_dir, lease_hours = getattr(args, 'lease_hours', 0))
+    if (args.command == 'list'):
+        list_entries(cache)
+    else:
+        removed = []
+        if (args.all):
+            removed += cache.prune()
+        if (args.stage is not None or args.unused_days is not None):
+            removed += cache.prune(stage = args.stage, unused_days = args.unused_days)
+        if (args.max_mb is not None):
+            removed += cache.evict(args.max_mb * 2**20)
+        for e in removed:
+            logging.info(f"Removed {e['stage']} {e['key']} ({pprint.pformat(e['nbytes'] / 2**20)} MB)")
+        logging.info(f"{pprint.pformat(len(removed))} entries removed, "
+                     f"{pprint.pformat(sum(e['nbytes'] for e in removed) / 2**20)} MB freed")
@@ -56,7 +56,7 @@ class AlexNet(BaseModel):
 
         print("network arch alexnet")
         with tf.variable_scope('network'):
-            self.logits, end_points = alexnet.alexnet_v2(inputs=self.x, num_classes=self.num_classes)
+            self.logits, end_points = alexnet.alexnet_v2(inputs=self.input_layer(self.x), num_classes=self.num_classes)
 #            self.logits = tf.squeeze(self.logits, axis=[1, 2])
 
             print("network output alexnet")
@@ -1,6 +1,8 @@
 import tensorflow as tf
+from tensorflow.contrib.layers import fully_connected
 from utils.model_utils import acc_majority_class
 import numpy as np
+import os
 
 class BaseModel:
     def __init__(self, config):
@@ -29,22 +31,50 @@ class BaseModel:
         # save attribute .. NOTE DON'T FORGET TO CONSTRUCT THE SAVER ON YOUR MODEL
         self.saver = None
 
+        # where save / load write and read the checkpoints (models holding only part of the
+        # network variables use their own directory, see ResNet18_MI)
+        self.checkpoint_dir = self.config.checkpoint_dir
+
     # save function that saves the checkpoint in the path defined in the config file
     def save(self, sess, best = False):
-        path = self.config.checkpoint_dir
+        path = self.checkpoint_dir
         if (best):
             path += '_best'
         print("Saving model...")
-        self.saver.save(sess, self.config.checkpoint_dir, self.global_step_tensor)
+        self.saver.save(sess, self.checkpoint_dir, self.global_step_tensor)
         print("Model saved")
 
     # load latest checkpoint from the experiment path defined in the config file
     def load(self, sess):
-        latest_checkpoint = tf.train.latest_checkpoint(self.config.checkpoint_dir)
+        latest_checkpoint = tf.train.latest_checkpoint(self.checkpoint_dir)
         if latest_checkpoint:
             print("Loading model checkpoint {} ...\n".format(latest_checkpoint))
             self.saver.restore(sess, latest_checkpoint)
             print("Model loaded")
+        elif (self.checkpoint_dir != self.config.checkpoint_dir):
+            self.warm_start(sess, self.config.checkpoint_dir)
+
+    # own checkpoint directory of a model holding only part of the network variables
+    def part_checkpoint_dir(self, suffix):
+        checkpoint_dir = os.path.join(self.config.checkpoint_dir.rstrip('/') + '_' + suffix, '')
+        if (not os.path.exists(checkpoint_dir)):
+            os.makedirs(checkpoint_dir)
+        return checkpoint_dir
+
+    # restore the network variables of this graph found in the full model checkpoint, the
+    # epoch / step counters and the optimizer slots keep their initial values
+    def warm_start(self, sess, checkpoint_dir):
+        latest_checkpoint = tf.train.latest_checkpoint(checkpoint_dir)
+        if (not latest_checkpoint):
+            return
+        shapes = dict(tf.train.list_variables(latest_checkpoint))
+        slots = set(self.optimizer.get_slot(v, name) for v in tf.trainable_variables()
+                    for name in self.optimizer.get_slot_names())
+        var_list = [v for v in tf.global_variables() if v.op.name.startswith('network/') and v not in slots and
+                    shapes.get(v.op.name) == v.shape.as_list()]
+        if (len(var_list) > 0):
+            print("Warm start of {} variables from {} ...\n".format(len(var_list), latest_checkpoint))
+            tf.train.Saver(var_list).restore(sess, latest_checkpoint)
     
     # just initialize a tensorflow variable to use it as epoch counter
     def init_cur_epoch(self):
@@ -107,7 +137,10 @@ class BaseModel:
         print("Pooled reshaped: ", pooled.shape)
         return pooled
     
-    def mi_pool_layer(self, input_vector, bag_indices, pooling = 'average'):
+    def mi_pool_layer(self, input_vector, bag_indices, pooling = 'average', scale_indices = None):
+        if (scale_indices is not None):
+            return self.multi_scale_pool_layer(input_vector, bag_indices, scale_indices, pooling)
+
         _, idx = tf.unique(bag_indices)
         reshaped = tf.dynamic_partition(input_vector, idx, num_partitions=self.config.batch_size)
 
@@ -120,7 +153,67 @@ class BaseModel:
             
         return tf.stack(pooled)
 
+    def multi_scale_pool_layer(self, input_vector, bag_indices, scale_indices, pooling = 'average'):
+        """
+        Pool the instances of each scale of a bag separately (see MultiScaleLoader),
+        then fuse the per-scale vectors with Config.scale_fusion
+        Every bag has instances at every scale, so the bags come out in the same order
+        """
+        pooled = []
+        for s in range(len(self.config.multi_scale_levels)):
+            mask = tf.equal(scale_indices, s)
+            pooled.append(self.mi_pool_layer(tf.boolean_mask(input_vector, mask),
+                                             tf.boolean_mask(bag_indices, mask), pooling))
+
+        if (self.config.scale_fusion == 'max'):
+            return tf.reduce_max(tf.stack(pooled), axis=0)
+        elif (self.config.scale_fusion == 'average'):
+            return tf.reduce_mean(tf.stack(pooled), axis=0)
+        return tf.concat(pooled, axis=-1)
+
+    def input_layer(self, x):
+        """
+        Cast the (uint8) images or patches of the loaders to float32 and normalize them with
+        Config.input_normalization, in the graph so that the input pipeline stays uint8
+        """
+        with tf.variable_scope('input_layer'):
+            x = tf.cast(x, tf.float32)
+            if (self.config.input_normalization == 'unit'):
+                x = x / 255.0
+            elif (self.config.input_normalization == 'standardize'):
+                x = (x - tf.constant(self.config.input_mean, dtype=tf.float32)) / \
+                    tf.constant(self.config.input_std, dtype=tf.float32)
+        return x
+
+    def hash_layer(self, x, pooled = False):
+        """
+        Hashing head (Deep Multiple Instance Hashing): tanh activations whose signs are the
+        binary codes, shared between the pooled bag vectors and the patch embeddings
+        Identity when Config.hash_bits is 0
+        :param pooled: x holds pooled bag vectors, which are n_scales times wider than the patch
+                       embeddings with multi-scale 'concat' fusion and get their own head then
+        """
+        if (self.config.hash_bits <= 0):
+            return x
+        scope = 'hash'
+        if (pooled and len(self.config.multi_scale_levels) > 0 and self.config.scale_fusion == 'concat'):
+            scope = 'hash_mi'
+        h = fully_connected(x, self.config.hash_bits, activation_fn=tf.nn.tanh,
+                            normalizer_fn=None, scope=scope, reuse=tf.AUTO_REUSE)
+        tf.add_to_collection('hash_activations', h)
+        return h
+
+    def hash_quantization_loss(self):
+        # pushes the hash activations towards -1 / +1 so that the sign loses little information
+        activations = tf.get_collection('hash_activations')
+        loss = tf.add_n([tf.reduce_mean(tf.square(tf.abs(h) - 1.0)) for h in activations]) / len(activations)
+        return self.config.hash_quantization_weight * loss
+
     def evaluate_accuracy(self, y, preds, is_training, n_patches):
+        # majority vote over consecutive groups of n_patches, wrong once background tiles are dropped
+        if (self.config.use_tissue_mask):
+            raise ValueError("Config.use_tissue_mask gives bags of varying size, not supported by the single "
+                             "instance models (majority vote over Config.patch_count patches), use the MI models")
         return tf.cond(is_training,
                        lambda: tf.reduce_mean(tf.cast(tf.equal(y, preds), tf.float32)),
                        lambda: acc_majority_class(y, preds, n_patches))
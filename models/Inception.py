@@ -54,7 +54,7 @@ class Inception(BaseModel):
 
         print("network arch inception")
         with tf.variable_scope('network'):
-            self.logits, end_points = inception_v3.inception_v3(inputs=self.x, num_classes=self.num_classes)
+            self.logits, end_points = inception_v3.inception_v3(inputs=self.input_layer(self.x), num_classes=self.num_classes)
             #self.logits = tf.squeeze(self.logits, axis=[1, 2])
 
             print("network output inception")
@@ -49,7 +49,7 @@ class LeNet(BaseModel):
         Network Architecture
         """
         with tf.variable_scope('network'):
-            net = slim.conv2d(self.x, 20, [5,5], scope='conv1')
+            net = slim.conv2d(self.input_layer(self.x), 20, [5,5], scope='conv1')
             net = slim.max_pool2d(net, [2,2], scope='pool1')
             net = slim.conv2d(net, 50, [5,5], scope='conv2')
             net = slim.max_pool2d(net, [2,2], scope='pool2')
@@ -0,0 +1,134 @@
+import tensorflow as tf
+from models.BaseModel import BaseModel
+from tensorflow.contrib.layers import fully_connected
+from utils.model_utils import combined_cost_function
+
+
+class MIHead(BaseModel):
+    """
+
+    Single-instance / multi-instance heads without a backbone
+    Trained on patch embeddings served by EmbeddingLoader (Config.train_head_only)
+    Variables are named like in the full MI models (network/logits_si, network/logits_mi, network/hash),
+    so trained heads can be restored into them
+
+    """
+
+    def __init__(self, data_loader, config):
+        super(MIHead, self).__init__(config)
+
+        # Get the data_loader to make the joint of the inputs in the graph
+        self.data_loader = data_loader
+
+        # define some important variables
+        self.x = None
+        self.y = None
+        self.y_mi = None
+        self.bi = None
+        self.scale_index = None
+        self.is_training = None
+        self.embedding = None
+        self.out_argmax = None
+        self.loss = None
+        self.acc = None
+        self.train_step = None
+        self.num_classes = config.num_classes
+        # head-only checkpoints are kept apart so that Config.checkpoint_dir keeps restoring
+        # into the full model (the heads start from it, the counters from 0)
+        self.checkpoint_dir = self.part_checkpoint_dir('head')
+
+        self.build_model()
+        self.init_saver()
+
+    def build_model(self):
+        """
+        :return:
+        """
+
+        """
+        Helper Variables
+        """
+        self.global_epoch_tensor = tf.Variable(0, trainable=False, name='global_epoch')
+        self.global_epoch_inc = self.global_epoch_tensor.assign(self.global_epoch_tensor + 1)
+
+        """
+        Inputs to the network
+        """
+        with tf.variable_scope('inputs'):
+            self.x, self.y, self.y_mi, self.bi = self.data_loader.get_input()
+            self.scale_index = getattr(self.data_loader, 'scale_index', None)
+            self.is_training = tf.placeholder(tf.bool, name='Training_flag')
+        tf.add_to_collection('inputs', self.x)
+        tf.add_to_collection('inputs', self.y)
+        tf.add_to_collection('inputs', self.y_mi)
+        tf.add_to_collection('inputs', self.bi)
+        tf.add_to_collection('inputs', self.is_training)
+
+        """
+        Network Architecture
+        """
+
+        with tf.variable_scope('network'):
+            net = self.x
+            self.embedding = net
+
+            if (self.config.mode == 'si_branch'):
+                self.logits = fully_connected(self.hash_layer(net), self.num_classes, activation_fn=None,
+                                              normalizer_fn=None, scope='logits_si')
+                net = self.logits
+
+            if (self.config.mode == 'mi_branch'):
+                net = self.mi_pool_layer(net, bag_indices = self.bi, pooling = self.config.pooling,
+                                         scale_indices = self.scale_index)
+                self.logits = fully_connected(self.hash_layer(net, pooled = True), self.num_classes, activation_fn=None,
+                                              normalizer_fn=None, scope='logits_mi')
+                net = self.logits
+
+            if (self.config.mode == 'si_mi_branch'):
+                pooled = self.mi_pool_layer(net, bag_indices = self.bi, pooling = self.config.pooling,
+                                            scale_indices = self.scale_index)
+                self.logits = fully_connected(self.hash_layer(pooled, pooled = True), self.num_classes, activation_fn=None,
+                                              normalizer_fn=None, scope='logits_mi')
+                self.logits_si = fully_connected(self.hash_layer(net), self.num_classes, activation_fn=None,
+                                                 normalizer_fn=None, scope='logits_si')
+                net = self.logits
+
+            with tf.variable_scope('out'):
+                self.out = tf.nn.softmax(net)
+
+            tf.add_to_collection('out', self.out)
+
+            with tf.variable_scope('out_argmax'):
+                self.out_argmax = tf.argmax(self.out, axis=-1, output_type=tf.int32, name='out_argmax')
+
+        with tf.variable_scope('loss-acc'):
+
+            if (self.config.mode == 'si_mi_branch'):
+                self.update_beta_combined_cost()
+                self.loss = combined_cost_function(self.y, self.logits_si, self.y_mi, self.logits,
+                                                   beta = self.current_beta)
+            else:
+                self.loss = tf.losses.sparse_softmax_cross_entropy(labels = self.y, logits = self.logits)
+
+            if (self.config.hash_bits > 0):
+                self.loss += self.hash_quantization_loss()
+
+            if (self.config.mode != 'si_branch'):
+                self.acc = tf.reduce_mean(tf.cast(tf.equal(self.y_mi, self.out_argmax), tf.float32))
+            else:
+                self.acc = tf.reduce_mean(tf.cast(tf.equal(self.y, self.out_argmax), tf.float32))
+
+        with tf.variable_scope('train_step'):
+            self.train_step = self.optimizer.minimize(self.loss, global_step=self.global_step_tensor)
+
+        tf.add_to_collection('test', self.out_argmax)
+        tf.add_to_collection('train', self.train_step)
+        tf.add_to_collection('train', self.loss)
+        tf.add_to_collection('train', self.acc)
+
+    def init_saver(self):
+        """
+        initialize the tensorflow saver that will be used in saving the checkpoints.
+        :return:
+        """
+        self.saver = tf.train.Saver(max_to_keep=self.config.max_to_keep, save_relative_paths=True)
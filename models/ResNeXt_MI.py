@@ -56,7 +56,13 @@ class ResNeXt_MI(BaseModel):
         self.y = None
         self.y_mi = None
         self.bi = None
+        self.scale_index = None
         self.is_training = None
+        self.embedding = None
+        # last convolutional feature map (before the global average pooling) and its
+        # stride in input pixels, for the fully-convolutional evaluation (utils.dense_eval)
+        self.feature_map = None
+        self.feature_stride = 4
         self.out_argmax = None
         self.loss = None
         self.acc = None
@@ -90,6 +96,7 @@ class ResNeXt_MI(BaseModel):
         print("Input to ResNext")
         with tf.variable_scope('inputs'):
             self.x, self.y, self.y_mi, self.bi = self.data_loader.get_input()
+            self.scale_index = getattr(self.data_loader, 'scale_index', None)
             self.is_training = tf.placeholder(tf.bool, name='Training_flag')
         tf.add_to_collection('inputs', self.x)
         tf.add_to_collection('inputs', self.y)
@@ -104,10 +111,11 @@ class ResNeXt_MI(BaseModel):
         print("network arch ResNeXt")
         with tf.variable_scope('network'):
 
-            input_x = self.first_layer(self.x, scope='first_layer')
+            input_x = self.first_layer(self.input_layer(self.x), scope='first_layer')
             x = self.residual_layer(input_x, out_dim=64, layer_num='1', res_block=self.blocks)
             x = self.residual_layer(x, out_dim=128, layer_num='2', res_block=self.blocks)
             x = self.residual_layer(x, out_dim=256, layer_num='3', res_block=self.blocks)
+            self.feature_map = x
             x = Global_Average_Pooling(x)
 
 #            x = flatten(x)
@@ -122,10 +130,11 @@ class ResNeXt_MI(BaseModel):
 #            net = tf.squeeze(net, [1, 2], name='SpatialSqueeze')
 
             end_points['resnext/spatial_squeeze'] = net
+            self.embedding = net
             print("Size after squeeze: ", net.shape)
 
             if (self.config.mode == 'si_branch'):
-                end_points['resnext/output_si'] = fully_connected(net,
+                end_points['resnext/output_si'] = fully_connected(self.hash_layer(net),
                                                                        self.num_classes, activation_fn=None,
                                                                        normalizer_fn=None, scope='logits_si')
                 self.logits = end_points['resnext/output_si']
@@ -133,11 +142,12 @@ class ResNeXt_MI(BaseModel):
                 net = end_points['resnext/output_si']
 
             if (self.config.mode == 'mi_branch'):
-                net = self.mi_pool_layer(net, bag_indices=self.bi, pooling=self.config.pooling)
+                net = self.mi_pool_layer(net, bag_indices=self.bi, pooling=self.config.pooling,
+                                         scale_indices=self.scale_index)
                 end_points['resnext/mi_pool1:0'] = net
                 print("Size after MI: ", net.shape)
 
-                end_points['resnext/output_mi'] = fully_connected(end_points['resnext/mi_pool1:0'],
+                end_points['resnext/output_mi'] = fully_connected(self.hash_layer(end_points['resnext/mi_pool1:0'], pooled = True),
                                                                        self.num_classes, activation_fn=None,
                                                                        normalizer_fn=None, scope='logits_mi')
                 self.logits = end_points['resnext/output_mi']
@@ -147,14 +157,15 @@ class ResNeXt_MI(BaseModel):
             if (self.config.mode == 'si_mi_branch'):
                 end_points['resnext/mi_pool1:0'] = self.mi_pool_layer(net,
                                                                            bag_indices=self.bi,
-                                                                           pooling=self.config.pooling)
+                                                                           pooling=self.config.pooling,
+                                                                           scale_indices=self.scale_index)
 
-                end_points['resnext/output_mi'] = fully_connected(end_points['resnext/mi_pool1:0'],
+                end_points['resnext/output_mi'] = fully_connected(self.hash_layer(end_points['resnext/mi_pool1:0'], pooled = True),
                                                                        self.num_classes, activation_fn=None,
                                                                        normalizer_fn=None, scope='logits_mi')
                 self.logits = end_points['resnext/output_mi']
 
-                end_points['resnext/output_si'] = fully_connected(net,
+                end_points['resnext/output_si'] = fully_connected(self.hash_layer(net),
                                                                        self.num_classes, activation_fn=None,
                                                                        normalizer_fn=None, scope='logits_si')
                 self.logits_si = end_points['resnext/output_si']
@@ -185,6 +196,9 @@ class ResNeXt_MI(BaseModel):
             else:
                 self.loss = tf.losses.sparse_softmax_cross_entropy(labels = self.y, logits = self.logits)
 
+            if (self.config.hash_bits > 0):
+                self.loss += self.hash_quantization_loss()
+
             if (self.config.mode != 'si_branch'):
                 self.acc = tf.reduce_mean(tf.cast(tf.equal(self.y_mi, self.out_argmax), tf.float32))
             else:
@@ -25,7 +25,13 @@ class ResNet18_MI(BaseModel):
         self.y = None
         self.y_mi = None
         self.bi = None
+        self.scale_index = None
         self.is_training = None
+        self.embedding = None
+        # last convolutional feature map (before the global average pooling) and its
+        # stride in input pixels, for the fully-convolutional evaluation (utils.dense_eval)
+        self.feature_map = None
+        self.feature_stride = 32
         self.out_argmax = None
         self.loss = None
         self.acc = None
@@ -35,6 +41,15 @@ class ResNet18_MI(BaseModel):
         self._flops = 0
         self._weights = 0
 
+        # stage name --> output tensor, and the stage whose cached activations are fed as input
+        # (set by ActivationCacheLoader when the backbone prefix is frozen, see Config.freeze_until)
+        self.stage_outputs = {}
+        self.freeze_until = getattr(data_loader, 'cached_stage', 'none')
+        if (self.freeze_until != 'none'):
+            # the suffix-only graph has no prefix variables, its checkpoints are kept apart so that
+            # Config.checkpoint_dir keeps restoring into the full model (the suffix starts from it)
+            self.checkpoint_dir = self.part_checkpoint_dir('from_' + self.freeze_until)
+
         self.build_model()
         self.init_saver()
 
@@ -46,28 +61,48 @@ class ResNet18_MI(BaseModel):
         kernels = [7, 3, 3, 3, 3]
         strides = [2, 0, 2, 2, 2]
 
-        # conv1
-        with tf.variable_scope('conv1'):
-            x = self._conv(self.x, kernels[0], filters[0], strides[0])
-            x = self._bn(x)
-            x = self._relu(x)
-            x = tf.nn.max_pool(x, [1, 3, 3, 1], [1, 2, 2, 1], 'SAME')
-
-        # conv2_x
-        x = self._residual_block(x, name='conv2_1')
-        x = self._residual_block(x, name='conv2_2')
-
-        # conv3_x
-        x = self._residual_block_first(x, filters[2], strides[2], name='conv3_1')
-        x = self._residual_block(x, name='conv3_2')
-
-        # conv4_x
-        x = self._residual_block_first(x, filters[3], strides[3], name='conv4_1')
-        x = self._residual_block(x, name='conv4_2')
-
-        # conv5_x
-        x = self._residual_block_first(x, filters[4], strides[4], name='conv5_1')
-        x = self._residual_block(x, name='conv5_2')
+        def conv1(x):
+            with tf.variable_scope('conv1'):
+                x = self._conv(x, kernels[0], filters[0], strides[0])
+                x = self._bn(x)
+                x = self._relu(x)
+                x = tf.nn.max_pool(x, [1, 3, 3, 1], [1, 2, 2, 1], 'SAME')
+            return x
+
+        def conv2_x(x):
+            x = self._residual_block(x, name='conv2_1')
+            x = self._residual_block(x, name='conv2_2')
+            return x
+
+        def conv3_x(x):
+            x = self._residual_block_first(x, filters[2], strides[2], name='conv3_1')
+            x = self._residual_block(x, name='conv3_2')
+            return x
+
+        def conv4_x(x):
+            x = self._residual_block_first(x, filters[3], strides[3], name='conv4_1')
+            x = self._residual_block(x, name='conv4_2')
+            return x
+
+        def conv5_x(x):
+            x = self._residual_block_first(x, filters[4], strides[4], name='conv5_1')
+            x = self._residual_block(x, name='conv5_2')
+            return x
+
+        stages = [('conv1', conv1), ('conv2_x', conv2_x), ('conv3_x', conv3_x), ('conv4_x', conv4_x), ('conv5_x', conv5_x)]
+
+        # with a frozen prefix (Config.freeze_until), the input holds the cached activations
+        # at the end of that stage and only the following stages are built
+        names = [name for name, _ in stages]
+        first = names.index(self.freeze_until) + 1 if self.freeze_until in names else 0
+
+        # pixels are cast and normalized in the graph, cached activations are fed as they are
+        x = self.input_layer(self.x) if first == 0 else self.x
+        for name, stage in stages[first:]:
+            x = stage(x)
+            self.stage_outputs[name] = x
+
+        self.feature_map = x
 
         # Logit
         with tf.variable_scope('logits') as scope:
@@ -100,6 +135,7 @@ class ResNet18_MI(BaseModel):
         """
         with tf.variable_scope('inputs'):
             self.x, self.y, self.y_mi, self.bi = self.data_loader.get_input()
+            self.scale_index = getattr(self.data_loader, 'scale_index', None)
             self.is_training = tf.placeholder(tf.bool, name='Training_flag')
         tf.add_to_collection('inputs', self.x)
         tf.add_to_collection('inputs', self.y)
@@ -119,10 +155,11 @@ class ResNet18_MI(BaseModel):
             #net = tf.squeeze(net, [1, 2], name='SpatialSqueeze')
 
             end_points['resnet_18/spatial_squeeze'] = net
+            self.embedding = net
             print("Size after squeeze: ", net.shape)
 
             if (self.config.mode == 'si_branch'):
-                end_points['resnet_18/output_si'] = fully_connected(net,
+                end_points['resnet_18/output_si'] = fully_connected(self.hash_layer(net),
                                                                        self.num_classes, activation_fn=None,
                                                                        normalizer_fn=None, scope='logits_si')
                 self.logits = end_points['resnet_18/output_si']
@@ -130,11 +167,12 @@ class ResNet18_MI(BaseModel):
                 net = end_points['resnet_18/output_si']
 
             if (self.config.mode == 'mi_branch'):
-                net = self.mi_pool_layer(net, bag_indices=self.bi, pooling=self.config.pooling)
+                net = self.mi_pool_layer(net, bag_indices=self.bi, pooling=self.config.pooling,
+                                         scale_indices=self.scale_index)
                 end_points['resnet_18/mi_pool1:0'] = net
                 print("Size after MI: ", net.shape)
 
-                end_points['resnet_18/output_mi'] = fully_connected(end_points['resnet_18/mi_pool1:0'],
+                end_points['resnet_18/output_mi'] = fully_connected(self.hash_layer(end_points['resnet_18/mi_pool1:0'], pooled = True),
                                                                        self.num_classes, activation_fn=None,
                                                                        normalizer_fn=None, scope='logits_mi')
                 self.logits = end_points['resnet_18/output_mi']
@@ -144,14 +182,15 @@ class ResNet18_MI(BaseModel):
             if (self.config.mode == 'si_mi_branch'):
                 end_points['resnet_18/mi_pool1:0'] = self.mi_pool_layer(net,
                                                                            bag_indices=self.bi,
-                                                                           pooling=self.config.pooling)
+                                                                           pooling=self.config.pooling,
+                                                                           scale_indices=self.scale_index)
 
-                end_points['resnet_18/output_mi'] = fully_connected(end_points['resnet_18/mi_pool1:0'],
+                end_points['resnet_18/output_mi'] = fully_connected(self.hash_layer(end_points['resnet_18/mi_pool1:0'], pooled = True),
                                                                        self.num_classes, activation_fn=None,
                                                                        normalizer_fn=None, scope='logits_mi')
                 self.logits = end_points['resnet_18/output_mi']
 
-                end_points['resnet_18/output_si'] = fully_connected(net,
+                end_points['resnet_18/output_si'] = fully_connected(self.hash_layer(net),
                                                                        self.num_classes, activation_fn=None,
                                                                        normalizer_fn=None, scope='logits_si')
                 self.logits_si = end_points['resnet_18/output_si']
@@ -182,6 +221,9 @@ class ResNet18_MI(BaseModel):
             else:
                 self.loss = tf.losses.sparse_softmax_cross_entropy(labels = self.y, logits = self.logits)
 
+            if (self.config.hash_bits > 0):
+                self.loss += self.hash_quantization_loss()
+
             if (self.config.mode != 'si_branch'):
                 self.acc = tf.reduce_mean(tf.cast(tf.equal(self.y_mi, self.out_argmax), tf.float32))
             else:
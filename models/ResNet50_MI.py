@@ -21,7 +21,13 @@ class ResNet50_MI(BaseModel):
         self.y = None
         self.y_mi = None
         self.bi = None
+        self.scale_index = None
         self.is_training = None
+        self.embedding = None
+        # last convolutional feature map (before the global average pooling) and its
+        # stride in input pixels, for the fully-convolutional evaluation (utils.dense_eval)
+        self.feature_map = None
+        self.feature_stride = 32
         self.out_argmax = None
         self.loss = None
         self.acc = None
@@ -49,6 +55,7 @@ class ResNet50_MI(BaseModel):
         """
         with tf.variable_scope('inputs'):
             self.x, self.y, self.y_mi, self.bi = self.data_loader.get_input()
+            self.scale_index = getattr(self.data_loader, 'scale_index', None)
             self.is_training = tf.placeholder(tf.bool, name='Training_flag')
         tf.add_to_collection('inputs', self.x)
         tf.add_to_collection('inputs', self.y)
@@ -61,7 +68,9 @@ class ResNet50_MI(BaseModel):
         """
         
         with tf.variable_scope('network'):
-            net, end_points = resnet_v2.resnet_v2_50(inputs = self.x, num_classes = None, global_pool = True)
+            net, end_points = resnet_v2.resnet_v2_50(inputs = self.input_layer(self.x), num_classes = None, global_pool = False)
+            self.feature_map = net
+            net = tf.reduce_mean(net, [1, 2], name = 'pool5', keepdims = True)
     
             end_points['resnet_v2_50/pool5:0'] = net 
             print("Size after pool: ", net.shape)
@@ -69,10 +78,11 @@ class ResNet50_MI(BaseModel):
             net = tf.squeeze(net, [1, 2], name='SpatialSqueeze')
     
             end_points['resnet_v2_50/spatial_squeeze'] = net
+            self.embedding = net
             print("Size after squeeze: ", net.shape)
     
             if (self.config.mode == 'si_branch'):
-                end_points['resnet_v2_50/output_si'] = fully_connected(net,
+                end_points['resnet_v2_50/output_si'] = fully_connected(self.hash_layer(net),
                                                                          self.num_classes, activation_fn=None,
                                                                          normalizer_fn=None, scope='logits_si')
                 self.logits = end_points['resnet_v2_50/output_si']
@@ -80,11 +90,12 @@ class ResNet50_MI(BaseModel):
                 net = end_points['resnet_v2_50/output_si']
                 
             if (self.config.mode == 'mi_branch'):
-                net = self.mi_pool_layer(net, bag_indices = self.bi, pooling = self.config.pooling)
+                net = self.mi_pool_layer(net, bag_indices = self.bi, pooling = self.config.pooling,
+                                         scale_indices = self.scale_index)
                 end_points['resnet_v2_50/mi_pool1:0'] = net
                 print("Size after MI: ", net.shape)
                 
-                end_points['resnet_v2_50/output_mi'] = fully_connected(end_points['resnet_v2_50/mi_pool1:0'],
+                end_points['resnet_v2_50/output_mi'] = fully_connected(self.hash_layer(end_points['resnet_v2_50/mi_pool1:0'], pooled = True),
                                                                          self.num_classes, activation_fn=None,
                                                                          normalizer_fn=None, scope='logits_mi')
                 self.logits = end_points['resnet_v2_50/output_mi']
@@ -94,14 +105,15 @@ class ResNet50_MI(BaseModel):
             if (self.config.mode == 'si_mi_branch'):
                 end_points['resnet_v2_50/mi_pool1:0'] = self.mi_pool_layer(net,
                                                                            bag_indices = self.bi,
-                                                                           pooling = self.config.pooling)
+                                                                           pooling = self.config.pooling,
+                                                                           scale_indices = self.scale_index)
                 
-                end_points['resnet_v2_50/output_mi'] = fully_connected(end_points['resnet_v2_50/mi_pool1:0'],
+                end_points['resnet_v2_50/output_mi'] = fully_connected(self.hash_layer(end_points['resnet_v2_50/mi_pool1:0'], pooled = True),
                                                                          self.num_classes, activation_fn=None,
                                                                          normalizer_fn=None, scope='logits_mi')
                 self.logits = end_points['resnet_v2_50/output_mi']
                 
-                end_points['resnet_v2_50/output_si'] = fully_connected(net,
+                end_points['resnet_v2_50/output_si'] = fully_connected(self.hash_layer(net),
                                                                          self.num_classes, activation_fn=None,
                                                                          normalizer_fn=None, scope='logits_si')
                 self.logits_si = end_points['resnet_v2_50/output_si']
@@ -134,6 +146,9 @@ class ResNet50_MI(BaseModel):
             else:    
                 self.loss = tf.losses.sparse_softmax_cross_entropy(labels = self.y, logits = self.logits)
 
+            if (self.config.hash_bits > 0):
+                self.loss += self.hash_quantization_loss()
+
             if (self.config.mode != 'si_branch'):
                 self.acc = tf.reduce_mean(tf.cast(tf.equal(self.y_mi, self.out_argmax), tf.float32))
             else:
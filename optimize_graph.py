@@ -0,0 +1,50 @@
+import argparse
+import logging
+import pprint
+
+import tensorflow as tf
+
+from dataloaders.PlaceholderLoader import PlaceholderLoader
+from utils.graph_utils import optimize_for_inference, save_graph_def
+from run import create_model
+
+from config import Config
+
+
+# run this script from the root directory to export the trained model in Config.checkpoint_dir
+# as a frozen inference graph (batch norms folded, training branches and optimizer removed)
+
+def get_inference_io(data_loader, model):
+    input_names = [data_loader.x.op.name, data_loader.bi.op.name]
+    output_names = [model.out.op.name, model.out_argmax.op.name]
+    return input_names, output_names
+
+
+def export_inference_graph(config, output_path):
+    tf.reset_default_graph()
+    data_loader = PlaceholderLoader(config)
+    model = create_model(data_loader, config)
+
+    input_names, output_names = get_inference_io(data_loader, model)
+    logging.info(f"Inference inputs: {pprint.pformat(input_names)}")
+    logging.info(f"Inference outputs: {pprint.pformat(output_names)}")
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        model.load(sess)
+        graph_def = optimize_for_inference(sess, input_names, output_names,
+                                           training_flag_name = model.is_training.op.name)
+
+    save_graph_def(graph_def, output_path)
+    logging.info(f"Saved inference graph to: {pprint.pformat(output_path)}")
+    return graph_def
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Export an optimized inference graph')
+    argparser.add_argument('-o', '--output', default='checkpoints/inference_graph.pb',
+                           help='Path of the frozen GraphDef to write')
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+    export_inference_graph(Config, args.output)
@@ -0,0 +1,70 @@
+import argparse
+import logging
+import resource
+import pprint
+import time
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from dataloaders.PlaceholderLoader import PlaceholderLoader
+from utils.quantization import head_weights
+from utils.slide_tiler import SlideTileReader, predict_slide
+from run import create_model
+
+from config import Config
+
+
+# run this script from the root directory to classify whole-slide images (tiled pyramidal
+# TIFF) with the trained MI model in Config.checkpoint_dir. Every tile of the slide is an
+# instance of one bag, tiles are streamed and their embeddings pooled online:
+#   python predict_slide.py slide_1.tif slide_2.tif --tissue_threshold 0.5
+
+def slide_embedder(sess, data_loader, model):
+    def embed(tiles):
+        if (tiles.shape[1:3] != (227, 227)):
+            tiles = np.stack([np.asarray(Image.fromarray(t).resize((227, 227), Image.BILINEAR)) for t in tiles])
+        return sess.run(model.embedding, feed_dict={data_loader.x: tiles.astype(np.float32),
+                                                    model.is_training: False})
+    return embed
+
+
+def main(config, slides, level = 0, tissue_threshold = None, batch_size = 64, read_ahead = 16):
+    tf.reset_default_graph()
+    data_loader = PlaceholderLoader(config)
+    model = create_model(data_loader, config)
+
+    with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
+        sess.run(tf.global_variables_initializer())
+        model.load(sess)
+        heads = {name: head_weights(sess, name) for name in ['logits_mi', 'logits_si', 'hash', 'hash_mi']}
+        embed = slide_embedder(sess, data_loader, model)
+
+        for path in slides:
+            reader = SlideTileReader(path, level = level, read_ahead = read_ahead, tissue_threshold = tissue_threshold)
+            start = time.perf_counter()
+            probabilities, n_tiles = predict_slide(reader, embed, heads, config.pooling, batch_size)
+            seconds = time.perf_counter() - start
+            reader.close()
+
+            logging.info(f"Slide: {pprint.pformat(path)} ({reader.height} x {reader.width})")
+            if (probabilities is None):
+                logging.info(f"No tissue: every tile is below the tissue threshold {tissue_threshold}, not classified")
+                continue
+            logging.info(f"Class probabilities: {pprint.pformat(probabilities)}")
+            logging.info(f"Tiles: {n_tiles} in {seconds:.1f} s ({n_tiles / seconds:.1f} tiles/s)")
+            logging.info(f"Peak RSS (MB): {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f}")
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Classify whole-slide TIFF images with online MI pooling')
+    argparser.add_argument('slides', nargs='+')
+    argparser.add_argument('--level', type=int, default=0, help='Pyramid level of the tiles')
+    argparser.add_argument('--tissue_threshold', type=float, default=None, help='Skip background tiles')
+    argparser.add_argument('--batch_size', type=int, default=64, help='Tiles per forward pass')
+    argparser.add_argument('--read_ahead', type=int, default=16, help='Tiles decoded ahead of the model')
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+    main(Config, args.slides, args.level, args.tissue_threshold, args.batch_size, args.read_ahead)
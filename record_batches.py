@@ -0,0 +1,49 @@
+import argparse
+import logging
+import pprint
+import time
+
+import tensorflow as tf
+
+from dataloaders.DatasetFileLoader import DatasetFileLoader
+from utils.batch_recording import BatchRecorder
+
+from config import Config
+
+
+# run this script from the root directory to record Config.replay_n_batches batches
+# (x, y, y_mi, bi) of the DatasetFileLoader pipeline (training, or validation with --val)
+# into Config.replay_batches_path, replayed by ReplayLoader (Config.dataloader_type =
+# 'ReplayLoader') to benchmark the models without the input pipeline
+
+def record_batches(config, path, n_batches, train = True, threads = 0):
+    data_loader = DatasetFileLoader(config)
+    inputs = data_loader.get_input()
+    metadata = {'loader': 'DatasetFileLoader', 'train': train, 'mode': config.mode,
+                'pipeline_dtype': config.pipeline_dtype, 'batch_size': config.batch_size,
+                'train_on_patches': config.train_on_patches, 'patch_size': config.patch_size,
+                'patch_count': config.patch_count}
+    recorder = BatchRecorder(path, metadata)
+    session_config = tf.ConfigProto(intra_op_parallelism_threads = threads, inter_op_parallelism_threads = threads)
+    with tf.Session(config = session_config) as sess:
+        data_loader.initialize(sess, train = train)
+        for _ in range(n_batches):
+            recorder.add(*sess.run(inputs))
+    recorder.close()
+    return recorder.nbytes
+
+
+if (__name__ == '__main__'):
+    argparser = argparse.ArgumentParser(description='Record input batches for ReplayLoader')
+    argparser.add_argument('--n_batches', type=int, default=Config.replay_n_batches)
+    argparser.add_argument('--out', default=Config.replay_batches_path)
+    argparser.add_argument('--val', action='store_true', help='record validation batches')
+    argparser.add_argument('--threads', type=int, default=0)
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+    start = time.perf_counter()
+    nbytes = record_batches(Config, args.out, args.n_batches, train = not args.val, threads = args.threads)
+    logging.info(f"{pprint.pformat(args.n_batches)} batches ({pprint.pformat(nbytes / 2**20)} MB) recorded to "
+                 f"{pprint.pformat(args.out)} in {pprint.pformat(time.perf_counter() - start)} s")
@@ -8,22 +8,46 @@ sys.path.extend(['..'])
 import tensorflow as tf
 from tensorflow.contrib.memory_stats.python.ops.memory_stats_ops import BytesInUse
 
-from dataloaders import DatasetLoader, DatasetFileLoader
+from dataloaders import DatasetLoader, DatasetFileLoader, EmbeddingLoader, ActivationCacheLoader, MultiScaleLoader, TFRecordLoader, ProcessPoolLoader, \
+    AugmentationBankLoader, ReplayLoader
 
 from models import LeNet, ResNet18, ResNet50, AlexNet, Inception, ResNeXt
 from models import ResNet50_MI
 from models import ResNet18_MI
 from models import ResNeXt_MI
+from models import MIHead
 
 from trainers.MTrainer import MTrainer
 
 from utils.logger import DefinedSummarizer
 from utils.utils import get_args
 from utils.dirs import create_dirs
+from utils.img_utils import get_images_pathlist_labels
+from utils.preprocess_stages import prepare_preprocessed
 
 from config import Config
 
 
+def create_model(data_loader, config):
+    if (config.train_head_only and isinstance(data_loader, EmbeddingLoader.EmbeddingLoader)):
+        model = MIHead.MIHead(data_loader, config)
+    elif (config.model_type.lower() == 'lenet'):
+        model = LeNet.LeNet(data_loader, config)
+    elif (config.model_type.lower() == 'resnet18'):
+        model = ResNet18_MI.ResNet18_MI(data_loader, config)
+    elif (config.model_type.lower() == 'resnet50'):
+        model = ResNet50_MI.ResNet50_MI(data_loader, config)
+    elif (config.model_type.lower() == 'alexnet'):
+        model = AlexNet.AlexNet(data_loader, config)
+    elif (config.model_type.lower() == 'inception'):
+        model = Inception.Inception(data_loader, config)
+    elif (config.model_type.lower() == 'resnext'):
+        model = ResNeXt_MI.ResNeXt_MI(data_loader, config)
+    else:
+        model = LeNet.LeNet(data_loader, config)
+    return model
+
+
 def main():
     # create the experiments dirs
     create_dirs([Config.summary_dir, "checkpoints", "logs"])
@@ -62,13 +86,35 @@ def main():
     logging.info(f"Initial weight value for combined loss (single instance weight) : {pprint.pformat(Config.beta)}")
     logging.info(f"Exponential Decay Rate for weight for combined loss (single instance weight) : {pprint.pformat(Config.beta_decay)}")
     logging.info(f"Pooling type used for Multiple instance pooling layer: {pprint.pformat(Config.pooling)}")
+    logging.info(f"Training heads only on stored embeddings: {pprint.pformat(Config.train_head_only)}")
+    logging.info(f"Backbone frozen up to stage: {pprint.pformat(Config.freeze_until)}")
+    logging.info(f"Multi-scale pyramid levels: {pprint.pformat(Config.multi_scale_levels)}")
     
 
+    # offline stages (stain normalization, pyramid, tissue index) from the preprocessing cache
+    if (Config.use_preprocess_cache):
+        logging.info(f"Preprocessing cache: {pprint.pformat(Config.preprocess_cache_dir)}")
+        prepare_preprocessed(Config, get_images_pathlist_labels()[0], num_workers = Config.num_parallel_cores)
+
     # create your data generator on the CPU 
 
     with tf.device("/cpu:0"):
 
-        if (Config.dataloader_type.lower() == 'datasetfileloader'):
+        if (Config.train_head_only):
+            data_loader = EmbeddingLoader.EmbeddingLoader(Config)
+        elif (Config.freeze_until != 'none' and Config.model_type.lower() == 'resnet18'):
+            data_loader = ActivationCacheLoader.ActivationCacheLoader(Config)
+        elif (len(Config.multi_scale_levels) > 0):
+            data_loader = MultiScaleLoader.MultiScaleLoader(Config)
+        elif (Config.dataloader_type.lower() == 'replayloader'):
+            data_loader = ReplayLoader.ReplayLoader(Config)
+        elif (Config.dataloader_type.lower() == 'augmentationbankloader'):
+            data_loader = AugmentationBankLoader.AugmentationBankLoader(Config)
+        elif (Config.dataloader_type.lower() == 'processpoolloader'):
+            data_loader = ProcessPoolLoader.ProcessPoolLoader(Config)
+        elif (Config.dataloader_type.lower() == 'tfrecordloader'):
+            data_loader = TFRecordLoader.TFRecordLoader(Config)
+        elif (Config.dataloader_type.lower() == 'datasetfileloader'):
             data_loader = DatasetFileLoader.DatasetFileLoader(Config)
         else:
             data_loader = DatasetLoader.DatasetLoader(Config)
@@ -80,20 +126,7 @@ def main():
         with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
 
             # create instance of the model you want
-            if (Config.model_type.lower() == 'lenet'):
-                model = LeNet.LeNet(data_loader, Config)
-            elif (Config.model_type.lower() == 'resnet18'):
-                model = ResNet18_MI.ResNet18_MI(data_loader, Config)
-            elif (Config.model_type.lower() == 'resnet50'):
-                model = ResNet50_MI.ResNet50_MI(data_loader, Config)
-            elif (Config.model_type.lower() == 'alexnet'):
-                model = AlexNet.AlexNet(data_loader, Config)
-            elif (Config.model_type.lower() == 'inception'):
-                model = Inception.Inception(data_loader, Config)
-            elif (Config.model_type.lower() == 'resnext'):
-                model = ResNeXt_MI.ResNeXt_MI(data_loader, Config)
-            else:
-                model = LeNet.LeNet(data_loader, Config)
+            model = create_model(data_loader, Config)
 
             # create tensorboard logger
             logger = DefinedSummarizer(sess, summary_dir=Config.summary_dir,
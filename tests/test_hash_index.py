@@ -0,0 +1,77 @@
+import numpy as np
+
+from utils.hash_index import HashIndex, MultiIndexHash, pack_codes, hamming_distances
+
+
+def brute_force(codes, query, k):
+    # unpacked bit comparison, independent of the packed popcount
+    bits = np.unpackbits(codes, axis=-1)
+    distances = (bits != np.unpackbits(query)).sum(axis=-1)
+    return np.sort(distances)[:k], distances
+
+
+def clustered_index(n_bits = 64, n_centres = 20, per_centre = 100, flip = 0.05, seed = 0):
+    rng = np.random.RandomState(seed)
+    centres = rng.rand(n_centres, n_bits) > 0.5
+    bits = np.repeat(centres, per_centre, axis=0) ^ (rng.rand(n_centres * per_centre, n_bits) < flip)
+    index = HashIndex(n_bits)
+    for i, code in enumerate(pack_codes(bits)):
+        index.add_image('image_{}.png'.format(i), i % 4, bag_code = code)
+    return index, centres, rng
+
+
+def test_hamming_distances():
+    rng = np.random.RandomState(1)
+    codes = pack_codes(rng.rand(50, 32) > 0.5)
+    expected = (np.unpackbits(codes, axis=-1) != np.unpackbits(codes[0])).sum(axis=-1)
+    assert np.array_equal(hamming_distances(codes[0], codes), expected)
+
+
+def test_linear_scan_is_exact():
+    index, _, rng = clustered_index()
+    for _ in range(10):
+        query = pack_codes(rng.rand(64) > 0.5)
+        idx, d = index.search(query, k = 15)
+        expected, distances = brute_force(index.codes, query, 15)
+        assert np.array_equal(d, expected)
+        assert np.array_equal(distances[idx], d)
+
+
+def test_multi_index_matches_brute_force():
+    index, centres, rng = clustered_index()
+    for n_tables in [None, 2, 4, 8]:
+        mih = MultiIndexHash(index, n_tables)
+        verified = []
+        for q in range(20):
+            # queries near the clusters (early exit of the MIH search) and uniform ones (fallback)
+            bits = centres[q % len(centres)] ^ (rng.rand(64) < 0.08) if q < 15 else rng.rand(64) > 0.5
+            query = pack_codes(bits)
+            for k in [1, 10, 150]:
+                idx, d, n_verified = mih.search(query, k)
+                expected, distances = brute_force(index.codes, query, k)
+                assert np.array_equal(d, expected)
+                assert np.array_equal(distances[idx], d)
+                assert len(np.unique(idx)) == len(idx)
+                verified.append(n_verified)
+        # sub-linear: the near-cluster queries verify a fraction of the entries
+        assert min(verified) < len(index)
+
+
+def test_bags_only_search():
+    index = HashIndex(16)
+    rng = np.random.RandomState(2)
+    for i in range(10):
+        index.add_image('image_{}.png'.format(i), 0, bag_code = pack_codes(rng.rand(16) > 0.5),
+                        patch_codes = pack_codes(rng.rand(4, 16) > 0.5), positions = np.zeros((4, 2)))
+    idx, _ = index.search(pack_codes(rng.rand(16) > 0.5), k = 10, bags_only = True)
+    assert index.is_bag()[idx].all()
+
+
+def test_save_load(tmp_path):
+    index, _, rng = clustered_index(per_centre = 5)
+    path = str(tmp_path / 'index.npz')
+    index.save(path)
+    loaded = HashIndex.load(path)
+    query = pack_codes(rng.rand(64) > 0.5)
+    assert np.array_equal(index.search(query, 5)[1], loaded.search(query, 5)[1])
+    assert loaded.image_paths == index.image_paths
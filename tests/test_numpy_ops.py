@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from utils.numpy_ops import (extract_patches_numpy, patch_positions, patch_view, needs_padding, PatchGrid,
+                             plan_patch_grid, mi_pool_numpy, OnlinePool)
+
+
+def crop(image, row, col, size_h, size_w):
+    # patch at (row, col), zero outside of the image
+    h, w, c = image.shape
+    out = np.zeros((size_h, size_w, c), dtype=image.dtype)
+    r0, c0 = max(row, 0), max(col, 0)
+    r1, c1 = min(row + size_h, h), min(col + size_w, w)
+    if (r1 > r0 and c1 > c0):
+        out[r0 - row : r1 - row, c0 - col : c1 - col] = image[r0:r1, c0:c1]
+    return out
+
+
+IMAGE_SHAPES = [(60, 80, 3), (64, 64, 1), (37, 53, 3)]
+# (size_w, size_h), overlap
+GRIDS = [((16, 16), 0), ((20, 12), 0), ((16, 16), 0.5), ((24, 10), 0.25)]
+
+
+@pytest.mark.parametrize('shape', IMAGE_SHAPES)
+@pytest.mark.parametrize('size, overlap', GRIDS)
+def test_same_view_matches_positions(shape, size, overlap):
+    image = np.random.RandomState(0).randint(1, 256, size=shape).astype(np.uint8)
+    size_w, size_h = size
+    patches = extract_patches_numpy(image, size, overlap)
+    positions = patch_positions(shape, size, overlap)
+    assert patches.shape == (len(positions), size_h, size_w, shape[-1])
+    for patch, (row, col) in zip(patches, positions):
+        assert np.array_equal(patch, crop(image, row, col, size_h, size_w))
+    view = patch_view(image, size, overlap)
+    assert np.array_equal(view.reshape(patches.shape), patches)
+    assert needs_padding(shape, size, overlap) == bool((positions < 0).any() or
+                                                       (positions[:, 0] + size_h > shape[0]).any() or
+                                                       (positions[:, 1] + size_w > shape[1]).any())
+
+
+@pytest.mark.parametrize('shape', IMAGE_SHAPES)
+@pytest.mark.parametrize('size, overlap', GRIDS)
+def test_valid_view_inside_image(shape, size, overlap):
+    image = np.random.RandomState(1).randint(0, 256, size=shape).astype(np.uint8)
+    size_w, size_h = size
+    stride_h, stride_w = int((1 - overlap) * size_h), int((1 - overlap) * size_w)
+    view = patch_view(image, size, overlap, padding = 'VALID')
+    rows, cols = view.shape[:2]
+    assert rows == (shape[0] - size_h) // stride_h + 1 and cols == (shape[1] - size_w) // stride_w + 1
+    for r in range(rows):
+        for c in range(cols):
+            assert np.array_equal(view[r, c], image[r * stride_h : r * stride_h + size_h,
+                                                    c * stride_w : c * stride_w + size_w])
+    # a view of the image memory, read-only
+    assert np.shares_memory(view, image)
+    assert not view.flags.writeable
+
+
+def test_batch_view_and_patch_grid():
+    images = np.random.RandomState(2).randint(0, 256, size=(4, 37, 53, 3)).astype(np.uint8)
+    batch = patch_view(images, (16, 16), 0.25)
+    grid = PatchGrid(images, (16, 16), 0.25)
+    assert grid.shape == batch.shape and grid.dtype == batch.dtype and len(grid) == 4
+    for i in range(4):
+        assert np.array_equal(grid[i], batch[i])
+        assert np.array_equal(grid[i], patch_view(images[i], (16, 16), 0.25))
+
+
+@pytest.mark.parametrize('shape', [(1536, 2048), (227, 227), (100, 300)])
+@pytest.mark.parametrize('n_patches', [1, 12, 20, 100])
+def test_plan_patch_grid(shape, n_patches):
+    size, count = plan_patch_grid(shape, n_patches)
+    grid = patch_view(np.zeros((*shape, 1), dtype=np.uint8), (size, size))
+    assert grid.shape[0] * grid.shape[1] == count
+    # no stride gives a grid closer to n_patches
+    counts = [-(-shape[0] // s) * -(-shape[1] // s) for s in range(1, max(shape) + 1)]
+    assert abs(count - n_patches) == min(abs(c - n_patches) for c in counts)
+
+
+@pytest.mark.parametrize('pooling', ['average', 'max', 'lse'])
+def test_online_pool_matches_mi_pool(pooling):
+    embeddings = np.random.RandomState(3).randn(103, 8).astype(np.float32) * 5
+    pool = OnlinePool(pooling)
+    for start in range(0, 103, 17):
+        pool.update(embeddings[start : start + 17])
+    pool.update(embeddings[:0])
+    expected = mi_pool_numpy(embeddings, np.zeros(103, dtype=np.int64), pooling)
+    assert pool.count == 103
+    np.testing.assert_allclose(pool.result(), expected, rtol = 1e-5, atol = 1e-5)
+
+
+def test_online_pool_empty_bag():
+    pool = OnlinePool('average')
+    pool.update(np.zeros((0, 8)))
+    with pytest.raises(ValueError):
+        pool.result()
@@ -0,0 +1,160 @@
+import json
+import os
+import time
+
+import pytest
+
+from utils.preprocess_cache import PreprocessCache, ENTRY_FILE
+
+
+def write_bytes(n):
+    def build(out_dir):
+        with open(os.path.join(out_dir, 'data.bin'), 'wb') as f:
+            f.write(b'0' * n)
+    return build
+
+
+def set_last_used(entry_dir, seconds_ago):
+    t = time.time() - seconds_ago
+    os.utime(os.path.join(entry_dir, ENTRY_FILE), (t, t))
+
+
+@pytest.fixture
+def sources(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / 'image_{}.png'.format(i)
+        path.write_bytes(bytes([i]) * 100)
+        paths.append(str(path))
+    return paths
+
+
+def test_key_stability(tmp_path, sources):
+    cache = PreprocessCache(str(tmp_path / 'cache'))
+    key = PreprocessCache.key('stage', 'source', {'a': 1, 'b': [1, 2]}, 'code')
+    # parameter order does not matter, every component does
+    assert key == PreprocessCache.key('stage', 'source', {'b': [1, 2], 'a': 1}, 'code')
+    assert key != PreprocessCache.key('stage', 'source', {'a': 2, 'b': [1, 2]}, 'code')
+    assert key != PreprocessCache.key('other', 'source', {'a': 1, 'b': [1, 2]}, 'code')
+    assert key != PreprocessCache.key('stage', 'source', {'a': 1, 'b': [1, 2]}, 'code2')
+
+    # the source checksum depends on the contents only, not on the order or a new cache
+    checksum = cache.source_checksum(sources)
+    assert checksum == cache.source_checksum(sources[::-1])
+    assert checksum == PreprocessCache(str(tmp_path / 'cache')).source_checksum(sources)
+    with open(sources[0], 'wb') as f:
+        f.write(b'changed')
+    assert checksum != cache.source_checksum(sources)
+
+
+def test_hit_and_miss(tmp_path):
+    cache = PreprocessCache(str(tmp_path))
+    calls = []
+    build = lambda out_dir: calls.append(write_bytes(10)(out_dir))
+    entry_dir, key = cache.get_or_build('stage', 'source', {'a': 1}, 'code', build)
+    assert os.path.exists(os.path.join(entry_dir, 'data.bin'))
+    assert cache.get_or_build('stage', 'source', {'a': 1}, 'code', build) == (entry_dir, key)
+    assert len(calls) == 1
+    cache.get_or_build('stage', 'source', {'a': 2}, 'code', build)
+    assert len(calls) == 2
+    # no temporary directory is left behind
+    assert not [name for name in os.listdir(str(tmp_path)) if name.startswith('.') and 'stage' in name]
+
+
+def test_failed_build_leaves_no_entry(tmp_path):
+    cache = PreprocessCache(str(tmp_path))
+
+    def build(out_dir):
+        write_bytes(10)(out_dir)
+        raise RuntimeError('build failed')
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_build('stage', 'source', {}, 'code', build)
+    assert cache.entries() == []
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_commit_race(tmp_path):
+    # another run commits the same key while this one builds: its entry is kept
+    cache = PreprocessCache(str(tmp_path))
+    key = PreprocessCache.key('stage', 'source', {}, 'code')
+
+    def build(out_dir):
+        # the other run (another process) commits first
+        committed = cache.entry_dir('stage', key)
+        os.makedirs(committed)
+        write_bytes(20)(committed)
+        with open(os.path.join(committed, ENTRY_FILE), 'w') as f:
+            json.dump({'stage': 'stage', 'key': key, 'nbytes': 20}, f)
+        write_bytes(10)(out_dir)
+
+    entry_dir, _ = cache.get_or_build('stage', 'source', {}, 'code', build)
+    assert os.path.getsize(os.path.join(entry_dir, 'data.bin')) == 20
+    assert len(cache.entries()) == 1
+    assert [name for name in os.listdir(str(tmp_path)) if name.startswith('.')] == []
+
+
+def test_stale_entry_replaced(tmp_path):
+    # a directory without entry.json (interrupted removal) is not a hit and is replaced
+    cache = PreprocessCache(str(tmp_path))
+    key = PreprocessCache.key('stage', 'source', {}, 'code')
+    stale = cache.entry_dir('stage', key)
+    os.makedirs(stale)
+    with open(os.path.join(stale, 'leftover'), 'w') as f:
+        f.write('x')
+    entry_dir, _ = cache.get_or_build('stage', 'source', {}, 'code', write_bytes(10))
+    assert entry_dir == stale
+    assert sorted(os.listdir(entry_dir)) == ['data.bin', ENTRY_FILE]
+
+
+def test_lru_budget(tmp_path):
+    cache = PreprocessCache(str(tmp_path), budget_mb = 1, lease_hours = 0)
+    mb = 2**20
+    first, _ = cache.get_or_build('stage', 'a', {}, 'code', write_bytes(mb // 2))
+    second, _ = cache.get_or_build('stage', 'b', {}, 'code', write_bytes(mb // 2))
+    set_last_used(first, 200)
+    set_last_used(second, 100)
+    # the lookup marks the first entry as used, the second becomes least recently used
+    assert cache.lookup('stage', PreprocessCache.key('stage', 'a', {}, 'code')) == first
+    third, _ = cache.get_or_build('stage', 'c', {}, 'code', write_bytes(mb // 2))
+    remaining = [e['dir'] for e in cache.entries()]
+    assert second not in remaining and first in remaining and third in remaining
+    assert sum(e['nbytes'] for e in cache.entries()) <= mb
+
+
+def test_evict_keeps_listed_keys(tmp_path):
+    cache = PreprocessCache(str(tmp_path), lease_hours = 0)
+    _, key = cache.get_or_build('stage', 'a', {}, 'code', write_bytes(100))
+    cache.get_or_build('stage', 'b', {}, 'code', write_bytes(100))
+    removed = cache.evict(0, keep = {key})
+    assert [e['key'] for e in cache.entries()] == [key]
+    assert len(removed) == 1
+
+
+def test_lease(tmp_path):
+    cache = PreprocessCache(str(tmp_path), lease_hours = 1)
+    recent, _ = cache.get_or_build('stage', 'a', {}, 'code', write_bytes(100))
+    old, _ = cache.get_or_build('stage', 'b', {}, 'code', write_bytes(100))
+    set_last_used(old, 2 * 3600)
+    removed = cache.evict(0)
+    # the entry used within the lease stays, even above budget
+    assert [e['dir'] for e in removed] == [old]
+    assert [e['dir'] for e in cache.entries()] == [recent]
+
+
+def test_prune(tmp_path):
+    cache = PreprocessCache(str(tmp_path))
+    a, _ = cache.get_or_build('stage_a', 's', {}, 'code', write_bytes(10))
+    b, _ = cache.get_or_build('stage_b', 's', {}, 'code', write_bytes(10))
+    set_last_used(b, 3 * 86400)
+    assert [e['dir'] for e in cache.prune(unused_days = 2)] == [b]
+    assert [e['dir'] for e in cache.prune(stage = 'stage_a')] == [a]
+    assert cache.entries() == []
+
+
+def test_entry_metadata(tmp_path):
+    cache = PreprocessCache(str(tmp_path))
+    entry_dir, key = cache.get_or_build('stage', 'source', {'a': 1}, 'code', write_bytes(10))
+    with open(os.path.join(entry_dir, ENTRY_FILE)) as f:
+        entry = json.load(f)
+    assert entry['key'] == key and entry['params'] == {'a': 1} and entry['nbytes'] == 10
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from utils.rotation import rot90_images, dihedral_images, rotate_images_by, rotation_coordinates, _sample
+
+
+def random_images(shape, seed = 0):
+    return np.random.RandomState(seed).randint(1, 256, size=shape).astype(np.uint8)
+
+
+def reference_rotate(image, degrees):
+    # tf.contrib.image.rotate, written out pixel by pixel: the projective transform
+    # [cos, -sin, x_offset, sin, cos, y_offset, 0, 0] of angles_to_projective_transforms maps
+    # every output pixel (x, y) to its source, nearest neighbour, 0 outside of the image
+    h, w = image.shape[:2]
+    angle = np.deg2rad(degrees)
+    cos, sin = np.cos(angle), np.sin(angle)
+    x_offset = ((w - 1) - (cos * (w - 1) - sin * (h - 1))) / 2.0
+    y_offset = ((h - 1) - (sin * (w - 1) + cos * (h - 1))) / 2.0
+    out = np.zeros_like(image)
+    for y in range(h):
+        for x in range(w):
+            src_x = int(np.round(cos * x - sin * y + x_offset))
+            src_y = int(np.round(sin * x + cos * y + y_offset))
+            if (0 <= src_x < w and 0 <= src_y < h):
+                out[y, x] = image[src_y, src_x]
+    return out
+
+
+def test_rot90_images():
+    images = random_images((12, 9, 9, 3))
+    ks = np.arange(12) % 4
+    expected = np.stack([np.rot90(image, k) for image, k in zip(images, ks)])
+    result = rot90_images(images.copy(), ks, chunk_size = 2)
+    assert np.array_equal(result, expected)
+
+
+def test_rot90_images_non_square():
+    images = random_images((6, 7, 11, 3))
+    ks = np.array([1, 3, 1, 3, 3, 1])
+    expected = np.stack([np.rot90(image, k) for image, k in zip(images, ks)])
+    assert np.array_equal(rot90_images(images.copy(), ks), expected)
+    # 0 / 180 keep the shape, in place
+    ks = np.array([0, 2, 2, 0, 2, 0])
+    expected = np.stack([np.rot90(image, k) for image, k in zip(images, ks)])
+    result = rot90_images(images, ks)
+    assert result is images and np.array_equal(result, expected)
+    with pytest.raises(ValueError):
+        rot90_images(images, [1, 0, 0, 0, 0, 0])
+
+
+def test_dihedral_images():
+    images = random_images((16, 8, 8, 3))
+    codes = np.arange(16) % 8
+    expected = []
+    for image, code in zip(images, codes):
+        if (code & 1):
+            image = np.flip(image, axis = 0)
+        if (code & 2):
+            image = np.flip(image, axis = 1)
+        if (code & 4):
+            image = np.transpose(image, (1, 0, 2))
+        expected.append(image)
+    assert np.array_equal(dihedral_images(images.copy(), codes, chunk_size = 3), np.stack(expected))
+    # the 8 transforms are the 8 distinct elements of the dihedral group
+    square = random_images((1, 8, 8, 1))
+    results = [dihedral_images(np.repeat(square, 1, axis = 0), [code])[0].tobytes() for code in range(8)]
+    assert len(set(results)) == 8
+    with pytest.raises(ValueError):
+        dihedral_images(random_images((2, 8, 6, 3)), [4, 0])
+
+
+@pytest.mark.parametrize('shape', [(17, 17, 3), (15, 22, 3)])
+@pytest.mark.parametrize('degrees', [10, 45, 90, 135, 200, 333])
+def test_rotate_images_by_matches_reference(shape, degrees):
+    image = random_images(shape, seed = degrees)
+    result = rotate_images_by(image[np.newaxis].copy(), [degrees])[0]
+    expected = reference_rotate(image, degrees)
+    # rounding of source coordinates exactly half way between pixels may differ
+    assert (result != expected).any(axis = -1).mean() < 0.02
+
+
+def test_rotate_images_by_right_angles():
+    images = random_images((8, 9, 9, 3))
+    angles = [0, 90, 180, 270, 360, -90, 450, 180]
+    expected = np.stack([np.rot90(image, (a // 90) % 4) for image, a in zip(images, angles)])
+    assert np.array_equal(rotate_images_by(images.copy(), angles), expected)
+    # the sampling grid of the general path agrees with rot90
+    rows, cols = rotation_coordinates(9, 9, np.deg2rad(90))
+    assert np.array_equal(_sample(images, rows, cols, 'NEAREST'), np.rot90(images, 1, axes = (1, 2)))
+
+
+def test_rotate_images_by_tensorflow():
+    tf = pytest.importorskip('tensorflow')
+    contrib = pytest.importorskip('tensorflow.contrib.image')
+    images = random_images((4, 15, 22, 3))
+    angles = [10, 45, 135, 333]
+    expected = []
+    with tf.Session() as sess:
+        for image, angle in zip(images, angles):
+            expected.append(sess.run(contrib.rotate(image, np.deg2rad(angle), interpolation = 'NEAREST')))
+    result = rotate_images_by(images.copy(), angles)
+    assert (result != np.stack(expected)).any(axis = -1).mean() < 0.02
@@ -3,6 +3,7 @@ from tqdm import tqdm
 import numpy as np
 import pandas as pd
 from datetime import datetime
+import time
 import tensorflow as tf
 
 from utils.metrics import AverageMeter
@@ -47,6 +48,8 @@ class MTrainer(BaseTrainer):
         self.preds = []
         self.outputs = []
         self.best_preds = []
+
+        self.epoch_time = None
         
         
     
@@ -85,6 +88,7 @@ class MTrainer(BaseTrainer):
 
         loss_per_epoch = AverageMeter()
         acc_per_epoch = AverageMeter()
+        start = time.time()
 
         # Iterate over batches
         for cur_it in tt:
@@ -94,11 +98,13 @@ class MTrainer(BaseTrainer):
             loss_per_epoch.update(loss)
             acc_per_epoch.update(acc)
 
+        self.epoch_time = time.time() - start
         self.sess.run(self.model.global_epoch_inc)
         logging.info(f"Learning rate: {pprint.pformat(self.sess.run(self.model.optimizer._lr))}")
         logging.info(f"Training Epoch: {pprint.pformat(epoch)}")
         logging.info(f"Training Loss Per Epoch: {pprint.pformat(loss_per_epoch.val)}")
         logging.info(f"Accuracy Per Epoch: {pprint.pformat(acc_per_epoch.val)}")
+        logging.info(f"Training Epoch Time (s): {pprint.pformat(self.epoch_time)}")
 
         
         logging.info(f"Current_si_weight: {pprint.pformat(self.sess.run(self.model.current_beta))}")
@@ -134,6 +140,10 @@ Epoch-{}  loss:{:.4f} -- acc:{:.4f}
         return loss, acc
     
     def test(self, epoch):
+        # timed from the dataset initialization, which fills the validation cache in the
+        # first validation epoch (Config.val_cache)
+        start = time.time()
+
         # initialize dataset
         self.data_loader.initialize(self.sess, train=False)
 
@@ -158,6 +168,7 @@ Epoch-{}  loss:{:.4f} -- acc:{:.4f}
             self.preds = np.append(self.preds, arg_max)
             self.outputs = np.concatenate((self.outputs, outputs[0]))
             
+        val_epoch_time = time.time() - start
         
         if (self.best_val_acc < acc_per_epoch.val):
             self.best_val_acc = acc_per_epoch.val
@@ -182,6 +193,7 @@ Epoch-{}  loss:{:.4f} -- acc:{:.4f}
         logging.info(f"Val Epoch: {pprint.pformat(epoch)}")
         logging.info(f"Val Loss Per Epoch: {pprint.pformat(loss_per_epoch.val)}")
         logging.info(f"Val Accuracy Per Epoch: {pprint.pformat(acc_per_epoch.val)}")
+        logging.info(f"Val Epoch Time (s): {pprint.pformat(val_epoch_time)}")
         
         # summarize
         summaries_dict = {'test/loss_per_epoch': loss_per_epoch.val,
@@ -192,4 +204,5 @@ Epoch-{}  loss:{:.4f} -- acc:{:.4f}
 Val-{}  loss:{:.4f} -- acc:{:.4f}
         """.format(epoch, loss_per_epoch.val, acc_per_epoch.val))
 
-        tt.close()
\ No newline at end of file
+        tt.close()
+        return loss_per_epoch.val, acc_per_epoch.val
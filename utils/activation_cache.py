@@ -0,0 +1,75 @@
+import numpy as np
+
+from utils.embedding_store import EmbeddingStoreWriter, EmbeddingStore
+
+import os
+
+
+# -------------------------------------------------------------------------------------
+
+# On-disk cache of backbone activations at a block boundary (see Config.freeze_until)
+# Same layout as the embedding store, with an optional lossy compression of the cached
+# feature maps so the cache stays memory mappable:
+#   'none'      float32
+#   'float16'   half precision, 2x smaller
+#   'uint8'     per patch and channel linear quantization of the (post-ReLU, >= 0)
+#               activations, 4x smaller, scales stored in scales.npy
+
+SCALES_FILE = 'scales.npy'
+
+COMPRESSION_DTYPES = {'none': 'float32', 'float16': 'float16', 'uint8': 'uint8'}
+
+
+class ActivationCacheWriter(EmbeddingStoreWriter):
+
+    def __init__(self, cache_dir, n_patches_total, shape, compression = 'none', metadata = None):
+        super(ActivationCacheWriter, self).__init__(cache_dir, n_patches_total, shape,
+                                                    dtype = COMPRESSION_DTYPES[compression],
+                                                    metadata = dict(metadata or {}, compression = compression))
+        self.compression = compression
+        self.scales = None
+        if (compression == 'uint8'):
+            self.scales = np.lib.format.open_memmap(os.path.join(cache_dir, SCALES_FILE), mode='w+',
+                                                    dtype=np.float32, shape=(n_patches_total, shape[-1]))
+
+    def add(self, image_path, label, activations, positions):
+        if (self.compression == 'uint8'):
+            scale = activations.max(axis=(1, 2)) / 255
+            scale[scale == 0] = 1
+            self.scales[self.offset : self.offset + activations.shape[0]] = scale
+            activations = np.round(activations / scale[:, np.newaxis, np.newaxis, :])
+            activations = np.clip(activations, 0, 255).astype(np.uint8)
+        super(ActivationCacheWriter, self).add(image_path, label, activations, positions)
+
+    def close(self):
+        if (self.scales is not None):
+            self.scales.flush()
+        super(ActivationCacheWriter, self).close()
+
+
+class ActivationCache(EmbeddingStore):
+    """
+
+    Read access to an activation cache, always memory mapped
+    get() returns decompressed float32 activations
+
+    """
+
+    def __init__(self, cache_dir):
+        super(ActivationCache, self).__init__(cache_dir, in_memory = False)
+        self.compression = self.metadata['compression']
+        self.scales = None
+        if (self.compression == 'uint8'):
+            self.scales = np.load(os.path.join(cache_dir, SCALES_FILE), mmap_mode = 'r')
+
+    def get(self, i):
+        activations, positions = super(ActivationCache, self).get(i)
+        activations = np.asarray(activations, dtype=np.float32)
+        if (self.scales is not None):
+            start = self.offsets[i]
+            activations *= self.scales[start : start + self.counts[i], np.newaxis, np.newaxis, :]
+        return activations, positions
+
+
+def cache_disk_bytes(cache_dir):
+    return sum(os.path.getsize(os.path.join(cache_dir, f)) for f in os.listdir(cache_dir))
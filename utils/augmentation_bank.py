@@ -0,0 +1,104 @@
+import numpy as np
+
+import json
+import os
+
+
+# -------------------------------------------------------------------------------------
+
+# Precomputed augmentation bank (AugmentationBankLoader), built once with
+# build_augmentation_bank.py: K augmented training bags per image (crops, color jitter and
+# rotation of the DatasetFileLoader training pipeline) stored as uint8, each epoch then
+# reads one randomly chosen variant per image instead of augmenting online.
+# Layout of the bank directory:
+#   bank.npy         n_images X K X n_patches X h X w X c uint8, memory mapped
+#   index.npz        per image: path, label, bag index
+#   metadata.json    K, bag shape and the augmentation parameters the bank was built with
+# This module must not import tensorflow (like utils.numpy_ops)
+
+BANK_FILE = 'bank.npy'
+INDEX_FILE = 'index.npz'
+METADATA_FILE = 'metadata.json'
+
+
+class AugmentationBankWriter:
+    """
+
+    add() augmented bags in any order, each image keeps its first K bags, the bank is
+    complete once every image has K of them, then close()
+
+    """
+
+    def __init__(self, bank_dir, paths, labels, bag_index, n_variants, bag_shape, metadata = None):
+        if (not os.path.exists(bank_dir)):
+            os.makedirs(bank_dir)
+        self.bank_dir = bank_dir
+        self.paths, self.labels, self.bag_index = np.asarray(paths), np.asarray(labels), np.asarray(bag_index)
+        self.n_variants = n_variants
+        self.bag_shape = tuple(int(d) for d in bag_shape)
+        self.bank = np.lib.format.open_memmap(os.path.join(bank_dir, BANK_FILE), mode='w+', dtype=np.uint8,
+                                              shape=(len(self.paths), n_variants, *self.bag_shape))
+        self.rows = {int(bi): row for row, bi in enumerate(self.bag_index)}
+        self.counts = np.zeros(len(self.paths), dtype=np.int64)
+        self.metadata = dict(metadata or {})
+
+    def add(self, bag_index, bag):
+        """
+        :return: True if the bag was stored, False if the image already has K variants
+        """
+        row = self.rows[int(bag_index)]
+        if (self.counts[row] >= self.n_variants):
+            return False
+        if (bag.shape != self.bag_shape):
+            raise ValueError(f"Bag of shape {bag.shape} for a bank of {self.bag_shape} bags, the bank needs bags "
+                             f"of a fixed size (no tissue mask dropping)")
+        self.bank[row, self.counts[row]] = bag
+        self.counts[row] += 1
+        return True
+
+    @property
+    def complete(self):
+        return bool((self.counts >= self.n_variants).all())
+
+    def close(self):
+        self.bank.flush()
+        np.savez(os.path.join(self.bank_dir, INDEX_FILE), paths = self.paths, labels = self.labels,
+                 bag_index = self.bag_index)
+        with open(os.path.join(self.bank_dir, METADATA_FILE), 'w') as f:
+            json.dump(dict(self.metadata, n_images = len(self.paths), n_variants = self.n_variants,
+                           bag_shape = list(self.bag_shape)), f, indent=2)
+
+
+class AugmentationBank:
+    """
+
+    Read access to a bank written by AugmentationBankWriter, memory mapped
+
+    """
+
+    def __init__(self, bank_dir):
+        with open(os.path.join(bank_dir, METADATA_FILE)) as f:
+            self.metadata = json.load(f)
+        index = np.load(os.path.join(bank_dir, INDEX_FILE))
+        self.paths = index['paths']
+        self.labels = index['labels'].astype(np.int32)
+        self.bag_index = index['bag_index'].astype(np.int64)
+        self.bank = np.load(os.path.join(bank_dir, BANK_FILE), mmap_mode = 'r')
+        self.n_variants = self.metadata['n_variants']
+        self.bag_shape = tuple(self.metadata['bag_shape'])
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def nbytes(self):
+        return self.bank.nbytes
+
+    def epoch(self, rng):
+        """
+        One epoch in random order, one random variant per image
+        :return: generator of (bag, label, bag index)
+        """
+        variants = rng.randint(0, self.n_variants, size = len(self.paths))
+        for row in rng.permutation(len(self.paths)):
+            yield self.bank[row, variants[row]], self.labels[row], self.bag_index[row]
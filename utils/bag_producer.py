@@ -0,0 +1,163 @@
+import numpy as np
+from PIL import Image
+
+import multiprocessing as mp
+import traceback
+
+from utils.shm_ring import SlotRing
+from utils.numpy_ops import patch_view
+from utils.rotation import rotate_images_by, dihedral_images
+
+
+# -------------------------------------------------------------------------------------
+
+# Process-pool producer of training batches (ProcessPoolLoader): worker processes decode the
+# PNGs (PIL), cut the bags of patches, resize and rotate them in NumPy, each worker writes a
+# whole batch into a free slot of a shared-memory SlotRing and hands the slot index to the
+# consumer, which copies the batch out of the slot and frees it right away (tf.data reads
+# ahead of the training step and may wrap the yielded arrays without copying them, so the
+# slot could otherwise be refilled under a batch still in use).
+# The parent deals the batches out: each free slot goes back to the workers with the next
+# batch_size images of a random permutation of the dataset, a new permutation per pass (the
+# last incomplete batch of a pass is dropped), so that len // batch_size batches cover every
+# image once like the shuffled DatasetFileLoader epochs (batches still in the prefetch
+# buffer when the dataset is re-initialized are skipped).
+# The decode and augmentation run outside of the training process and its GIL, so the
+# throughput scales with the number of workers instead of stopping at the map threads.
+# Workers are forked (Linux), before the training session starts its thread pools.
+# This module must not import tensorflow (like utils.numpy_ops)
+
+def bag_size(image_shape, patch_size, n_patches, scheme, overlap = 0):
+    # number of patches per bag, the same for every bag of the dataset
+    if (scheme == 'sequential_full'):
+        grid = patch_view(np.empty((*image_shape[:2], 1), dtype=np.uint8), (patch_size, patch_size), overlap)
+        return grid.shape[0] * grid.shape[1]
+    return n_patches
+
+
+def make_bag(image, rng, patch_size = 227, n_patches = 20, scheme = 'random_crops', overlap = 0, size = 227,
+             n_times_90 = 0, random_rotation = True, rotation = 'arbitrary', residual_angle = 0,
+             interpolation = 'NEAREST', **_):
+    """
+    NumPy version of the DatasetFileLoader training bag (get_patches_train, patch rotation)
+    :return: n_patches X size X size X c uint8
+    """
+    p = patch_size
+    image = np.rot90(image, n_times_90)
+    if (scheme == 'random_crops'):
+        rows = rng.randint(0, image.shape[0] - p + 1, size = n_patches)
+        cols = rng.randint(0, image.shape[1] - p + 1, size = n_patches)
+        patches = np.stack([image[r : r + p, c : c + p] for r, c in zip(rows, cols)])
+    else:
+        patches = patch_view(image, (p, p), overlap).reshape(-1, p, p, image.shape[-1])
+        if (scheme == 'sequential_randomly_subset' and patches.shape[0] > n_patches):
+            start = rng.randint(0, patches.shape[0] - n_patches)
+            patches = patches[start : start + n_patches]
+        patches = np.array(patches)
+    if (p != size):
+        patches = np.stack([np.asarray(Image.fromarray(patch).resize((size, size), Image.BILINEAR))
+                            for patch in patches])
+    if (random_rotation and rotation == 'dihedral'):
+        dihedral_images(patches, rng.randint(0, 8, size = patches.shape[0]))
+        if (residual_angle > 0):
+            rotate_images_by(patches, rng.uniform(-residual_angle, residual_angle, size = patches.shape[0]),
+                             interpolation)
+    elif (random_rotation):
+        rotate_images_by(patches, rng.uniform(0, 360, size = patches.shape[0]), interpolation)
+    return patches
+
+
+def produce(worker_id, ring, jobs, filled, paths, labels, bag_index, params, seed):
+    rng = np.random.RandomState(seed + worker_id)
+    try:
+        while (True):
+            job = jobs.get()
+            if (job is None):
+                return
+            slot, bags = job
+            views = ring.slot(slot)
+            n = 0
+            for b, i in enumerate(bags):
+                image = np.asarray(Image.open(paths[i]).convert('RGB'), dtype = np.uint8)
+                patches = make_bag(image, rng, **params)
+                views['images'][n : n + patches.shape[0]] = patches
+                views['bag_index'][n : n + patches.shape[0]] = bag_index[i]
+                views['labels'][n : n + patches.shape[0]] = labels[i]
+                views['mi_labels'][b] = labels[i]
+                n += patches.shape[0]
+            filled.put((slot, n))
+    except Exception:
+        filled.put((None, traceback.format_exc()))
+
+
+class BagProducer:
+    """
+
+    batches() yields (images, labels, mi_labels, bag_index) copies of the ring slots, a slot is
+    freed as soon as it is copied. labels are per patch, per bag (mi_labels) in mode 'mi_branch'
+    params: batch_size, patch_size, n_patches, scheme, overlap, size (resize target),
+            n_times_90, random_rotation, rotation, residual_angle, interpolation, mode
+
+    """
+
+    def __init__(self, paths, labels, bag_index, params, image_shape, n_workers = 8, n_slots = 16, seed = 1):
+        self.params = params
+        self.n_workers = n_workers
+        self.n_per_bag = bag_size(image_shape, params['patch_size'], params['n_patches'], params['scheme'],
+                                  params.get('overlap', 0))
+        max_n = params['batch_size'] * self.n_per_bag
+        size = params['size']
+        self.ring = SlotRing(n_slots, {'images': ((max_n, size, size, image_shape[-1]), np.uint8),
+                                       'labels': ((max_n,), np.int32),
+                                       'mi_labels': ((params['batch_size'],), np.int32),
+                                       'bag_index': ((max_n,), np.int64)})
+
+        # epoch order dealt out by the parent, batch_size images per job
+        self.rng = np.random.RandomState(seed)
+        self.n_images = len(paths)
+        if (self.n_images < params['batch_size']):
+            raise ValueError(f"{self.n_images} training images for batches of {params['batch_size']}")
+        self.order = []
+
+        context = mp.get_context('fork')
+        self.jobs = context.Queue()
+        self.filled = context.Queue()
+        for slot in range(n_slots):
+            self.jobs.put((slot, self.next_bags()))
+        self.workers = [context.Process(target = produce, daemon = True,
+                                        args = (w, self.ring, self.jobs, self.filled, np.asarray(paths),
+                                                np.asarray(labels), np.asarray(bag_index), params, seed))
+                        for w in range(n_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def next_bags(self):
+        # the next batch_size images of the current pass, a new permutation once it is used up
+        batch_size = self.params['batch_size']
+        if (len(self.order) == 0):
+            permutation = self.rng.permutation(self.n_images)
+            self.order = [permutation[i : i + batch_size]
+                          for i in range(0, self.n_images - batch_size + 1, batch_size)][::-1]
+        return self.order.pop()
+
+    def batches(self):
+        while (True):
+            slot, n = self.filled.get()
+            if (slot is None):
+                raise RuntimeError("Bag producer worker failed:\n" + n)
+            views = self.ring.slot(slot)
+            n_bags = self.params['batch_size']
+            labels = views['labels'][:n] if self.params.get('mode') != 'mi_branch' else views['mi_labels'][:n_bags]
+            batch = (np.array(views['images'][:n]), np.array(labels), np.array(views['mi_labels'][:n_bags]),
+                     np.array(views['bag_index'][:n]))
+            self.jobs.put((slot, self.next_bags()))
+            yield batch
+
+    def close(self):
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join(timeout = 5)
+            if (worker.is_alive()):
+                worker.terminate()
+        self.ring.close()
@@ -0,0 +1,81 @@
+import numpy as np
+
+import struct
+import json
+
+
+# -------------------------------------------------------------------------------------
+
+# Recorded input batches (record_batches.py, ReplayLoader): the (x, y, y_mi, bi) batches of a
+# loader captured once into a single binary file and replayed from memory, so that model step
+# times are measured without the input pipeline. Layout of the file:
+#   magic            8 bytes, MAGIC
+#   header           uint64 length + JSON: recording parameters (mode, pipeline dtype, ...)
+#   per batch        uint64 length + JSON: dtype and shape of x, y, y_mi, bi
+#                    then their raw bytes, in that order
+# Batches may differ in size (tissue mask dropping, last batch)
+# This module must not import tensorflow (like utils.numpy_ops)
+
+MAGIC = b'MIBATCH1'
+FIELDS = ('x', 'y', 'y_mi', 'bi')
+
+
+def _write_json(f, obj):
+    data = json.dumps(obj).encode()
+    f.write(struct.pack('<Q', len(data)))
+    f.write(data)
+
+
+class BatchRecorder:
+    """
+
+    add() the batches as returned by sess.run(loader.get_input()), then close()
+
+    """
+
+    def __init__(self, path, metadata = None):
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        _write_json(self.file, dict(metadata or {}))
+        self.n_batches = 0
+        self.nbytes = 0
+
+    def add(self, x, y, y_mi, bi):
+        arrays = [np.ascontiguousarray(a) for a in (x, y, y_mi, bi)]
+        _write_json(self.file, {name: [a.dtype.str, list(a.shape)] for name, a in zip(FIELDS, arrays)})
+        for a in arrays:
+            self.file.write(a.data)
+            self.nbytes += a.nbytes
+        self.n_batches += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read_batches(path):
+    """
+    The whole file is read into memory once, the batches are views of that buffer
+    :return: the recording parameters and the list of (x, y, y_mi, bi) batches
+    """
+    with open(path, 'rb') as f:
+        buffer = memoryview(f.read())
+    if (bytes(buffer[:len(MAGIC)]) != MAGIC):
+        raise ValueError(f"{path} is not a batch recording (record_batches.py)")
+
+    def read_json(offset):
+        length, = struct.unpack_from('<Q', buffer, offset)
+        offset += 8
+        return json.loads(bytes(buffer[offset : offset + length]).decode()), offset + length
+
+    metadata, offset = read_json(len(MAGIC))
+    batches = []
+    while (offset < len(buffer)):
+        shapes, offset = read_json(offset)
+        batch = []
+        for name in FIELDS:
+            dtype, shape = np.dtype(shapes[name][0]), shapes[name][1]
+            count = int(np.prod(shape))
+            batch.append(np.frombuffer(buffer, dtype = dtype, count = count, offset = offset).reshape(shape))
+            offset += count * dtype.itemsize
+        batches.append(tuple(batch))
+    return metadata, batches
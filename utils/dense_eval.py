@@ -0,0 +1,99 @@
+import tensorflow as tf
+import numpy as np
+from PIL import Image
+
+from utils.model_utils import roi_average
+from utils.numpy_ops import patch_positions, receptive_field_boxes, mi_pool_numpy, dense_numpy, softmax_numpy, hash_numpy
+from utils.quantization import head_weights
+
+
+# -------------------------------------------------------------------------------------
+
+# Fully-convolutional (dense) evaluation of the sequential patch bags
+# Overlapping patches share most of their convolutions, so instead of running the backbone
+# on every patch it runs once over the whole image (resized so that a patch is 227 pixels
+# like in the loaders) and the embedding of a patch is the mean of the cells of the last
+# feature map whose receptive field centres fall inside the patch (the global average
+# pooling of the patch model, restricted to its region). The cost no longer depends on
+# the overlap. Borders differ from the explicit patches: the image is not zero padded and
+# the receptive fields of cells near the patch edges see the neighbouring tissue.
+# The MI pooling and the heads run in NumPy (like utils.quantization).
+
+def dense_input_shape(config, image_shape):
+    """
+    Input shape of the fully-convolutional graph (PlaceholderLoader input_shape) for images
+    of image_shape (h, w) cut in patches of config.patch_size
+    """
+    scale = 227 / config.patch_size
+    return int(round(image_shape[0] * scale)), int(round(image_shape[1] * scale)), config.channels
+
+
+def bag_probabilities(embeddings, heads, pooling = 'average'):
+    """
+    Class probabilities of one bag from the embeddings of its patches
+    (SI only models: the patch probabilities are averaged)
+    :param heads: dict with the (weights, biases) of 'logits_mi' / 'logits_si' and optionally 'hash' / 'hash_mi'
+    """
+    if (heads.get('logits_mi') is None):
+        return softmax_numpy(dense_numpy(hash_numpy(embeddings, heads), *heads['logits_si'])).mean(axis=0)
+    pooled = mi_pool_numpy(embeddings, np.zeros(embeddings.shape[0], dtype=np.int64), pooling)
+    return softmax_numpy(dense_numpy(hash_numpy(pooled, heads, pooled = True), *heads['logits_mi']))[0]
+
+
+class DenseEvaluator:
+    """
+
+    Patch embeddings and bag predictions of whole images from one fully-convolutional pass
+    The model must be built on a PlaceholderLoader with input_shape = dense_input_shape(...)
+    (the variables are the ones of the patch model, any checkpoint can be loaded)
+
+    """
+
+    def __init__(self, sess, data_loader, model, config, image_shape):
+        """
+        :param image_shape: (h, w) of the images in pixels, before resizing
+        """
+        if (getattr(model, 'feature_map', None) is None):
+            raise ValueError(f"{config.model_type} has no convolutional feature map")
+        self.sess = sess
+        self.data_loader = data_loader
+        self.model = model
+        self.config = config
+        self.image_shape = tuple(image_shape[:2])
+        self.input_shape = tuple(data_loader.x.shape.as_list()[1:3])
+        self.scale = self.input_shape[0] / self.image_shape[0]
+        self.feature_shape = tuple(model.feature_map.shape.as_list()[1:3])
+
+        # the boxes are fed, one graph serves every overlap
+        self.boxes = tf.placeholder(tf.int32, shape=(None, 4), name='dense_boxes')
+        self.patch_embeddings = roi_average(model.feature_map, self.boxes)
+        self.heads = {name: head_weights(sess, name) for name in ['logits_mi', 'logits_si', 'hash', 'hash_mi']}
+
+    def patch_boxes(self, overlap):
+        p = self.config.patch_size
+        positions = patch_positions(self.image_shape, (p, p), overlap) * self.scale
+        return receptive_field_boxes(positions, p * self.scale, self.feature_shape, self.model.feature_stride)
+
+    def resize(self, images):
+        if (self.input_shape == self.image_shape):
+            return np.asarray(images, dtype=np.float32)
+        size = (self.input_shape[1], self.input_shape[0])
+        return np.stack([np.asarray(Image.fromarray(np.asarray(x, dtype=np.uint8)).resize(size, Image.BILINEAR))
+                         for x in images]).astype(np.float32)
+
+    def embed(self, images, overlap = 0):
+        """
+        :param images: B X h X w X 3 uint8 images of image_shape
+        :return: B X n_patches X embedding size, the patches in the order of extract_patches_numpy
+        """
+        boxes = self.patch_boxes(overlap)
+        embeddings = self.sess.run(self.patch_embeddings,
+                                   feed_dict={self.data_loader.x: self.resize(images), self.boxes: boxes,
+                                              self.model.is_training: False})
+        return embeddings.reshape(len(images), boxes.shape[0], -1)
+
+    def predict(self, images, overlap = 0):
+        """
+        :return: B X num_classes bag probabilities
+        """
+        return np.stack([bag_probabilities(x, self.heads, self.config.pooling) for x in self.embed(images, overlap)])
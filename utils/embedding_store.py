@@ -0,0 +1,101 @@
+import numpy as np
+
+import json
+import os
+
+
+# -------------------------------------------------------------------------------------
+
+# On-disk store of patch embeddings, keyed by image path and patch position
+# Layout of the store directory:
+#   embeddings.npy   all patch embeddings, n_patches_total X dim (float16 by default), memory mapped
+#   index.npz        per image: path, label, offset and count into embeddings.npy
+#                    per patch: (row, col) of the top-left corner in the image
+#   metadata.json    model type, embedding dim, dtype and tiling parameters
+
+EMBEDDINGS_FILE = 'embeddings.npy'
+INDEX_FILE = 'index.npz'
+METADATA_FILE = 'metadata.json'
+
+
+class EmbeddingStoreWriter:
+    """
+
+    Append the embeddings of one image at a time, then close() to write the index
+    Embeddings are written straight to a memory mapped .npy of known total size
+
+    """
+
+    def __init__(self, store_dir, n_patches_total, dim, dtype = 'float16', metadata = None):
+        if (not os.path.exists(store_dir)):
+            os.makedirs(store_dir)
+        self.store_dir = store_dir
+        # dim is the embedding size, or the shape of a feature map (see utils.activation_cache)
+        dim = [int(d) for d in dim] if np.ndim(dim) else int(dim)
+        self.embeddings = np.lib.format.open_memmap(os.path.join(store_dir, EMBEDDINGS_FILE), mode='w+',
+                                                    dtype=np.dtype(dtype), shape=(int(n_patches_total), *np.atleast_1d(dim).tolist()))
+        self.metadata = dict(metadata or {}, dim=dim, dtype=dtype)
+        self.paths, self.labels, self.offsets, self.counts, self.positions = [], [], [], [], []
+        self.offset = 0
+
+    def add(self, image_path, label, embeddings, positions):
+        n = embeddings.shape[0]
+        self.embeddings[self.offset : self.offset + n] = embeddings
+        self.paths.append(image_path)
+        self.labels.append(label)
+        self.offsets.append(self.offset)
+        self.counts.append(n)
+        self.positions.append(np.asarray(positions, dtype=np.int32))
+        self.offset += n
+
+    def close(self):
+        self.embeddings.flush()
+        np.savez(os.path.join(self.store_dir, INDEX_FILE),
+                 paths = np.asarray(self.paths), labels = np.asarray(self.labels),
+                 offsets = np.asarray(self.offsets, dtype=np.int64), counts = np.asarray(self.counts, dtype=np.int64),
+                 positions = np.concatenate(self.positions))
+        with open(os.path.join(self.store_dir, METADATA_FILE), 'w') as f:
+            json.dump(dict(self.metadata, n_images = len(self.paths), n_patches = self.offset), f, indent=2)
+
+
+class EmbeddingStore:
+    """
+
+    Read access to a store written by EmbeddingStoreWriter
+
+    """
+
+    def __init__(self, store_dir, in_memory = True):
+        with open(os.path.join(store_dir, METADATA_FILE)) as f:
+            self.metadata = json.load(f)
+        index = np.load(os.path.join(store_dir, INDEX_FILE))
+        self.paths = index['paths']
+        self.labels = index['labels']
+        self.offsets = index['offsets']
+        self.counts = index['counts']
+        self.positions = index['positions']
+
+        self.embeddings = np.load(os.path.join(store_dir, EMBEDDINGS_FILE), mmap_mode = None if in_memory else 'r')
+        self.lookup = {path: i for i, path in enumerate(self.paths)}
+        self.dim = self.metadata['dim']
+
+    def __len__(self):
+        return len(self.paths)
+
+    def image_index(self, image_path):
+        return self.lookup[image_path]
+
+    def get(self, i):
+        """
+        :param i: image index (see image_index)
+        :return: embeddings and (row, col) positions of the patches of image i
+        """
+        start, end = self.offsets[i], self.offsets[i] + self.counts[i]
+        return self.embeddings[start:end], self.positions[start:end]
+
+    def get_patch(self, image_path, position):
+        embeddings, positions = self.get(self.image_index(image_path))
+        match = np.where((positions == np.asarray(position)).all(axis=1))[0]
+        if (len(match) == 0):
+            raise KeyError(f"No patch at {position} in {image_path}")
+        return embeddings[match[0]]
@@ -0,0 +1,242 @@
+import tensorflow as tf
+from tensorflow.tools.graph_transforms import TransformGraph
+
+import logging
+import pprint
+import copy
+
+
+# -------------------------------------------------------------------------------------
+
+# Functions to turn a training graph into a lean inference graph:
+#   1. freeze variables into constants and keep only the subgraph feeding the outputs
+#      (drops the loss, the optimizer and the moving statistics update ops)
+#   2. replace the "is_training" placeholder by a constant and remove the dead branch
+#      of every tf.cond that depends on it (the custom _bn and ResNeXt batch norms)
+#   3. switch fused batch norms that still compute batch moments to moving statistics
+#   4. constant-fold and fold the batch norm multiplications into the conv kernels
+
+INFERENCE_TRANSFORMS = ['remove_nodes(op=Identity, op=CheckNumerics, op=StopGradient)',
+                        'fold_constants(ignore_errors=true)',
+                        'fold_batch_norms',
+                        'fold_old_batch_norms',
+                        'fold_constants(ignore_errors=true)',
+                        'strip_unused_nodes',
+                        'sort_by_execution_order']
+
+
+def _node_name(tensor_name):
+    if (tensor_name.startswith('^')):
+        tensor_name = tensor_name[1:]
+    return tensor_name.split(':')[0]
+
+
+def _bool_const(name, value):
+    node = tf.NodeDef()
+    node.op = 'Const'
+    node.name = name
+    node.attr['dtype'].type = tf.bool.as_datatype_enum
+    node.attr['value'].tensor.CopyFrom(tf.make_tensor_proto(value, dtype=tf.bool))
+    return node
+
+
+def _resolve_bool(name, nodes):
+    # follow Identity chains down to a boolean constant, None if not constant
+    node = nodes.get(_node_name(name))
+    while node is not None and node.op == 'Identity':
+        node = nodes.get(_node_name(node.input[0]))
+    if (node is None or node.op != 'Const'):
+        return None
+    return bool(tf.make_ndarray(node.attr['value'].tensor))
+
+
+def replace_training_flag(graph_def, flag_name, value = False):
+    """
+    Replace the boolean training placeholder by a constant
+    :param graph_def: GraphDef to rewrite (not modified)
+    :param flag_name: node name of the placeholder, e.g. 'inputs/Training_flag'
+    :param value: constant value to bake in
+    :return: new GraphDef
+    """
+    out = tf.GraphDef()
+    out.versions.CopyFrom(graph_def.versions)
+    for node in graph_def.node:
+        if (node.name == flag_name):
+            out.node.extend([_bool_const(flag_name, value)])
+        else:
+            out.node.extend([copy.deepcopy(node)])
+    return out
+
+
+def remove_dead_branches(graph_def):
+    """
+    Remove the untaken branch of every Switch/Merge pair whose predicate is constant
+    Dead outputs propagate through data and control edges like the TF executor does,
+    Merge nodes are replaced by their single live input
+    :param graph_def: GraphDef with constant predicates (see replace_training_flag)
+    :return: new GraphDef without the resolved Switch/Merge nodes
+    """
+    nodes = {node.name: node for node in graph_def.node}
+
+    # tensor name --> replacement tensor name, dead tensors / nodes and removed nodes
+    forward = {}
+    dead_tensors = set()
+    dead_nodes = set()
+    removed = set()
+
+    def resolve(name):
+        is_control = name.startswith('^')
+        base = name[1:] if is_control else name
+        if (':' not in base):
+            base += ':0'
+        while base in forward:
+            base = forward[base]
+        if (is_control):
+            return '^' + _node_name(base)
+        return base
+
+    def is_dead(name):
+        if (name.startswith('^')):
+            return _node_name(name) in dead_nodes
+        r = resolve(name)
+        return r in dead_tensors or _node_name(r) in dead_nodes
+
+    for node in _topological_order(graph_def):
+        data_inputs = [i for i in node.input if not i.startswith('^')]
+
+        if (node.op == 'Merge'):
+            live = [i for i in data_inputs if not is_dead(i)]
+            if (len(live) == 0):
+                dead_nodes.add(node.name)
+            elif (len(live) == 1 and len(data_inputs) > 1):
+                forward[node.name + ':0'] = resolve(live[0])
+                removed.add(node.name)
+            continue
+
+        if any(is_dead(i) for i in node.input):
+            dead_nodes.add(node.name)
+            continue
+
+        if (node.op == 'Switch'):
+            pred = _resolve_bool(resolve(node.input[1]), nodes)
+            if (pred is not None):
+                taken, untaken = (1, 0) if pred else (0, 1)
+                forward[node.name + ':' + str(taken)] = resolve(node.input[0])
+                dead_tensors.add(node.name + ':' + str(untaken))
+                removed.add(node.name)
+
+    out = tf.GraphDef()
+    out.versions.CopyFrom(graph_def.versions)
+    for node in graph_def.node:
+        if (node.name in dead_nodes or node.name in removed):
+            continue
+        new_node = copy.deepcopy(node)
+        del new_node.input[:]
+        for i in node.input:
+            r = resolve(i)
+            if (r.startswith('^') and _node_name(r) in removed):
+                # control edges on resolved switches only carried the branch liveness
+                continue
+            new_node.input.append(r)
+        out.node.extend([new_node])
+
+    logging.info(f"Removed nodes from dead branches: {pprint.pformat(len(dead_nodes) + len(removed))}")
+    return out
+
+
+def _topological_order(graph_def):
+    nodes = {node.name: node for node in graph_def.node}
+    # NextIteration closes while-loop cycles, skip its back edge when ordering
+    deps = {node.name: set(_node_name(i) for i in node.input
+                           if nodes.get(_node_name(i)) is not None and nodes[_node_name(i)].op != 'NextIteration')
+            for node in graph_def.node}
+
+    order = []
+    visited = set()
+    for name in nodes:
+        stack = [(name, False)]
+        while stack:
+            current, expanded = stack.pop()
+            if (expanded):
+                if (current not in visited):
+                    visited.add(current)
+                    order.append(nodes[current])
+                continue
+            if (current in visited):
+                continue
+            stack.append((current, True))
+            stack.extend((d, False) for d in deps[current] if d not in visited)
+    return order
+
+
+def use_moving_statistics(graph_def):
+    """
+    Switch FusedBatchNorm nodes built with is_training=True (e.g. slim.batch_norm with its
+    default arguments in resnet_v2) to inference mode using their moving statistics,
+    so that they no longer compute batch moments and can be folded
+    :param graph_def: frozen GraphDef
+    :return: new GraphDef
+    """
+    out = copy.deepcopy(graph_def)
+    names = set(node.name for node in out.node)
+    switched = 0
+    for node in out.node:
+        if (not node.op.startswith('FusedBatchNorm') or not node.attr['is_training'].b):
+            continue
+        scope = node.name.rsplit('/', 1)[0]
+        mean, variance = scope + '/moving_mean', scope + '/moving_variance'
+        if (mean not in names or variance not in names):
+            continue
+        node.input[3] = mean
+        node.input[4] = variance
+        node.attr['is_training'].b = False
+        switched += 1
+
+    logging.info(f"Batch norms switched to moving statistics: {pprint.pformat(switched)}")
+    return out
+
+
+def optimize_for_inference(sess, input_names, output_names, training_flag_name = 'inputs/Training_flag',
+                           moving_statistics = True, transforms = INFERENCE_TRANSFORMS):
+    """
+    Build the optimized inference GraphDef from the graph held by a session
+    :param sess: session with the trained (or restored) variables
+    :param input_names: node names of the inputs to keep, e.g. ['placeholder_inputs/x']
+    :param output_names: node names of the outputs, e.g. ['network/Softmax']
+    :param training_flag_name: node name of the is_training placeholder
+    :param moving_statistics: rewrite training-mode fused batch norms to use moving statistics
+    :param transforms: graph transforms applied at the end (constant and batch norm folding)
+    :return: optimized GraphDef
+    """
+    graph_def = sess.graph.as_graph_def()
+    logging.info(f"Nodes in training graph: {pprint.pformat(len(graph_def.node))}")
+
+    # keep the forward pass only (loss, optimizer and update ops are pruned)
+    graph_def = tf.graph_util.extract_sub_graph(graph_def, output_names)
+    graph_def = tf.graph_util.convert_variables_to_constants(sess, graph_def, output_names)
+
+    names = set(node.name for node in graph_def.node)
+    if (training_flag_name in names):
+        graph_def = replace_training_flag(graph_def, training_flag_name, value = False)
+        graph_def = remove_dead_branches(graph_def)
+        graph_def = tf.graph_util.extract_sub_graph(graph_def, output_names)
+
+    if (moving_statistics):
+        graph_def = use_moving_statistics(graph_def)
+
+    graph_def = TransformGraph(graph_def, input_names, output_names, transforms)
+
+    logging.info(f"Nodes in inference graph: {pprint.pformat(len(graph_def.node))}")
+    return graph_def
+
+
+def save_graph_def(graph_def, path):
+    with tf.gfile.GFile(path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+
+
+def load_graph_def(path):
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(path, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+    return graph_def
@@ -0,0 +1,263 @@
+import numpy as np
+
+from itertools import combinations
+from math import comb
+
+from utils.numpy_ops import mi_pool_numpy, dense_numpy
+
+
+# -------------------------------------------------------------------------------------
+
+# Retrieval index over binary hash codes of bags and patches (Deep Multiple Instance Hashing)
+# Codes are packed 8 bits per byte, the Hamming distance is the popcount of the xor.
+# HashIndex.search is an exact linear scan, MultiIndexHash adds the multi-index hashing
+# of Norouzi et al. for sub-linear exact k-NN search: the codes are split into m
+# substrings, each indexed in a sorted table, and for a query all table entries within
+# substring radius s = 0, 1, ... are verified until the k-th distance is < m * (s + 1)
+# (pigeonhole: a code at distance d has a substring within distance d // m).
+
+if hasattr(np, 'bitwise_count'):
+    def popcount(x):
+        return np.bitwise_count(x)
+else:
+    _POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(x):
+        return _POPCOUNT8[x]
+
+
+def binarize(h):
+    # codes from the tanh hash activations
+    return h > 0
+
+
+def pack_codes(bits):
+    """
+    :param bits: n X n_bits boolean array, n_bits a multiple of 8
+    :return: n X n_bits/8 uint8 array
+    """
+    return np.packbits(np.asarray(bits, dtype=bool), axis=-1)
+
+
+def hamming_distances(query, codes):
+    """
+    :param query: n_bytes packed code
+    :param codes: n X n_bytes packed codes
+    :return: n distances
+    """
+    return popcount(np.bitwise_xor(codes, query)).sum(axis=-1, dtype=np.int32)
+
+
+def top_k(distances, k):
+    k = min(k, distances.shape[0])
+    idx = np.argpartition(distances, k - 1)[:k]
+    return idx[np.argsort(distances[idx], kind='stable')]
+
+
+class HashIndex:
+    """
+
+    Packed binary codes with one entry per bag (image) or patch
+    Each entry keeps the image id, the patch (row, col) position or (-1, -1) for a bag code,
+    and the label of the image
+
+    """
+
+    def __init__(self, n_bits):
+        if (n_bits % 8 != 0):
+            raise ValueError("The number of hash bits must be a multiple of 8")
+        self.n_bits = n_bits
+        self.codes = np.zeros((0, n_bits // 8), dtype=np.uint8)
+        self.image_ids = np.zeros(0, dtype=np.int64)
+        self.positions = np.zeros((0, 2), dtype=np.int32)
+        self.labels = np.zeros(0, dtype=np.int64)
+        self.image_paths = []
+        self._pending = []
+
+    def __len__(self):
+        self._flush()
+        return self.codes.shape[0]
+
+    def add_image(self, image_path, label, bag_code = None, patch_codes = None, positions = None):
+        """
+        Add the packed codes of one image: its bag code and / or its patch codes
+        :param positions: n_patches X 2 (row, col) of the patches
+        :return: image id
+        """
+        image_id = len(self.image_paths)
+        self.image_paths.append(image_path)
+        if (bag_code is not None):
+            bag_code = np.reshape(bag_code, (1, -1))
+            self._pending.append((bag_code, np.full(1, image_id), -np.ones((1, 2), dtype=np.int32), np.full(1, label)))
+        if (patch_codes is not None):
+            n = patch_codes.shape[0]
+            self._pending.append((patch_codes, np.full(n, image_id), np.asarray(positions, dtype=np.int32),
+                                  np.full(n, label)))
+        return image_id
+
+    def _flush(self):
+        if (len(self._pending) == 0):
+            return
+        codes, image_ids, positions, labels = zip(*self._pending)
+        self.codes = np.concatenate([self.codes, *codes])
+        self.image_ids = np.concatenate([self.image_ids, *image_ids])
+        self.positions = np.concatenate([self.positions, *positions])
+        self.labels = np.concatenate([self.labels, *labels])
+        self._pending = []
+
+    def is_bag(self):
+        self._flush()
+        return self.positions[:, 0] == -1
+
+    def search(self, query, k = 10, bags_only = False):
+        """
+        Exact k nearest neighbours in Hamming distance by linear scan
+        :return: entry indices and distances
+        """
+        self._flush()
+        distances = hamming_distances(query, self.codes)
+        if (bags_only):
+            distances = np.where(self.is_bag(), distances, self.n_bits + 1)
+        idx = top_k(distances, k)
+        return idx, distances[idx]
+
+    def save(self, path):
+        self._flush()
+        np.savez(path, n_bits = self.n_bits, codes = self.codes, image_ids = self.image_ids,
+                 positions = self.positions, labels = self.labels, image_paths = np.asarray(self.image_paths))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        index = cls(int(data['n_bits']))
+        index.codes = data['codes']
+        index.image_ids = data['image_ids']
+        index.positions = data['positions']
+        index.labels = data['labels']
+        index.image_paths = list(data['image_paths'])
+        return index
+
+
+class MultiIndexHash:
+    """
+
+    Multi-index hashing over the codes of a HashIndex for sub-linear exact search
+
+    """
+
+    def __init__(self, index, n_tables = None):
+        """
+        :param index: HashIndex
+        :param n_tables: number of substrings m, by default n_bits / log2(n) rounded to whole bytes
+        """
+        self.index = index
+        n = len(index)
+        codes = index.codes
+        n_bytes = codes.shape[1]
+
+        if (n_tables is None):
+            # substrings of about log2(n) bits, in whole bytes dividing the code length
+            target = np.log2(max(n, 2)) / 8
+            substring_bytes = min([d for d in range(1, min(n_bytes, 4) + 1) if n_bytes % d == 0],
+                                  key = lambda d: abs(d - target))
+            n_tables = n_bytes // substring_bytes
+        if (n_bytes % n_tables != 0):
+            raise ValueError("The code length in bytes must be divisible by the number of tables")
+
+        self.n_tables = n_tables
+        self.substring_bytes = n_bytes // n_tables
+        self.substring_bits = self.substring_bytes * 8
+
+        # one sorted table per substring: keys, and entry ids grouped by key (CSR layout)
+        self.tables = []
+        for j in range(n_tables):
+            keys = self._substring(codes, j)
+            order = np.argsort(keys, kind='stable')
+            unique_keys, starts = np.unique(keys[order], return_index=True)
+            self.tables.append((unique_keys, np.append(starts, n), order))
+
+        self.masks = {}
+
+    def _substring(self, codes, j):
+        chunk = codes[..., j * self.substring_bytes : (j + 1) * self.substring_bytes].astype(np.uint64)
+        value = np.zeros(chunk.shape[:-1], dtype=np.uint64)
+        for b in range(self.substring_bytes):
+            value = (value << np.uint64(8)) | chunk[..., b]
+        return value
+
+    def _flip_masks(self, s):
+        # all substring values with exactly s bits set
+        if (s not in self.masks):
+            self.masks[s] = np.asarray([sum(1 << int(b) for b in bits)
+                                        for bits in combinations(range(self.substring_bits), s)], dtype=np.uint64)
+        return self.masks[s]
+
+    def search(self, query, k = 10, max_radius = None):
+        """
+        Exact k nearest neighbours in Hamming distance
+        :return: entry indices, distances and number of candidates verified
+        """
+        if (max_radius is None):
+            max_radius = self.substring_bits
+        k = min(k, len(self.index))
+
+        query_keys = [self._substring(query, j) for j in range(self.n_tables)]
+        seen = np.zeros(len(self.index), dtype=bool)
+        candidates, distances = [], []
+
+        for s in range(max_radius + 1):
+            # once the tables would be probed more often than there are entries, scan instead
+            if (comb(self.substring_bits, s) * self.n_tables > len(self.index)):
+                break
+
+            masks = self._flip_masks(s)
+            for j, (keys, starts, order) in enumerate(self.tables):
+                values = np.bitwise_xor(masks, query_keys[j])
+                pos = np.searchsorted(keys, values)
+                valid = pos < keys.shape[0]
+                hits = pos[valid][keys[pos[valid]] == values[valid]]
+                if (hits.shape[0] == 0):
+                    continue
+                ids = np.concatenate([order[starts[h] : starts[h + 1]] for h in hits])
+                ids = ids[~seen[ids]]
+                seen[ids] = True
+                candidates.append(ids)
+                distances.append(hamming_distances(query, self.index.codes[ids]))
+
+            if (len(candidates) > 0):
+                all_ids = np.concatenate(candidates)
+                all_distances = np.concatenate(distances)
+                if (all_ids.shape[0] >= k):
+                    best = top_k(all_distances, k)
+                    if (all_distances[best[-1]] < self.n_tables * (s + 1)):
+                        return all_ids[best], all_distances[best], all_ids.shape[0]
+
+        # radius exhausted: fall back to the linear scan
+        idx, d = self.index.search(query, k)
+        return idx, d, len(self.index)
+
+
+class HashIndexWriter:
+    """
+
+    Store writer interface (see extract_embeddings.extract_features) that hashes the patch
+    embeddings with the trained hash layer and adds bag and patch codes to a HashIndex
+
+    """
+
+    def __init__(self, path, hash_weights, pooling = 'average'):
+        self.path = path
+        self.weights, self.biases = hash_weights
+        self.pooling = pooling
+        self.index = HashIndex(self.weights.shape[1])
+
+    def add(self, image_path, label, embeddings, positions):
+        embeddings = embeddings.astype(np.float32)
+        patch_codes = binarize(np.tanh(dense_numpy(embeddings, self.weights, self.biases)))
+        pooled = mi_pool_numpy(embeddings, np.zeros(embeddings.shape[0], dtype=np.int64), self.pooling)
+        bag_code = binarize(np.tanh(dense_numpy(pooled, self.weights, self.biases)))
+
+        self.index.add_image(image_path, label, pack_codes(bag_code), pack_codes(patch_codes), positions)
+
+    def close(self):
+        self.index.save(self.path)
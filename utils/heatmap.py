@@ -0,0 +1,83 @@
+import numpy as np
+from PIL import Image
+
+import os
+
+
+# Per-tile class probability maps, stitched incrementally from sliding-window tiles
+# The map has one cell per cell_size x cell_size pixels of the image (cell_size is the
+# window stride), every window adds its probabilities to the cells it covers and the map
+# is the mean over the windows covering each cell. With a path the sums live in memory
+# mapped .npy files, so the map of a whole slide is never held in memory
+
+# one colour per class (BACH: benign, normal, in situ, invasive)
+CLASS_COLORS = np.array([[46, 204, 113], [52, 152, 219], [241, 196, 15], [231, 76, 60],
+                         [155, 89, 182], [230, 126, 34]], dtype=np.float32)
+
+
+class HeatmapAccumulator:
+
+    def __init__(self, image_shape, cell_size, num_classes, path = None):
+        """
+        :param image_shape: (h, w) of the image in pixels
+        :param cell_size: pixels per map cell
+        :param path: prefix of the memory mapped <path>_sum.npy / <path>_count.npy, None for in memory
+        """
+        self.cell_size = cell_size
+        self.shape = (-(-image_shape[0] // cell_size), -(-image_shape[1] // cell_size))
+        self.path = path
+        if (path is not None):
+            self.sum = np.lib.format.open_memmap(path + '_sum.npy', mode='w+', dtype=np.float32,
+                                                 shape=(*self.shape, num_classes))
+            self.count = np.lib.format.open_memmap(path + '_count.npy', mode='w+', dtype=np.float32,
+                                                   shape=self.shape)
+        else:
+            self.sum = np.zeros((*self.shape, num_classes), dtype=np.float32)
+            self.count = np.zeros(self.shape, dtype=np.float32)
+
+    def add(self, positions, size, probabilities):
+        """
+        :param positions: n X 2 (y, x) top-left corners of the windows in pixels (may be negative)
+        :param size: window size in pixels
+        :param probabilities: n X num_classes
+        """
+        c = self.cell_size
+        for (y, x), p in zip(positions, probabilities):
+            r0, r1 = max(y // c, 0), min(-(-(y + size) // c), self.shape[0])
+            c0, c1 = max(x // c, 0), min(-(-(x + size) // c), self.shape[1])
+            self.sum[r0:r1, c0:c1] += p
+            self.count[r0:r1, c0:c1] += 1
+
+    def probabilities(self):
+        # cells covered by no window (skipped background) are 0
+        return self.sum / np.maximum(self.count, 1)[..., np.newaxis]
+
+    def save(self, path):
+        """
+        Write the probability map (float16 .npy, cells X classes) and remove the sums
+        """
+        np.save(path, self.probabilities().astype(np.float16))
+        if (self.path is not None):
+            del self.sum, self.count
+            os.remove(self.path + '_sum.npy')
+            os.remove(self.path + '_count.npy')
+
+
+def overlay_png(probabilities, background, path, alpha = 0.5, max_side = 2048):
+    """
+    Blend the class of highest probability (colour, opacity scaled by the probability) over
+    a thumbnail of the image
+    :param probabilities: cells_h X cells_w X num_classes map
+    :param background: h X w X 3 uint8 thumbnail (any size with the same aspect ratio)
+    """
+    scale = min(1.0, max_side / max(background.shape[:2]))
+    size = (int(background.shape[1] * scale), int(background.shape[0] * scale))
+    background = np.asarray(Image.fromarray(background).resize(size, Image.BILINEAR), dtype=np.float32)
+
+    best = probabilities.argmax(axis=-1)
+    weight = alpha * probabilities.max(axis=-1)
+    colors = CLASS_COLORS[best % len(CLASS_COLORS)]
+    colors = np.asarray(Image.fromarray(colors.astype(np.uint8)).resize(size, Image.NEAREST), dtype=np.float32)
+    weight = np.asarray(Image.fromarray(weight.astype(np.float32), mode='F').resize(size, Image.NEAREST))[..., np.newaxis]
+
+    Image.fromarray((background * (1 - weight) + colors * weight).astype(np.uint8)).save(path)
@@ -0,0 +1,86 @@
+import numpy as np
+from PIL import Image
+
+from collections import OrderedDict
+import threading
+
+
+# -------------------------------------------------------------------------------------
+
+# Byte-budgeted LRU cache of decoded images (DatasetFileLoader, Config.image_cache_mb)
+# The loader reads images through DecodedImageCache.read in a tf.py_func, the parallel map
+# calls run in threads of the same process and share the one cache (guarded by a lock, the
+# decode itself runs outside of it). Once the budget is reached the least recently used images
+# are evicted, images larger than the whole budget are decoded and never cached, so a dataset
+# larger than the budget degrades to decoding the misses only.
+# This module must not import tensorflow (like utils.numpy_ops)
+
+
+def decode_png(path):
+    return np.asarray(Image.open(path).convert('RGB'), dtype=np.uint8)
+
+
+class DecodedImageCache:
+    """
+
+    read(path) returns the decoded uint8 image, from the cache or decoded and inserted
+    Counters: hits, misses, evictions, bypassed (larger than the budget), bytes in use
+
+    """
+
+    def __init__(self, budget_mb, decode = decode_png):
+        self.budget = int(budget_mb * 2**20)
+        self.decode = decode
+        self.images = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypassed = 0
+
+    def read(self, path):
+        if (isinstance(path, bytes)):
+            # tf.py_func passes strings as bytes
+            path = path.decode()
+        with self.lock:
+            image = self.images.get(path)
+            if (image is not None):
+                self.images.move_to_end(path)
+                self.hits += 1
+                return image
+            self.misses += 1
+
+        image = self.decode(path)
+        image.setflags(write = False)
+        with self.lock:
+            self.insert(path, image)
+        return image
+
+    def insert(self, path, image):
+        if (image.nbytes > self.budget):
+            self.bypassed += 1
+            return
+        if (path in self.images):
+            # decoded concurrently by another reader
+            return
+        while (self.nbytes + image.nbytes > self.budget):
+            _, evicted = self.images.popitem(last = False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+        self.images[path] = image
+        self.nbytes += image.nbytes
+
+    def __len__(self):
+        return len(self.images)
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'bypassed': self.bypassed, 'hit_rate': self.hits / requests if requests else 0.0,
+                    'images': len(self.images), 'mb': self.nbytes / 2**20, 'budget_mb': self.budget / 2**20}
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = self.misses = self.evictions = self.bypassed = 0
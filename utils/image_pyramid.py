@@ -0,0 +1,130 @@
+import numpy as np
+from PIL import Image
+
+from multiprocessing import Pool
+import ntpath
+import json
+import os
+
+
+# Multi-resolution store of the dataset images, built once with build_image_pyramid.py
+# Layout of the store directory:
+#   level_1/<name>.png     full resolution (or .raw, see below)
+#   level_2/<name>.png     1/2 in each dimension, downscaled from the previous level
+#   level_4/ ...
+#   metadata.json          levels, image size and format, stain normalization and directory of
+#                          the source images (build_stain_normalized.py, 'none' for the originals)
+# Format 'png' keeps the files small, format 'raw' stores the uint8 pixels without header
+# (decoded with a read and a reshape, no inflate cost) at h * w * 3 bytes per image
+# This module must not import tensorflow (like utils.numpy_ops)
+
+METADATA_FILE = 'metadata.json'
+
+
+def level_dir(store_dir, level):
+    return os.path.join(store_dir, 'level_{}'.format(level))
+
+
+def level_path(store_dir, image_path, level, format = 'png'):
+    name = os.path.splitext(ntpath.basename(image_path))[0]
+    return os.path.join(level_dir(store_dir, level), name + '.' + format)
+
+
+def write_image_levels(image_path, store_dir, levels, format = 'png'):
+    image = Image.open(image_path).convert('RGB')
+    current = 1
+    for level in levels:
+        if (level != current):
+            w, h = image.size
+            image = image.resize((w * current // level, h * current // level), Image.BOX)
+            current = level
+        path = level_path(store_dir, image_path, level, format)
+        if (format == 'raw'):
+            np.asarray(image, dtype=np.uint8).tofile(path)
+        else:
+            image.save(path)
+
+
+def _write_image_levels(job):
+    return write_image_levels(*job)
+
+
+def build_image_pyramid(image_paths, store_dir, levels = (1, 2, 4, 8), format = 'png', num_workers = 1,
+                        stain_normalization = 'none', source_dir = None):
+    """
+    :param levels: downscaling factors, increasing
+    :param stain_normalization: method the image_paths were normalized with, read from source_dir
+    """
+    levels = sorted(int(l) for l in levels)
+    for level in levels:
+        if (not os.path.exists(level_dir(store_dir, level))):
+            os.makedirs(level_dir(store_dir, level))
+
+    h, w = np.asarray(Image.open(image_paths[0])).shape[:2]
+    jobs = [(path, store_dir, levels, format) for path in image_paths]
+    if (num_workers > 1):
+        with Pool(num_workers) as pool:
+            pool.map(_write_image_levels, jobs)
+    else:
+        for job in jobs:
+            _write_image_levels(job)
+
+    with open(os.path.join(store_dir, METADATA_FILE), 'w') as f:
+        json.dump({'levels': levels, 'image_h': int(h), 'image_w': int(w), 'format': format,
+                   'n_images': len(image_paths), 'stain_normalization': stain_normalization,
+                   'source_dir': source_dir}, f, indent=2)
+
+
+class ImagePyramid:
+    """
+
+    Read access to a store written by build_image_pyramid (all images of the same size)
+
+    """
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, METADATA_FILE)) as f:
+            self.metadata = json.load(f)
+        self.store_dir = store_dir
+        self.levels = self.metadata['levels']
+        self.format = self.metadata['format']
+
+    def level_shape(self, level):
+        # size after successive integer divisions, like write_image_levels
+        h, w, current = self.metadata['image_h'], self.metadata['image_w'], 1
+        for l in self.levels:
+            if (l > level):
+                break
+            h, w, current = h * current // l, w * current // l, l
+        return h, w
+
+    def level_for(self, target_size):
+        """
+        Coarsest level that is at least target_size (h, w) in both dimensions, so the
+        image is only ever downscaled to the target
+        """
+        candidates = [l for l in self.levels if min(np.subtract(self.level_shape(l), target_size)) >= 0]
+        return max(candidates) if len(candidates) > 0 else min(self.levels)
+
+    def check_source(self, stain_normalization = 'none', stain_normalized_dir = None):
+        """
+        Raises ValueError if the levels were not built from the images the loaders read: the
+        stain normalized images of stain_normalized_dir, or the originals for 'none'
+        """
+        built = self.metadata.get('stain_normalization', 'none')
+        source_dir = self.metadata.get('source_dir')
+        if (built != stain_normalization or
+            (built != 'none' and (source_dir is None or
+                                  os.path.abspath(source_dir) != os.path.abspath(stain_normalized_dir)))):
+            raise ValueError(f"The image pyramid {self.store_dir} was built from the '{built}' stain normalized "
+                             f"images of {source_dir}, not the '{stain_normalization}' ones of "
+                             f"{stain_normalized_dir}, run build_image_pyramid.py again")
+
+    def paths(self, image_paths, level):
+        return np.asarray([level_path(self.store_dir, p, level, self.format) for p in image_paths])
+
+    def read(self, image_path, level):
+        path = level_path(self.store_dir, image_path, level, self.format)
+        if (self.format == 'raw'):
+            return np.fromfile(path, dtype=np.uint8).reshape(*self.level_shape(level), 3)
+        return np.asarray(Image.open(path).convert('RGB'))
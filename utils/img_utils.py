@@ -11,6 +11,9 @@ import random
 import ntpath
 import re
 
+from utils.numpy_ops import plan_patch_grid
+from utils.rotation import rot90_images, rotate_images_by
+
 
 def get_images_pathlist_labels(dir_names=["data/0_Benign_PNGs", "data/1_Cnormal_PNGs", "data/2_InSitu_PNGs", "data/3_Invasive_PNGs"], n = 100, pre_shuffle = True, seed = 1):
     if (n > 100):
@@ -98,29 +101,18 @@ def split_train_val(images, labels, bag_index, ratio = 0.8, pre_shuffle = True,
 # Function to pre-augment whole images (needed before patching)
 
     
-def pre_augment_images(images, angles=[0, 90, 180, 270]):
+def pre_augment_images(images, angles=[0, 90, 180, 270], interpolation = 'NEAREST'):
+    # rotation by arbitrary angles in NumPy (utils.rotation), in place, no graph is built
     rotation_vector = [random.choice(angles) for _ in range(images.shape[0])]
-    rotation_vector = np.asarray(rotation_vector) * np.pi / 180
-    images = tf.contrib.image.rotate(images, angles = rotation_vector)
-    return images
+    return rotate_images_by(images, rotation_vector, interpolation = interpolation)
 
 
 
 def rotate_images(images, angles = [0, 90, 180, 270]):
-    X_rotate = []
-    angles = np.array(angles) / 90
-    tf.reset_default_graph()
-    X = tf.placeholder(tf.float32, shape = (images.shape[1], images.shape[2], 3))
-    k = tf.placeholder(tf.int32)
-    tf_img = tf.image.rot90(X, k = k)
-    with tf.Session() as sess:
-        sess.run(tf.global_variables_initializer())
-        for img in images:
-            rotated_img = sess.run(tf_img, feed_dict = {X: img, k: random.choice(angles)})
-            X_rotate.append(rotated_img)
-        
-    X_rotate = np.array(X_rotate, dtype = np.float32)
-    return X_rotate
+    # one random multiple of 90 degrees per image, the images are grouped by rotation and
+    # rotated in place by utils.rotation (same dtype as the input, no TF session)
+    ks = [int(random.choice(angles)) // 90 for _ in range(images.shape[0])]
+    return rot90_images(images, ks)
 
 
 # -------------------------------------------------------------------------------------
@@ -129,7 +121,7 @@ def rotate_images(images, angles = [0, 90, 180, 270]):
 # args:
     # "images": 4-D tensor of shape: n_images X image_width X image_height X image_channels
     # "size": tuple of patch size --> number of patches then determined accordingly
-    # "n_patches": if supplied, try to find the best patch size to match this total number given the "delta"
+    # "n_patches": if supplied, the patch size whose grid has the closest number of patches ("delta" is unused)
 
 # returns:
     # "patches": 5-D tensor of shape: n_images X n_patches_per_image X patch_width X patch_height X patch_channels   
@@ -137,37 +129,21 @@ def rotate_images(images, angles = [0, 90, 180, 270]):
 
 def get_patches_from_images_tensor(images, size=(224, 224), n_patches=-1, delta=5):
     n = images.shape[0]
-    with tf.Session() as sess:
-        if (n_patches != -1):
-            h, w = images.shape[1:3]
-            x = h * w / n_patches
-            size_w = size_h = np.floor(np.sqrt(x))
-            actual_patches = 0
-            while np.abs(n_patches - actual_patches) >= delta:
-                size_w += 1
-                size_h += 1
-                print("Searching for best split")
-                patches = tf.extract_image_patches(images,
-                                              [1, size_w, size_h, 1],
-                                              [1, size_w, size_h, 1],
-                                              [1, 1, 1, 1],
-                                              "SAME")
-                new_shape = (n, -1, size_w, size_h, 3)
-                patches = tf.reshape(patches, shape = new_shape)
-                actual_patches = int(patches.shape[1])                   
-        else:
-            size_w, size_h = size
-
-        patches = tf.extract_image_patches(images,
-                                              [1, size_w, size_h, 1],
-                                              [1, size_w, size_h, 1],
-                                              [1, 1, 1, 1],
-                                              "SAME")
-
-        print("Patches  shape before failing: ", patches.shape)
-        new_shape = (n, -1, size_w, size_h, 3)
-        patches = tf.reshape(patches, shape=new_shape) 
-        number_of_patches_per_image = patches.shape[1]
+    if (n_patches != -1):
+        # patch size from the grid size formula (see utils.numpy_ops.plan_patch_grid)
+        size_w = size_h = plan_patch_grid(images.shape[1:3], n_patches)[0]
+    else:
+        size_w, size_h = size
+
+    patches = tf.extract_image_patches(images,
+                                          [1, size_w, size_h, 1],
+                                          [1, size_w, size_h, 1],
+                                          [1, 1, 1, 1],
+                                          "SAME")
+
+    new_shape = (n, -1, size_w, size_h, 3)
+    patches = tf.reshape(patches, shape=new_shape) 
+    number_of_patches_per_image = patches.shape[1]
     return patches, number_of_patches_per_image
 
 
@@ -175,8 +151,9 @@ def extract_patches_from_tensor(images, size=(224, 224), overlap = 0):
     n = tf.shape(images)[0]
     
     size_w, size_h = size
-    stride_w = (1 - overlap) * size_w
-    stride_h = (1 - overlap) * size_h
+    # integer strides, like utils.numpy_ops.patch_view
+    stride_w = int((1 - overlap) * size_w)
+    stride_h = int((1 - overlap) * size_h)
     
     patches = tf.extract_image_patches(images,
                                        [1, size_h, size_w, 1],
@@ -189,3 +166,43 @@ def extract_patches_from_tensor(images, size=(224, 224), overlap = 0):
     number_of_patches_per_image = tf.shape(patches)[1]
     
     return patches, number_of_patches_per_image
+
+
+# -------------------------------------------------------------------------------------
+
+# The loaders keep images and patches as uint8 (Config.pipeline_dtype) through batching and
+# prefetch, the models cast and normalize them at their input (BaseModel.input_layer).
+# Float results of resizing or color augmentation are rounded back to the pipeline dtype.
+
+def cast_pixels(images, dtype = tf.uint8):
+    if (dtype == tf.uint8 and images.dtype != tf.uint8):
+        return tf.saturate_cast(tf.round(images), tf.uint8)
+    return tf.cast(images, dtype)
+
+
+def resize_patches(images, size, dtype = tf.uint8):
+    # a no-op (no float round trip) when the patches already have the size
+    if (images.shape[1:3].as_list() != list(size)):
+        images = tf.image.resize_images(images, size)
+    return cast_pixels(images, dtype)
+
+
+
+# -------------------------------------------------------------------------------------
+
+# Dihedral patch rotation (Config.patch_rotation = 'dihedral'): each square patch gets one of
+# the 8 rotations by multiples of 90 degrees / reflections, drawn as 3 random bits (flip rows,
+# flip columns, transpose). Each is a copy with permuted indices: no interpolation and no
+# black corners. Optionally followed by a residual rotation by a small uniform angle in
+# [-residual_angle, residual_angle] degrees (interpolated, small corners)
+
+def random_dihedral(images, residual_angle = 0, interpolation = 'NEAREST', seed = None):
+    n = tf.shape(images)[0]
+    bits = tf.random_uniform([3, n], maxval = 2, dtype = tf.int32, seed = seed) > 0
+    images = tf.where(bits[0], tf.reverse(images, [1]), images)
+    images = tf.where(bits[1], tf.reverse(images, [2]), images)
+    images = tf.where(bits[2], tf.transpose(images, [0, 2, 1, 3]), images)
+    if (residual_angle > 0):
+        angles = tf.random_uniform([n], -residual_angle, residual_angle, seed = seed) * np.pi / 180
+        images = tf.contrib.image.rotate(images, angles, interpolation = interpolation)
+    return images
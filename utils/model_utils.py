@@ -28,4 +28,25 @@ def combined_cost_function(y_si, logits_si,
     
     mi_loss = tf.losses.sparse_softmax_cross_entropy(labels = y_mi, logits = logits_mi)
 
-    return (1-beta) * mi_loss + (beta) * si_loss
\ No newline at end of file
+    return (1-beta) * mi_loss + (beta) * si_loss
+
+
+def roi_average(feature_map, boxes):
+    """
+    Mean of the feature map cells inside each box, for every image of the batch, from an
+    integral image of the map (four gathers per box whatever its size)
+    :param feature_map: B X fh X fw X C
+    :param boxes: n X 4 int32 (r0, c0, r1, c1) cell ranges, end exclusive
+    :return: B * n X C, the n boxes of the first image first
+    """
+    integral = tf.cumsum(tf.cumsum(feature_map, axis=1), axis=2)
+    integral = tf.pad(integral, [[0, 0], [1, 0], [1, 0], [0, 0]])
+    shape = tf.shape(integral)
+    flat = tf.reshape(integral, [shape[0], shape[1] * shape[2], shape[3]])
+
+    r0, c0, r1, c1 = tf.unstack(boxes, axis=1)
+    corner = lambda r, c: tf.gather(flat, r * shape[2] + c, axis=1)
+    sums = corner(r1, c1) - corner(r0, c1) - corner(r1, c0) + corner(r0, c0)
+    area = tf.cast((r1 - r0) * (c1 - c0), feature_map.dtype)
+
+    return tf.reshape(sums / area[tf.newaxis, :, tf.newaxis], [-1, feature_map.shape[-1]])
@@ -0,0 +1,234 @@
+import numpy as np
+
+
+# NumPy versions of the patching and MI pooling ops used by the TF graphs
+# This module must not import tensorflow: it is used by the lightweight TFLite runner
+
+# -------------------------------------------------------------------------------------
+
+# NumPy counterpart of extract_patches_from_tensor for a single image (h x w x c),
+# including the zero padding of tf.extract_image_patches with "SAME" padding
+# returns patches of shape: n_patches X patch_height X patch_width X channels (row-major order)
+
+def same_padding(length, size, stride):
+    n_out = int(np.ceil(length / stride))
+    pad = max((n_out - 1) * stride + size - length, 0)
+    return n_out, pad // 2, pad - pad // 2
+
+
+def extract_patches_numpy(image, size=(224, 224), overlap = 0):
+    size_w, size_h = size
+    return patch_view(image, size, overlap).reshape(-1, size_h, size_w, image.shape[-1])
+
+
+def patch_positions(image_shape, size=(224, 224), overlap = 0):
+    # (row, col) of the top-left corner of each patch of extract_patches_numpy in image
+    # coordinates (negative where the patch starts in the padding)
+    size_w, size_h = size
+    stride_w = int((1 - overlap) * size_w)
+    stride_h = int((1 - overlap) * size_h)
+
+    rows, top, _ = same_padding(image_shape[0], size_h, stride_h)
+    cols, left, _ = same_padding(image_shape[1], size_w, stride_w)
+    return np.asarray([(r * stride_h - top, c * stride_w - left) for r in range(rows) for c in range(cols)],
+                      dtype=np.int32)
+
+
+def receptive_field_boxes(positions, size, feature_shape, stride):
+    """
+    Cells of a feature map of the given stride (in pixels) whose receptive field centres
+    fall inside size x size patches, the equivalent of the patches on the feature map of a
+    fully-convolutional pass over the whole image (clipped to the map, at least one cell)
+    :param positions: n X 2 (row, col) top-left corners of the patches in pixels (may be negative)
+    :return: n X 4 int32 (r0, c0, r1, c1) cell ranges, end exclusive
+    """
+    fh, fw = feature_shape
+    positions = np.asarray(positions, dtype=np.float64)
+    r0 = np.clip(np.round(positions[:, 0] / stride), 0, fh - 1)
+    c0 = np.clip(np.round(positions[:, 1] / stride), 0, fw - 1)
+    r1 = np.clip(np.round((positions[:, 0] + size) / stride), r0 + 1, fh)
+    c1 = np.clip(np.round((positions[:, 1] + size) / stride), c0 + 1, fw)
+    return np.stack([r0, c0, r1, c1], axis=1).astype(np.int32)
+
+# -------------------------------------------------------------------------------------
+
+# Patch grids as strided views: the rows x cols patches of an image are a view of the image
+# memory (overlapping patches share it), nothing is copied per patch. 'SAME' padding (like
+# tf.extract_image_patches) makes one zero padded copy of the images when the grid overhangs
+# the border, 'VALID' keeps the patches that lie inside the images and never copies.
+
+def patch_view(images, size=(224, 224), overlap = 0, padding = 'SAME'):
+    """
+    :param images: h X w X c image or n X h X w X c batch
+    :return: read-only view (n X) rows X cols X size_h X size_w X c, patches in the order of
+             extract_patches_numpy when flattened
+    """
+    size_w, size_h = size
+    stride_w = int((1 - overlap) * size_w)
+    stride_h = int((1 - overlap) * size_h)
+
+    single = images.ndim == 3
+    if (single):
+        images = images[np.newaxis]
+    n, h, w, c = images.shape
+
+    if (padding == 'SAME'):
+        rows, top, bottom = same_padding(h, size_h, stride_h)
+        cols, left, right = same_padding(w, size_w, stride_w)
+        if (top + bottom + left + right > 0):
+            images = np.pad(images, ((0, 0), (top, bottom), (left, right), (0, 0)), mode='constant')
+    else:
+        rows = (h - size_h) // stride_h + 1
+        cols = (w - size_w) // stride_w + 1
+
+    sn, sh, sw, sc = images.strides
+    view = np.lib.stride_tricks.as_strided(images, shape=(n, rows, cols, size_h, size_w, c),
+                                           strides=(sn, sh * stride_h, sw * stride_w, sh, sw, sc),
+                                           writeable=False)
+    return view[0] if single else view
+
+
+def needs_padding(image_shape, size=(224, 224), overlap = 0):
+    # True if the 'SAME' grid of patch_view overhangs the border (patch_view copies the images)
+    size_w, size_h = size
+    _, top, bottom = same_padding(image_shape[0], size_h, int((1 - overlap) * size_h))
+    _, left, right = same_padding(image_shape[1], size_w, int((1 - overlap) * size_w))
+    return top + bottom + left + right > 0
+
+
+class PatchGrid:
+    """
+
+    patch_view of a batch of images taken one image at a time: indexing returns the patch
+    grid of that image, so 'SAME' padding copies one image per access instead of the
+    whole batch up front (shape and dtype are those of the full patch_view)
+
+    """
+
+    def __init__(self, images, size=(224, 224), overlap = 0, padding = 'SAME'):
+        self.images = images
+        self.size, self.overlap, self.padding = size, overlap, padding
+        self.shape = (images.shape[0], *patch_view(images[0], size, overlap, padding).shape)
+        self.dtype = images.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, i):
+        return patch_view(self.images[i], self.size, self.overlap, self.padding)
+
+
+def plan_patch_grid(image_shape, n_patches, overlap = 0):
+    """
+    Square patch size whose 'SAME' grid has the number of patches closest to n_patches,
+    from the grid size formula ceil(h / stride) * ceil(w / stride), which does not increase
+    with the stride (binary search, no patches are extracted)
+    :return: patch size, number of patches of the grid
+    """
+    h, w = image_shape[:2]
+    count = lambda stride: -(-h // stride) * -(-w // stride)
+
+    # smallest stride with at most n_patches patches, or the stride just below it
+    low, high = 1, max(h, w)
+    while (low < high):
+        mid = (low + high) // 2
+        if (count(mid) <= n_patches):
+            high = mid
+        else:
+            low = mid + 1
+    stride = min([s for s in (low - 1, low) if s >= 1], key=lambda s: abs(count(s) - n_patches))
+
+    size = max(int(round(stride / (1 - overlap))), 1)
+    return size, count(max(int((1 - overlap) * size), 1))
+
+# -------------------------------------------------------------------------------------
+
+# NumPy counterpart of BaseModel.mi_pool_layer, used where the backbone runs outside of
+# the TF graph (e.g. TFLite or cached embeddings). Bags are returned in order of first
+# appearance in bag_indices like tf.unique does.
+
+def mi_pool_numpy(embeddings, bag_indices, pooling = 'average'):
+    _, first, inverse = np.unique(bag_indices, return_index=True, return_inverse=True)
+    rank = np.empty_like(first)
+    rank[np.argsort(first)] = np.arange(len(first))
+    idx = rank[inverse.reshape(-1)]
+
+    pooled = []
+    for b in range(len(first)):
+        x = embeddings[idx == b]
+        if (pooling == 'max'):
+            pooled.append(x.max(axis=0))
+        elif (pooling == 'lse'):
+            m = x.max(axis=0)
+            pooled.append(m + np.log(np.exp(x - m).sum(axis=0)))
+        else:
+            pooled.append(x.mean(axis=0))
+
+    return np.stack(pooled)
+
+
+def dense_numpy(x, weights, biases):
+    return np.dot(x, weights) + biases
+
+
+def hash_numpy(x, heads, pooled = False):
+    # BaseModel.hash_layer: 'hash_mi' for the pooled bag vectors when the model has one
+    # (multi-scale 'concat' fusion), 'hash' otherwise, identity without hashing head
+    name = 'hash_mi' if pooled and heads.get('hash_mi') is not None else 'hash'
+    if (heads.get(name) is None):
+        return x
+    return np.tanh(dense_numpy(x, *heads[name]))
+
+
+def softmax_numpy(logits):
+    e = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+class OnlinePool:
+    """
+
+    Streaming version of mi_pool_numpy for a single bag too large to hold in memory:
+    embeddings are added chunk by chunk, the state is one vector (two for 'lse')
+
+    """
+
+    def __init__(self, pooling = 'average'):
+        self.pooling = pooling
+        self.count = 0
+        self.state = None
+        self.max = None
+
+    def update(self, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float64)
+        if (embeddings.shape[0] == 0):
+            return
+        m = embeddings.max(axis=0)
+        if (self.count == 0):
+            self.max = m
+            self.state = np.zeros_like(m)
+        elif (self.pooling == 'lse'):
+            # rescale the running sum of exponentials to the new maximum
+            new_max = np.maximum(self.max, m)
+            self.state *= np.exp(self.max - new_max)
+            m = new_max
+        else:
+            m = np.maximum(self.max, m)
+        self.max = m
+
+        if (self.pooling == 'lse'):
+            self.state += np.exp(embeddings - self.max).sum(axis=0)
+        elif (self.pooling != 'max'):
+            self.state += embeddings.sum(axis=0)
+        self.count += embeddings.shape[0]
+
+    def result(self):
+        if (self.count == 0):
+            raise ValueError("No instances were pooled (empty bag)")
+        if (self.pooling == 'max'):
+            pooled = self.max
+        elif (self.pooling == 'lse'):
+            pooled = self.max + np.log(self.state)
+        else:
+            pooled = self.state / self.count
+        return pooled[np.newaxis].astype(np.float32)
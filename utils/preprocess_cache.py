@@ -0,0 +1,221 @@
+import hashlib
+import shutil
+import json
+import time
+import os
+
+
+# -------------------------------------------------------------------------------------
+
+# Content-addressed cache of the deterministic preprocessing stages (stain normalization,
+# image pyramid, tissue index, ...), shared by all runs and experiments using the same root.
+# The output of a stage is stored under the key
+#   sha1(stage name, source checksum, stage parameters, code version)
+# where the source checksum hashes the contents of the input images (or is the key of the
+# upstream stage when stages are chained) and the code version hashes the source files of
+# the modules implementing the stage. Any change of the inputs, of a parameter or of the
+# code is a new entry; entries are never modified once committed.
+# Layout of the cache root:
+#   <stage>-<key>/          stage output (the build function writes anything in there)
+#   <stage>-<key>/entry.json  stage, key, parameters, size, creation time, written last (marks it
+#                           complete); its modification time is the last use (LRU eviction)
+#   checksums.json          content hash of the source files, memoized on (size, mtime)
+# The entries above budget_mb are evicted least recently used first after each build, except
+# those used within the last lease_hours: a run marks the entries it reads as used when it
+# looks them up (run start) and keeps reading them for its whole duration, the lease protects
+# them from the eviction of concurrent runs. A run longer than the lease can still lose its
+# entries to eviction (set lease_hours above the longest run); the explicit removals of
+# manage_preprocess_cache.py (--stage, --unused_days, --all) ignore the lease.
+# This module must not import tensorflow (like utils.numpy_ops)
+
+ENTRY_FILE = 'entry.json'
+CHECKSUMS_FILE = 'checksums.json'
+
+
+def file_sha1(path, block_size = 2**20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def code_version(*modules):
+    """
+    :param modules: imported modules implementing a stage
+    :return: hash of their source files
+    """
+    sha1 = hashlib.sha1()
+    for module in modules:
+        with open(module.__file__, 'rb') as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()[:16]
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+class PreprocessCache:
+    """
+
+    get_or_build() the output directory of a stage: the committed entry of the same key if
+    any, otherwise build(out_dir) is run into a temporary directory which is then committed
+
+    """
+
+    def __init__(self, root, budget_mb = 20480, lease_hours = 48):
+        if (not os.path.exists(root)):
+            os.makedirs(root)
+        self.root = root
+        self.budget = budget_mb * 2**20
+        self.lease = lease_hours * 3600
+        self.checksums = None
+
+    def source_checksum(self, paths):
+        """
+        Content hash of the source files (order independent), each file hashed once and
+        memoized in checksums.json until its size or modification time changes
+        """
+        if (self.checksums is None):
+            checksums_path = os.path.join(self.root, CHECKSUMS_FILE)
+            self.checksums = {}
+            if (os.path.exists(checksums_path)):
+                with open(checksums_path) as f:
+                    self.checksums = json.load(f)
+        sha1, updated = hashlib.sha1(), False
+        for path in sorted(os.path.abspath(str(p)) for p in paths):
+            stat = os.stat(path)
+            memo = self.checksums.get(path)
+            if (memo is None or memo[0] != stat.st_size or memo[1] != stat.st_mtime_ns):
+                memo = [stat.st_size, stat.st_mtime_ns, file_sha1(path)]
+                self.checksums[path] = memo
+                updated = True
+            sha1.update(memo[2].encode())
+        if (updated):
+            self.save_checksums()
+        return sha1.hexdigest()
+
+    def save_checksums(self):
+        tmp_path = os.path.join(self.root, '.{}.{}'.format(CHECKSUMS_FILE, os.getpid()))
+        with open(tmp_path, 'w') as f:
+            json.dump(self.checksums, f)
+        os.replace(tmp_path, os.path.join(self.root, CHECKSUMS_FILE))
+
+    @staticmethod
+    def key(stage, source, params, code):
+        return hashlib.sha1(json.dumps([stage, source, params, code], sort_keys = True).encode()).hexdigest()[:16]
+
+    def entry_dir(self, stage, key):
+        return os.path.join(self.root, '{}-{}'.format(stage, key))
+
+    def lookup(self, stage, key):
+        """
+        :return: the directory of the committed entry (marked as used) or None
+        """
+        entry_dir = self.entry_dir(stage, key)
+        if (not os.path.exists(os.path.join(entry_dir, ENTRY_FILE))):
+            return None
+        os.utime(os.path.join(entry_dir, ENTRY_FILE))
+        return entry_dir
+
+    def get_or_build(self, stage, source, params, code, build, keep = ()):
+        """
+        :param source: source checksum, or the key of the upstream stage
+        :param params: JSON serializable stage parameters
+        :param code: code_version() of the stage
+        :param build: function writing the stage output into the directory it is given
+        :param keep: keys of other entries in use, never evicted by this build
+        :return: the entry directory and its key
+        """
+        key = self.key(stage, source, params, code)
+        entry_dir = self.lookup(stage, key)
+        if (entry_dir is not None):
+            return entry_dir, key
+
+        entry_dir = self.entry_dir(stage, key)
+        tmp_dir = os.path.join(self.root, '.{}-{}.{}'.format(stage, key, os.getpid()))
+        shutil.rmtree(tmp_dir, ignore_errors = True)
+        os.makedirs(tmp_dir)
+        start = time.time()
+        try:
+            build(tmp_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors = True)
+            raise
+        with open(os.path.join(tmp_dir, ENTRY_FILE), 'w') as f:
+            json.dump({'stage': stage, 'key': key, 'source': source, 'params': params, 'code': code,
+                       'nbytes': dir_size(tmp_dir), 'created': start, 'build_seconds': time.time() - start},
+                      f, indent=2)
+        self.commit(tmp_dir, entry_dir)
+        self.evict(self.budget, keep = {key, *keep})
+        return entry_dir, key
+
+    def commit(self, tmp_dir, entry_dir):
+        try:
+            os.rename(tmp_dir, entry_dir)
+            return
+        except OSError:
+            pass
+        if (os.path.exists(os.path.join(entry_dir, ENTRY_FILE))):
+            # committed meanwhile by a concurrent run with the same key
+            shutil.rmtree(tmp_dir, ignore_errors = True)
+            return
+        # stale directory without entry.json (interrupted removal), replaced by the new build
+        shutil.rmtree(entry_dir, ignore_errors = True)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            if (not os.path.exists(os.path.join(entry_dir, ENTRY_FILE))):
+                raise
+            shutil.rmtree(tmp_dir, ignore_errors = True)
+
+    def entries(self):
+        """
+        :return: the committed entries, least recently used first, with their directory and last use
+        """
+        entries = []
+        for name in os.listdir(self.root):
+            entry_file = os.path.join(self.root, name, ENTRY_FILE)
+            if (not name.startswith('.') and os.path.exists(entry_file)):
+                with open(entry_file) as f:
+                    entry = json.load(f)
+                entries.append(dict(entry, dir = os.path.join(self.root, name),
+                                    last_used = os.path.getmtime(entry_file)))
+        return sorted(entries, key = lambda e: e['last_used'])
+
+    def remove(self, entry):
+        # entry.json first: a partially removed entry is no longer a hit
+        os.remove(os.path.join(entry['dir'], ENTRY_FILE))
+        shutil.rmtree(entry['dir'], ignore_errors = True)
+
+    def evict(self, budget, keep = ()):
+        """
+        Removes least recently used entries until the cache fits in budget bytes, the entries
+        in keep or used within the lease are never removed (the cache may stay above budget)
+        :return: the removed entries
+        """
+        entries = self.entries()
+        total = sum(e['nbytes'] for e in entries)
+        removed = []
+        for entry in entries:
+            if (total <= budget):
+                break
+            if (entry['key'] not in keep and time.time() - entry['last_used'] > self.lease):
+                self.remove(entry)
+                total -= entry['nbytes']
+                removed.append(entry)
+        return removed
+
+    def prune(self, stage = None, unused_days = None):
+        """
+        Removes the entries of a stage and / or those unused for unused_days
+        :return: the removed entries
+        """
+        removed = []
+        for entry in self.entries():
+            if ((stage is None or entry['stage'] == stage) and
+                (unused_days is None or time.time() - entry['last_used'] > unused_days * 86400)):
+                self.remove(entry)
+                removed.append(entry)
+        return removed
@@ -0,0 +1,84 @@
+import logging
+import pprint
+import time
+import os
+
+from utils.preprocess_cache import PreprocessCache, code_version
+from utils import stain_norm, image_pyramid, tissue_mask
+
+
+# -------------------------------------------------------------------------------------
+
+# The deterministic offline stages of the loaders run through the preprocessing cache
+# (Config.use_preprocess_cache): each enabled stage is looked up by the content of the
+# dataset images, its parameters and the code of its module, built into the cache on a
+# miss, and the Config path the loaders read it from (stain_normalized_dir,
+# image_pyramid_dir, tissue_index_path) is pointed at the cache entry.
+#   stain_normalized   Config.stain_normalization != 'none' (build_stain_normalized.py)
+#   image_pyramid      Config.use_image_pyramid or Config.multi_scale_levels, built from the
+#                      stain normalized images when enabled (build_image_pyramid.py)
+#   tissue_index       Config.use_tissue_mask (build_tissue_index.py)
+# This module must not import tensorflow (like utils.numpy_ops)
+
+TISSUE_INDEX_FILE = 'tissue_index.npz'
+
+
+def cached_stage(cache, stage, source, params, module, build, keep = ()):
+    def timed_build(out_dir):
+        start = time.perf_counter()
+        build(out_dir)
+        logging.info(f"Preprocessing stage {stage} built in {pprint.pformat(time.perf_counter() - start)} s")
+
+    code = code_version(module)
+    if (cache.lookup(stage, cache.key(stage, source, params, code)) is None):
+        logging.info(f"Preprocessing stage {stage} not cached, building it")
+    entry_dir, key = cache.get_or_build(stage, source, params, code, timed_build, keep)
+    logging.info(f"Preprocessing stage {stage}: {pprint.pformat(entry_dir)}")
+    return entry_dir, key
+
+
+def prepare_preprocessed(config, paths, num_workers = 1):
+    """
+    :param paths: all the dataset images (get_images_pathlist_labels)
+    :return: the cache entry directory of each enabled stage
+    """
+    cache = PreprocessCache(config.preprocess_cache_dir, config.preprocess_cache_mb,
+                            config.preprocess_cache_lease_hours)
+    source = cache.source_checksum(paths)
+    entries, keys = {}, []
+
+    # the pyramid is built from the images the loaders read
+    pyramid_paths, pyramid_source, pyramid_dir = paths, source, None
+    if (config.stain_normalization != 'none'):
+        method, downsample = config.stain_normalization, config.stain_estimate_downsample
+        params = {'method': method, 'downsample': downsample, 'target': 'default'}
+        build = lambda out_dir: stain_norm.normalize_dataset(
+            paths, out_dir, method, stain_norm.dataset_target(paths, method, downsample, num_workers),
+            downsample = downsample, num_workers = num_workers)
+        entries['stain_normalized'], key = cached_stage(cache, 'stain_normalized', source, params, stain_norm, build)
+        keys.append(key)
+        config.stain_normalized_dir = entries['stain_normalized']
+        pyramid_paths = [stain_norm.stain_normalized_path(p, config.stain_normalized_dir) for p in paths]
+        pyramid_source, pyramid_dir = key, config.stain_normalized_dir
+
+    if (config.use_image_pyramid or len(config.multi_scale_levels) > 0):
+        params = {'levels': sorted(int(l) for l in config.pyramid_levels), 'format': config.pyramid_format}
+        build = lambda out_dir: image_pyramid.build_image_pyramid(
+            pyramid_paths, out_dir, levels = config.pyramid_levels, format = config.pyramid_format,
+            num_workers = num_workers, stain_normalization = config.stain_normalization, source_dir = pyramid_dir)
+        entries['image_pyramid'], key = cached_stage(cache, 'image_pyramid', pyramid_source, params, image_pyramid, build,
+                                                    keys)
+        keys.append(key)
+        config.image_pyramid_dir = entries['image_pyramid']
+
+    if (config.use_tissue_mask):
+        params = {'patch_size': config.patch_size, 'patches_overlap': config.patches_overlap,
+                  'downsample': config.tissue_mask_downsample,
+                  'saturation_threshold': config.tissue_saturation_threshold}
+        build = lambda out_dir: tissue_mask.build_tissue_index(
+            paths, config.patch_size, config.patches_overlap, downsample = config.tissue_mask_downsample,
+            saturation_threshold = config.tissue_saturation_threshold).save(os.path.join(out_dir, TISSUE_INDEX_FILE))
+        entries['tissue_index'], _ = cached_stage(cache, 'tissue_index', source, params, tissue_mask, build, keys)
+        config.tissue_index_path = os.path.join(entries['tissue_index'], TISSUE_INDEX_FILE)
+
+    return entries
@@ -0,0 +1,122 @@
+import tensorflow as tf
+import numpy as np
+
+from dataloaders.DatasetFileLoader import DatasetFileLoader
+from utils.graph_utils import optimize_for_inference, save_graph_def
+
+import logging
+import pprint
+import tempfile
+import os
+
+
+# -------------------------------------------------------------------------------------
+
+# Post-training int8 quantization of the MI backbones for CPU inference
+# The backbone (patch --> embedding) is converted to a fully integer TFLite model:
+# weights are quantized per output channel, activations per tensor with ranges
+# calibrated on a few batches of BACH patches from the training pipeline.
+# The MI pooling and the logits heads stay in float and run in NumPy
+# (see utils.numpy_ops.mi_pool_numpy), they are a negligible part of the cost.
+
+def calibration_patches(config, n_batches = 10):
+    """
+    Pull a few training batches of patches from DatasetFileLoader in a separate graph
+    :param config: Config class
+    :param n_batches: number of batches (each batch_size bags of n_random_patches patches)
+    :return: float32 array of patches n X 227 X 227 X 3
+    """
+    patches = []
+    with tf.Graph().as_default():
+        data_loader = DatasetFileLoader(config)
+        x = data_loader.get_input()[0]
+        with tf.Session() as sess:
+            data_loader.initialize(sess, train = True)
+            for _ in range(n_batches):
+                patches.append(sess.run(x))
+
+    # the loader yields uint8 patches (see Config.pipeline_dtype)
+    patches = np.concatenate(patches).astype(np.float32)
+    logging.info(f"Calibration patches: {pprint.pformat(patches.shape)}")
+    return patches
+
+
+def backbone_graph_def(sess, data_loader, model):
+    """
+    Optimized inference graph of the backbone only (input patches --> embedding)
+    :return: graph_def, input node name, output node name
+    """
+    input_name = data_loader.x.op.name
+    output_name = model.embedding.op.name
+    graph_def = optimize_for_inference(sess, [input_name], [output_name],
+                                       training_flag_name = model.is_training.op.name)
+    return graph_def, input_name, output_name
+
+
+def head_weights(sess, scope):
+    """
+    Get the weights and biases of a fully connected head, e.g. 'logits_mi' or 'logits_si'
+    :return: (weights, biases) as numpy arrays, None if the head does not exist
+    """
+    variables = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope='network/' + scope + '/')
+    weights = [v for v in variables if v.op.name.endswith('weights')]
+    biases = [v for v in variables if v.op.name.endswith('biases')]
+    if (len(weights) == 0):
+        return None
+    return sess.run(weights[0]), sess.run(biases[0])
+
+
+def convert_to_tflite(graph_def, input_name, output_name, calibration_images = None,
+                      input_shape = (1, 227, 227, 3)):
+    """
+    Convert a frozen backbone graph to TFLite
+    :param graph_def: frozen inference GraphDef (see backbone_graph_def)
+    :param calibration_images: float32 patches, if given the model is quantized to int8
+                               (per-channel weights, calibrated per-tensor activations),
+                               otherwise it stays float32
+    :return: serialized TFLite flatbuffer
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'backbone.pb')
+        save_graph_def(graph_def, path)
+        converter = tf.lite.TFLiteConverter.from_frozen_graph(path, [input_name], [output_name],
+                                                              input_shapes = {input_name: list(input_shape)})
+
+    if (calibration_images is not None):
+        def representative_dataset():
+            for image in calibration_images:
+                yield [image[np.newaxis].astype(np.float32)]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    tflite_model = converter.convert()
+    logging.info(f"TFLite model size (MB): {pprint.pformat(len(tflite_model) / 2**20)}")
+    return tflite_model
+
+
+class TFLiteBackbone:
+    """
+
+    Run a TFLite backbone over a batch of patches
+    The input is resized to the batch size so all patches go through one invoke
+
+    """
+
+    def __init__(self, model_content = None, model_path = None, num_threads = None):
+        self.interpreter = tf.lite.Interpreter(model_content = model_content, model_path = model_path)
+        if (num_threads is not None and hasattr(self.interpreter, 'set_num_threads')):
+            self.interpreter.set_num_threads(num_threads)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.batch = None
+
+    def predict(self, images):
+        if (self.batch != images.shape[0]):
+            self.interpreter.resize_tensor_input(self.input_index, [images.shape[0], *images.shape[1:]])
+            self.interpreter.allocate_tensors()
+            self.batch = images.shape[0]
+        self.interpreter.set_tensor(self.input_index, images.astype(np.float32))
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
@@ -0,0 +1,126 @@
+import numpy as np
+
+
+# Vectorized rotation pre-augmentation of in-memory image arrays (DatasetLoader)
+# Images are grouped by rotation and each group is rotated with one NumPy call per chunk,
+# written back into the input array (in place, also on memory mapped arrays), so no copy of
+# the dataset and no TF graph or session is involved. Chunks bound the temporary memory.
+# This module must not import tensorflow (like utils.numpy_ops)
+
+def random_rotations(n, angles = (0, 90, 180, 270), seed = None):
+    """
+    :return: one angle (degrees, counter-clockwise) per image drawn from angles
+    """
+    rng = np.random.RandomState(seed)
+    return rng.choice(np.asarray(angles), size = n)
+
+
+def _chunks(indices, chunk_size):
+    for start in range(0, len(indices), chunk_size):
+        yield indices[start : start + chunk_size]
+
+
+def rot90_images(images, ks, chunk_size = 32):
+    """
+    Rotate each image by ks[i] x 90 degrees counter-clockwise, in place
+    90 / 270 degree rotations change the shape of non-square images: they are only possible
+    when all images get one, and then a new array is returned
+    :param images: n X h X w X c array
+    :return: the rotated images (the input array unless the shape changes)
+    """
+    ks = np.asarray(ks) % 4
+    h, w = images.shape[1:3]
+    odd = ks % 2 == 1
+    if (h != w and odd.any()):
+        if (not odd.all()):
+            raise ValueError("90 / 270 degree rotations of non-square images change their shape, "
+                             "rotate all of them by an odd multiple of 90 degrees or only use 0 / 180")
+        rotated = np.empty((images.shape[0], w, h, *images.shape[3:]), dtype = images.dtype)
+        for k in (1, 3):
+            for idx in _chunks(np.flatnonzero(ks == k), chunk_size):
+                rotated[idx] = np.rot90(images[idx], k, axes = (1, 2))
+        return rotated
+
+    for k in (1, 2, 3):
+        for idx in _chunks(np.flatnonzero(ks == k), chunk_size):
+            # the fancy index is a copy of the chunk, the rotated view of it is written back
+            images[idx] = np.rot90(images[idx], k, axes = (1, 2))
+    return images
+
+
+def dihedral_images(images, codes, chunk_size = 32):
+    """
+    Apply one of the 8 dihedral transforms to each image, in place (like
+    utils.img_utils.random_dihedral): bit 1 of codes[i] flips the rows, bit 2 the columns and
+    bit 4 transposes (square images only)
+    """
+    codes = np.asarray(codes) % 8
+    if (images.shape[1] != images.shape[2] and (codes & 4).any()):
+        raise ValueError("Transposing non-square images changes their shape")
+    for code in range(1, 8):
+        for idx in _chunks(np.flatnonzero(codes == code), chunk_size):
+            x = images[idx]
+            if (code & 1):
+                x = x[:, ::-1]
+            if (code & 2):
+                x = x[:, :, ::-1]
+            if (code & 4):
+                x = x.transpose(0, 2, 1, 3)
+            images[idx] = x
+    return images
+
+
+def rotation_coordinates(h, w, angle):
+    """
+    Source pixel of every output pixel for a counter-clockwise rotation by angle (radians)
+    about the image centre, the transform of tf.contrib.image.rotate
+    :return: rows, cols float arrays of shape h X w
+    """
+    cos, sin = np.cos(angle), np.sin(angle)
+    x_offset = ((w - 1) - (cos * (w - 1) - sin * (h - 1))) / 2.0
+    y_offset = ((h - 1) - (sin * (w - 1) + cos * (h - 1))) / 2.0
+    y, x = np.mgrid[0:h, 0:w].astype(np.float64)
+    return sin * x + cos * y + y_offset, cos * x - sin * y + x_offset
+
+
+def rotate_images_by(images, angles, interpolation = 'NEAREST', chunk_size = 16):
+    """
+    Rotate each image by angles[i] degrees counter-clockwise about its centre, in place,
+    pixels from outside of the image are 0 (like tf.contrib.image.rotate)
+    Multiples of 90 degrees of square images are exact rot90 rotations
+    :param interpolation: 'NEAREST' or 'BILINEAR'
+    """
+    angles = np.asarray(angles, dtype = np.float64) % 360
+    h, w = images.shape[1:3]
+    right = angles % 90 == 0
+    if (h == w):
+        for k in (1, 2, 3):
+            for idx in _chunks(np.flatnonzero(right & (angles == 90 * k)), chunk_size):
+                images[idx] = np.rot90(images[idx], k, axes = (1, 2))
+
+    for angle in np.unique(angles[~right] if h == w else angles):
+        if (angle == 0):
+            continue
+        # the sampling grid is computed once per angle and shared by the whole group
+        rows, cols = rotation_coordinates(h, w, np.deg2rad(angle))
+        for idx in _chunks(np.flatnonzero(angles == angle), chunk_size):
+            images[idx] = _sample(images[idx], rows, cols, interpolation).astype(images.dtype)
+    return images
+
+
+def _sample(images, rows, cols, interpolation):
+    if (interpolation == 'BILINEAR'):
+        r0, c0 = np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+        fr, fc = (rows - r0)[..., np.newaxis], (cols - c0)[..., np.newaxis]
+        gather = lambda r, c: _gather(images, r, c).astype(np.float32)
+        return (gather(r0, c0) * (1 - fr) * (1 - fc) + gather(r0, c0 + 1) * (1 - fr) * fc +
+                gather(r0 + 1, c0) * fr * (1 - fc) + gather(r0 + 1, c0 + 1) * fr * fc).round()
+    return _gather(images, np.round(rows).astype(np.int64), np.round(cols).astype(np.int64))
+
+
+def _gather(images, rows, cols):
+    h, w = images.shape[1:3]
+    inside = (rows >= 0) & (rows < h) & (cols >= 0) & (cols < w)
+    out = images[:, np.clip(rows, 0, h - 1), np.clip(cols, 0, w - 1)]
+    out[:, ~inside] = 0
+    return out
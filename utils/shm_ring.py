@@ -0,0 +1,53 @@
+import numpy as np
+
+from multiprocessing import shared_memory
+
+
+# -------------------------------------------------------------------------------------
+
+# Ring of fixed-size slots in shared memory, written by producer processes and read by the
+# training process without a copy (utils.bag_producer). Each field (images, labels, ...) is
+# one shared block of n_slots X field shape, a slot is the i-th entry of every field.
+# Which slots are free or filled is passed around as slot indices on queues by the user of
+# the ring, the ring itself does no synchronization.
+# The blocks are created by the parent and inherited by forked producers (no attach by
+# name, so the resource tracker sees a single owner that unlinks them in close()).
+# This module must not import tensorflow (like utils.numpy_ops)
+
+
+class SlotRing:
+
+    def __init__(self, n_slots, fields):
+        """
+        :param fields: dict name --> (slot shape, dtype)
+        """
+        self.n_slots = n_slots
+        self.fields = {name: (tuple(shape), np.dtype(dtype)) for name, (shape, dtype) in fields.items()}
+        self.blocks = {}
+        self.arrays = {}
+        for name, (shape, dtype) in self.fields.items():
+            nbytes = max(1, n_slots * int(np.prod(shape)) * dtype.itemsize)
+            self.blocks[name] = shared_memory.SharedMemory(create = True, size = nbytes)
+            self.arrays[name] = np.ndarray((n_slots, *shape), dtype = dtype, buffer = self.blocks[name].buf)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.arrays.values())
+
+    def slot(self, i):
+        """
+        :return: dict name --> view of slot i (writable, in shared memory)
+        """
+        return {name: array[i] for name, array in self.arrays.items()}
+
+    def close(self, unlink = True):
+        self.arrays = {}
+        for block in self.blocks.values():
+            try:
+                block.close()
+            except BufferError:
+                # views of a slot still referenced, the mapping goes with the process
+                pass
+            if (unlink):
+                block.unlink()
+        self.blocks = {}
@@ -0,0 +1,252 @@
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import os
+
+from utils.numpy_ops import OnlinePool, dense_numpy, softmax_numpy, hash_numpy
+from utils.tissue_mask import tissue_mask, window_fractions
+
+# tifffile is only needed for whole-slide images
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+
+# Streaming reader of tiled (pyramidal) TIFF whole-slide images
+# Tiles are read and decoded one at a time straight from their byte ranges in the file,
+# in raster order, with at most read_ahead tiles in flight on a thread pool, so memory
+# does not depend on the slide size. The tiles of the file are the instances of the bag
+# (edge tiles hold whatever padding the file stores past the border),
+# overlapping windows of another size can be cut from them with SlideTileReader.windows
+
+def read_ahead_map(fn, items, read_ahead = 16, num_workers = 4):
+    """
+    Like map(fn, items), computed on a thread pool with at most read_ahead results in flight
+    """
+    with ThreadPoolExecutor(max_workers = num_workers) as pool:
+        pending = deque()
+        for item in items:
+            if (len(pending) >= read_ahead):
+                yield pending.popleft().result()
+            pending.append(pool.submit(fn, *item))
+        while (len(pending) > 0):
+            yield pending.popleft().result()
+
+
+def batch_tiles(tiles, batch_size):
+    """
+    :param tiles: iterator over (row, col, tile)
+    :return: iterator over (positions, tiles) with positions n X 2
+    """
+    positions, batch = [], []
+    for row, col, tile in tiles:
+        positions.append((row, col))
+        batch.append(tile)
+        if (len(batch) == batch_size):
+            yield np.asarray(positions), np.stack(batch)
+            positions, batch = [], []
+    if (len(batch) > 0):
+        yield np.asarray(positions), np.stack(batch)
+
+
+def _require_tifffile():
+    if (tifffile is None):
+        raise ImportError("Reading whole-slide TIFF files requires the tifffile package")
+
+
+class SlideTileReader:
+    """
+
+    Iterate over the tiles of one pyramid level of a tiled TIFF file
+    Yields (row, col, tile) with tile a tile_h X tile_w X 3 uint8 array
+
+    """
+
+    def __init__(self, path, level = 0, read_ahead = 16, num_workers = 4, tissue_threshold = None):
+        """
+        :param level: pyramid level, 0 is the full resolution
+        :param read_ahead: maximum number of tiles read and decoded ahead of the consumer
+        :param tissue_threshold: skip the tiles whose tissue fraction (from a mask of the
+                                 coarsest level) is below this value, None to read all tiles
+        """
+        _require_tifffile()
+        self.path = path
+        self.tiff = tifffile.TiffFile(path)
+        self.levels = self.tiff.series[0].levels
+        self.page = self.levels[level].keyframe
+        if (not self.page.is_tiled):
+            raise ValueError(f"{path} level {level} is not tiled")
+
+        self.height, self.width = self.page.shape[:2]
+        self.tile_h, self.tile_w = self.page.tilelength, self.page.tilewidth
+        self.rows = -(-self.height // self.tile_h)
+        self.cols = -(-self.width // self.tile_w)
+        self.read_ahead = read_ahead
+        self.num_workers = num_workers
+        self.fd = os.open(path, os.O_RDONLY)
+
+        self.keep = None
+        if (tissue_threshold is not None):
+            self.keep = self.tissue_tiles(tissue_threshold)
+
+    def __len__(self):
+        return int(self.keep.sum()) if self.keep is not None else self.rows * self.cols
+
+    def tissue_tiles(self, threshold):
+        # the coarsest level is small enough to be decoded at once
+        thumbnail = self.levels[-1].asarray()
+        self.mask_downsample = self.height / thumbnail.shape[0]
+        self.mask = tissue_mask(thumbnail[..., :3], downsample = 1)
+        self.threshold = threshold
+        rows, cols = np.meshgrid(np.arange(self.rows) * self.tile_h / self.mask_downsample,
+                                 np.arange(self.cols) * self.tile_w / self.mask_downsample, indexing='ij')
+        size = (self.tile_h / self.mask_downsample, self.tile_w / self.mask_downsample)
+        return window_fractions(self.mask, rows, cols, size, 1) >= threshold
+
+    def read_tile(self, row, col):
+        index = row * self.cols + col
+        # pread does not move a shared file position, so tiles can be read from several threads
+        data = os.pread(self.fd, int(self.page.databytecounts[index]), int(self.page.dataoffsets[index]))
+        segment, _, _ = self.page.decode(data, index, jpegtables = self.page.jpegtables)
+        return row, col, segment.reshape(self.tile_h, self.tile_w, -1)[..., :3]
+
+    def positions(self):
+        for row in range(self.rows):
+            for col in range(self.cols):
+                if (self.keep is None or self.keep[row, col]):
+                    yield row, col
+
+    def __iter__(self):
+        return read_ahead_map(self.read_tile, self.positions(), self.read_ahead, self.num_workers)
+
+    def batches(self, batch_size):
+        """
+        :return: iterator over (positions, tiles) with positions n X 2 (row, col) of the tiles
+        """
+        return batch_tiles(self, batch_size)
+
+    def windows(self, size, stride):
+        """
+        Sliding windows of size x size pixels every stride pixels, in raster order, cut
+        from the decoded tiles (zero padded past the slide border). Only the rows of tiles
+        under the current row of windows are kept in memory
+        Yields (y, x, window) with (y, x) the top-left corner in pixels
+        """
+        n_rows = -(-self.height // stride)
+        n_cols = -(-self.width // stride)
+        tiles = {}
+
+        for i in range(n_rows):
+            y = i * stride
+            first, last = y // self.tile_h, min((y + size - 1) // self.tile_h, self.rows - 1)
+            for r in [r for r in tiles if r < first]:
+                del tiles[r]
+            for r in range(first, last + 1):
+                if (r not in tiles):
+                    row = read_ahead_map(self.read_tile, ((r, c) for c in range(self.cols)),
+                                         self.read_ahead, self.num_workers)
+                    tiles[r] = [tile for _, _, tile in row]
+
+            keep = None
+            if (self.keep is not None):
+                xs = np.arange(n_cols) * stride
+                keep = window_fractions(self.mask, np.full(n_cols, y / self.mask_downsample),
+                                        xs / self.mask_downsample, size / self.mask_downsample, 1) >= self.threshold
+
+            for j in range(n_cols):
+                if (keep is not None and not keep[j]):
+                    continue
+                x = j * stride
+                window = np.zeros((size, size, 3), dtype=np.uint8)
+                for r in range(first, last + 1):
+                    for c in range(x // self.tile_w, min((x + size - 1) // self.tile_w, self.cols - 1) + 1):
+                        # intersection of the window and tile (r, c) in slide pixels
+                        y0, y1 = max(y, r * self.tile_h), min(y + size, (r + 1) * self.tile_h, self.height)
+                        x0, x1 = max(x, c * self.tile_w), min(x + size, (c + 1) * self.tile_w, self.width)
+                        window[y0 - y : y1 - y, x0 - x : x1 - x] = tiles[r][c][y0 - r * self.tile_h : y1 - r * self.tile_h,
+                                                                               x0 - c * self.tile_w : x1 - c * self.tile_w]
+                yield y, x, window
+
+    def close(self):
+        os.close(self.fd)
+        self.tiff.close()
+
+
+def predict_slide(reader, embed, heads, pooling = 'average', batch_size = 64, on_batch = None):
+    """
+    Classify a whole slide as one bag: embeddings of the tiles are pooled online
+    (SI only models: the tile probabilities are averaged online)
+    :param embed: function uint8 tiles --> embeddings (e.g. a TF session or TFLite backbone)
+    :param heads: dict with the (weights, biases) of 'logits_mi' / 'logits_si' and optionally 'hash' / 'hash_mi'
+    :param on_batch: optional callback (positions, embeddings) for per tile outputs
+    :return: bag class probabilities and number of tiles, (None, 0) when no tile is kept
+             (e.g. every tile below the reader's tissue_threshold)
+    """
+    si_only = heads.get('logits_mi') is None
+    pool = OnlinePool('average' if si_only else pooling)
+
+    for positions, tiles in reader.batches(batch_size):
+        embeddings = embed(tiles)
+        if (si_only):
+            pool.update(softmax_numpy(dense_numpy(hash_numpy(embeddings, heads), *heads['logits_si'])))
+        else:
+            pool.update(embeddings)
+        if (on_batch is not None):
+            on_batch(positions, embeddings)
+
+    if (pool.count == 0):
+        # no tissue: there is no bag to classify
+        return None, 0
+    if (si_only):
+        return pool.result()[0], pool.count
+    return softmax_numpy(dense_numpy(hash_numpy(pool.result(), heads, pooled = True), *heads['logits_mi']))[0], pool.count
+
+
+# -------------------------------------------------------------------------------------
+
+# Synthetic pyramidal tiled TIFF for testing, written tile by tile (never held in memory):
+# tissue-like regions (pink / purple noise) on a white background, from a random low
+# resolution blob field with one value per level 0 tile; a tile of a coarser level holds the
+# downscaled level 0 tiles it covers, so every level has the same tissue layout
+
+def write_synthetic_slide(path, height, width, tile_size = 256, n_levels = 3, tissue_fraction = 0.4,
+                          compression = 'zlib', seed = 1):
+    _require_tifffile()
+    from PIL import Image
+
+    if (tile_size % 2 ** (n_levels - 1) != 0):
+        raise ValueError(f"tile_size {tile_size} is not divisible by the coarsest downsampling {2 ** (n_levels - 1)}")
+    rng = np.random.RandomState(seed)
+    rows, cols = -(-height // tile_size), -(-width // tile_size)
+    field = Image.fromarray(rng.rand(max(rows // 8, 2), max(cols // 8, 2)).astype(np.float32), mode='F')
+    field = np.asarray(field.resize((cols, rows), Image.BICUBIC))
+    tissue = field > np.quantile(field, 1 - tissue_fraction)
+
+    noise = [rng.randint(-12, 13, size=(tile_size, tile_size, 1)) for _ in range(8)]
+    colors = np.array([[233, 150, 200], [170, 100, 190], [240, 240, 240]])
+
+    def tiles(downsample):
+        block = tile_size // downsample
+        for r in range(0, -(-height // downsample), tile_size):
+            for c in range(0, -(-width // downsample), tile_size):
+                tile = np.empty((tile_size, tile_size, 3), dtype=np.uint8)
+                # the downsample X downsample level 0 tiles under this one, a block each
+                for i in range(downsample):
+                    for j in range(downsample):
+                        tr, tc = r * downsample // tile_size + i, c * downsample // tile_size + j
+                        is_tissue = tr < rows and tc < cols and tissue[tr, tc]
+                        color = colors[(tr + tc) % 2] if is_tissue else colors[2]
+                        tile[i * block : (i + 1) * block, j * block : (j + 1) * block] = np.clip(
+                            color + noise[(tr * 7 + tc) % 8][::downsample, ::downsample], 0, 255)
+                yield tile
+
+    with tifffile.TiffWriter(path, bigtiff = True) as tif:
+        for level in range(n_levels):
+            downsample = 2 ** level
+            shape = (-(-height // downsample), -(-width // downsample), 3)
+            options = {'subifds': n_levels - 1} if level == 0 else {'subfiletype': 1}
+            tif.write(tiles(downsample), shape = shape, dtype = 'uint8', tile = (tile_size, tile_size),
+                      compression = compression, compressionargs = {'level': 1} if compression == 'zlib' else None,
+                      photometric = 'rgb', **options)
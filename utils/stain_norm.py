@@ -0,0 +1,191 @@
+import numpy as np
+from PIL import Image
+
+from multiprocessing import Pool
+import json
+import time
+import os
+
+
+# -------------------------------------------------------------------------------------
+
+# Offline H&E stain normalization of the dataset (build_stain_normalized.py), the normalized
+# images are written as PNGs in the layout of the dataset directories (stain_normalized_dir/
+# <class directory>/<name>.png) and read by the loaders instead of the originals
+# (Config.stain_normalization). The stain parameters of each image are estimated on a
+# 1/downsample subsampling of its pixels, the normalization of the full resolution pixels runs
+# in float32 chunks of chunk_pixels, one image per worker process.
+#   'macenko'   stain matrix from the optical density plane of the two principal directions
+#               (Macenko et al. 2009), concentrations rescaled to a reference stain matrix
+#   'reinhard'  per channel mean / std matched in the l-alpha-beta colour space (Reinhard et
+#               al. 2001) to reference statistics
+# This module must not import tensorflow (like utils.numpy_ops)
+
+METADATA_FILE = 'metadata.json'
+
+IO = 240
+# reference stain matrix (H, E columns of optical density) and 99th percentile concentrations
+HE_REF = np.array([[0.5626, 0.2159], [0.7201, 0.8012], [0.4062, 0.5581]], dtype=np.float32)
+MAX_C_REF = np.array([1.9705, 1.0308], dtype=np.float32)
+
+RGB_TO_LMS = np.array([[0.3811, 0.5783, 0.0402], [0.1967, 0.7244, 0.0782], [0.0241, 0.1288, 0.8444]],
+                      dtype=np.float32)
+LMS_TO_RGB = np.linalg.inv(RGB_TO_LMS).astype(np.float32)
+LOG_LMS_TO_LAB = (np.diag([1 / np.sqrt(3), 1 / np.sqrt(6), 1 / np.sqrt(2)]) @
+                  np.array([[1, 1, 1], [1, 1, -2], [1, -1, 0]])).astype(np.float32)
+LAB_TO_LOG_LMS = np.linalg.inv(LOG_LMS_TO_LAB).astype(np.float32)
+
+
+def optical_density(pixels, io = IO):
+    return -np.log((pixels.astype(np.float32) + 1) / io)
+
+
+def macenko_params(pixels, alpha = 1, beta = 0.15, io = IO):
+    """
+    :param pixels: n X 3 uint8 (a subsampling of the image)
+    :return: stain matrix (3 X 2, H then E) and 99th percentile concentrations (2,)
+    """
+    od = optical_density(pixels, io)
+    od = od[(od > beta).all(axis=1)]
+    if (od.shape[0] < 10):
+        # background only
+        return HE_REF.copy(), MAX_C_REF.copy()
+    _, eigenvectors = np.linalg.eigh(np.cov(od.T))
+    plane = eigenvectors[:, 1:3]
+    projected = od @ plane
+    phi = np.arctan2(projected[:, 1], projected[:, 0])
+    low, high = np.percentile(phi, alpha), np.percentile(phi, 100 - alpha)
+    v_low = plane @ np.array([np.cos(low), np.sin(low)])
+    v_high = plane @ np.array([np.cos(high), np.sin(high)])
+    # haematoxylin first (larger red optical density), columns pointing to positive density
+    he = np.stack([v_low, v_high] if v_low[0] > v_high[0] else [v_high, v_low], axis=1)
+    he *= np.where(he.sum(axis=0) < 0, -1, 1)
+    concentrations = np.linalg.lstsq(he, od.T, rcond=None)[0]
+    return he.astype(np.float32), np.percentile(concentrations, 99, axis=1).astype(np.float32)
+
+
+def rgb_to_lab(pixels):
+    lms = np.maximum(pixels.astype(np.float32) @ RGB_TO_LMS.T, 1)
+    return np.log10(lms) @ LOG_LMS_TO_LAB.T
+
+
+def lab_to_rgb(lab):
+    return np.power(10, lab @ LAB_TO_LOG_LMS.T) @ LMS_TO_RGB.T
+
+
+def reinhard_params(pixels):
+    """
+    :param pixels: n X 3 uint8 (a subsampling of the image)
+    :return: l-alpha-beta mean and std (3,)
+    """
+    lab = rgb_to_lab(pixels)
+    return lab.mean(axis=0), np.maximum(lab.std(axis=0), 1e-6)
+
+
+def estimate(image, method, downsample = 8):
+    pixels = image[::downsample, ::downsample].reshape(-1, 3)
+    return macenko_params(pixels) if method == 'macenko' else reinhard_params(pixels)
+
+
+def normalize(image, method, params, target, chunk_pixels = 2**20, io = IO):
+    """
+    :param params: estimate() of the image
+    :param target: reference parameters, (stain matrix, concentrations) or (mean, std)
+    :return: normalized uint8 image
+    """
+    flat = image.reshape(-1, 3)
+    out = np.empty_like(flat)
+    if (method == 'macenko'):
+        he, max_c = params
+        # concentrations, rescaled to the reference, then back to optical density with the reference matrix
+        to_target = target[0] @ (np.diag(target[1] / max_c) @ np.linalg.pinv(he)).astype(np.float32)
+    else:
+        scale = (target[1] / params[1]).astype(np.float32)
+        shift = (target[0] - params[0] * scale).astype(np.float32)
+    for start in range(0, flat.shape[0], chunk_pixels):
+        chunk = flat[start : start + chunk_pixels]
+        if (method == 'macenko'):
+            # inverse of optical_density (the +1 of the pixels removed)
+            rgb = io * np.exp(-(optical_density(chunk, io) @ to_target.T)) - 1
+        else:
+            rgb = lab_to_rgb(rgb_to_lab(chunk) * scale + shift)
+        out[start : start + chunk_pixels] = np.clip(np.round(rgb), 0, 255)
+    return out.reshape(image.shape)
+
+
+def stain_normalized_path(image_path, out_dir):
+    # <out_dir>/<class directory>/<name>.png
+    return os.path.join(out_dir, os.path.basename(os.path.dirname(image_path)), os.path.basename(image_path))
+
+
+def stain_metadata(out_dir):
+    # method, estimate downsampling and reference target the images of out_dir were normalized with
+    with open(os.path.join(out_dir, METADATA_FILE)) as f:
+        return json.load(f)
+
+
+def stain_normalized_paths(image_paths, out_dir, method):
+    """
+    Paths of the normalized images of a dataset normalized with method, checked
+    """
+    metadata = stain_metadata(out_dir)
+    if (metadata['method'] != method):
+        raise ValueError(f"{out_dir} holds '{metadata['method']}' normalized images, not '{method}'")
+    paths = np.asarray([stain_normalized_path(p, out_dir) for p in image_paths])
+    missing = [p for p in paths if not os.path.exists(p)]
+    if (len(missing) > 0):
+        raise FileNotFoundError(f"{len(missing)} images are not stain normalized (e.g. {missing[0]}), "
+                                f"run build_stain_normalized.py")
+    return paths
+
+
+def _estimate_file(job):
+    path, method, downsample = job
+    return estimate(np.asarray(Image.open(path).convert('RGB')), method, downsample)
+
+
+def _normalize_file(job):
+    path, out_dir, method, target, downsample, chunk_pixels = job
+    image = np.asarray(Image.open(path).convert('RGB'), dtype=np.uint8)
+    start = time.perf_counter()
+    normalized = normalize(image, method, estimate(image, method, downsample), target, chunk_pixels)
+    seconds = time.perf_counter() - start
+    # fast PNG compression, the loaders decode these on every read
+    Image.fromarray(normalized).save(stain_normalized_path(path, out_dir), compress_level = 1)
+    return image.shape[0] * image.shape[1], seconds
+
+
+def dataset_target(image_paths, method, downsample = 8, num_workers = 1):
+    """
+    Reference parameters when no reference image is given: the reference stain matrix for
+    'macenko', the median statistics of the dataset for 'reinhard'
+    """
+    if (method == 'macenko'):
+        return HE_REF, MAX_C_REF
+    jobs = [(path, method, downsample) for path in image_paths]
+    with Pool(num_workers) as pool:
+        stats = pool.map(_estimate_file, jobs)
+    return np.median([s[0] for s in stats], axis=0), np.median([s[1] for s in stats], axis=0)
+
+
+def normalize_dataset(image_paths, out_dir, method, target, downsample = 8, chunk_pixels = 2**20, num_workers = 1):
+    """
+    :return: pixels, wall seconds and the summed normalization seconds of the workers
+    """
+    for d in set(os.path.dirname(stain_normalized_path(p, out_dir)) for p in image_paths):
+        if (not os.path.exists(d)):
+            os.makedirs(d)
+    jobs = [(path, out_dir, method, target, downsample, chunk_pixels) for path in image_paths]
+    start = time.perf_counter()
+    if (num_workers > 1):
+        with Pool(num_workers) as pool:
+            results = pool.map(_normalize_file, jobs)
+    else:
+        results = [_normalize_file(job) for job in jobs]
+    seconds = time.perf_counter() - start
+
+    with open(os.path.join(out_dir, METADATA_FILE), 'w') as f:
+        json.dump({'method': method, 'downsample': downsample, 'n_images': len(image_paths),
+                   'target': [np.asarray(t).tolist() for t in target]}, f, indent=2)
+    return {'pixels': int(sum(r[0] for r in results)), 'seconds': seconds,
+            'normalize_seconds': float(sum(r[1] for r in results))}
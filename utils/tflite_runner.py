@@ -0,0 +1,119 @@
+import numpy as np
+from PIL import Image
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import json
+import os
+
+from utils.numpy_ops import extract_patches_numpy, mi_pool_numpy, dense_numpy, softmax_numpy, hash_numpy
+
+# Use the standalone TFLite runtime when installed, so deployment containers do not need
+# the full tensorflow package, fall back to the interpreter shipped with tensorflow
+try:
+    from tflite_runtime.interpreter import Interpreter
+except ImportError:
+    from tensorflow.lite import Interpreter
+
+
+# Files written by export_tflite.py
+BACKBONE_FILE = 'backbone.tflite'
+HEAD_FILE = 'head.npz'
+METADATA_FILE = 'metadata.json'
+
+
+class TFLiteBagRunner:
+    """
+
+    Lightweight bag classifier around a TFLite backbone
+    Tiling of the image and MI pooling + logits heads are done in NumPy,
+    the backbone runs in TFLite interpreters, one per worker thread
+    (invoke releases the GIL, so images are processed in parallel)
+
+    """
+
+    def __init__(self, model_dir, num_workers = 1, threads_per_worker = 1, patch_batch = 0):
+        """
+        :param model_dir: directory written by export_tflite.py
+        :param num_workers: number of images processed concurrently (one interpreter each)
+        :param threads_per_worker: intra-op threads of each interpreter
+        :param patch_batch: patches per invoke, 0 to run the whole bag in one invoke
+        """
+        with open(os.path.join(model_dir, METADATA_FILE)) as f:
+            self.metadata = json.load(f)
+        head = np.load(os.path.join(model_dir, HEAD_FILE))
+        self.heads = {name: (head[name + '_weights'], head[name + '_biases'])
+                      for name in ['logits_mi', 'logits_si', 'hash', 'hash_mi'] if name + '_weights' in head}
+
+        self.model_path = os.path.join(model_dir, BACKBONE_FILE)
+        self.threads_per_worker = threads_per_worker
+        self.patch_batch = patch_batch
+        self.pool = ThreadPoolExecutor(max_workers = num_workers)
+        self.local = threading.local()
+
+    def _interpreter(self):
+        # interpreters are not thread safe, keep one per worker thread
+        if (not hasattr(self.local, 'interpreter')):
+            try:
+                interpreter = Interpreter(model_path = self.model_path, num_threads = self.threads_per_worker)
+            except TypeError:
+                # older tensorflow.lite interpreters have no num_threads argument
+                interpreter = Interpreter(model_path = self.model_path)
+            self.local.interpreter = interpreter
+            self.local.input_index = interpreter.get_input_details()[0]['index']
+            self.local.output_index = interpreter.get_output_details()[0]['index']
+            self.local.batch = None
+        return self.local
+
+    def embed(self, patches):
+        local = self._interpreter()
+        batch = self.patch_batch if self.patch_batch > 0 else patches.shape[0]
+        outputs = []
+        for start in range(0, patches.shape[0], batch):
+            chunk = patches[start : start + batch]
+            if (local.batch != chunk.shape[0]):
+                local.interpreter.resize_tensor_input(local.input_index, [chunk.shape[0], *chunk.shape[1:]])
+                local.interpreter.allocate_tensors()
+                local.batch = chunk.shape[0]
+            local.interpreter.set_tensor(local.input_index, chunk)
+            local.interpreter.invoke()
+            outputs.append(local.interpreter.get_tensor(local.output_index).copy())
+        return np.concatenate(outputs)
+
+    def hash(self, x, pooled = False):
+        # hash layer between the embeddings and the logits (Config.hash_bits > 0)
+        return hash_numpy(x, self.heads, pooled)
+
+    def tile(self, image):
+        p = self.metadata['patch_size']
+        patches = extract_patches_numpy(image, size=(p, p), overlap = self.metadata['patches_overlap'])
+        if (p != 227):
+            patches = np.stack([np.asarray(Image.fromarray(x).resize((227, 227), Image.BILINEAR)) for x in patches])
+        return patches.astype(np.float32)
+
+    def predict_image(self, image):
+        """
+        :param image: h X w X 3 uint8 array or path of an image
+        :return: bag class probabilities
+        """
+        if (isinstance(image, str)):
+            image = np.asarray(Image.open(image).convert('RGB'))
+        embeddings = self.embed(self.tile(image))
+
+        if ('logits_mi' in self.heads):
+            pooled = mi_pool_numpy(embeddings, np.zeros(embeddings.shape[0], dtype=np.int64),
+                                   self.metadata['pooling'])
+            return softmax_numpy(dense_numpy(self.hash(pooled, pooled = True), *self.heads['logits_mi']))[0]
+
+        # SI only models: average of the patch probabilities
+        return softmax_numpy(dense_numpy(self.hash(embeddings), *self.heads['logits_si'])).mean(axis=0)
+
+    def predict(self, images):
+        """
+        Classify several images (arrays or paths) concurrently
+        :return: n_images X num_classes probabilities
+        """
+        return np.stack(list(self.pool.map(self.predict_image, images)))
+
+    def close(self):
+        self.pool.shutdown()
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from PIL import Image
+
+from multiprocessing import Pool
+import json
+import os
+
+
+# -------------------------------------------------------------------------------------
+
+# Sharded TFRecord store of the dataset (TFRecordLoader), written once with
+# build_tfrecord_shards.py. Each record holds the raw uint8 pixels of one image (no PNG
+# inflate when read), its shape, label, bag index and source path. Images are dealt to the
+# shards round-robin. Layout of a split directory (train/ or val/):
+#   shard-00000-of-00016.tfrecord ...
+#   metadata.json     number of shards, records per shard, image shape
+
+SHARD_PATTERN = 'shard-{:05d}-of-{:05d}.tfrecord'
+METADATA_FILE = 'metadata.json'
+
+
+def _int64(values):
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=np.atleast_1d(values).tolist()))
+
+
+def _bytes(value):
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+
+
+def image_example(image, label, bag_index, path):
+    return tf.train.Example(features=tf.train.Features(feature={
+        'image': _bytes(np.ascontiguousarray(image, dtype=np.uint8).tobytes()),
+        'shape': _int64(image.shape),
+        'label': _int64(label),
+        'bag_index': _int64(bag_index),
+        'path': _bytes(str(path).encode())}))
+
+
+def write_shard(shard_path, paths, labels, bag_index):
+    shape = None
+    with tf.python_io.TFRecordWriter(shard_path) as writer:
+        for path, label, bi in zip(paths, labels, bag_index):
+            image = np.asarray(Image.open(path).convert('RGB'), dtype=np.uint8)
+            shape = image.shape
+            writer.write(image_example(image, label, bi, path).SerializeToString())
+    return shape
+
+
+def _write_shard(job):
+    return write_shard(*job)
+
+
+def write_shards(paths, labels, bag_index, shard_dir, n_shards = 16, num_workers = 1):
+    """
+    Write the images into n_shards TFRecord files of shard_dir, one worker process per shard
+    """
+    if (not os.path.exists(shard_dir)):
+        os.makedirs(shard_dir)
+    n_shards = max(1, min(n_shards, len(paths)))
+    jobs = [(os.path.join(shard_dir, SHARD_PATTERN.format(s, n_shards)),
+             paths[s::n_shards], labels[s::n_shards], bag_index[s::n_shards]) for s in range(n_shards)]
+    if (num_workers > 1):
+        with Pool(num_workers) as pool:
+            shapes = pool.map(_write_shard, jobs)
+    else:
+        shapes = [_write_shard(job) for job in jobs]
+
+    with open(os.path.join(shard_dir, METADATA_FILE), 'w') as f:
+        json.dump({'n_shards': n_shards, 'counts': [len(job[1]) for job in jobs],
+                   'shards': [os.path.basename(job[0]) for job in jobs],
+                   'image_shape': [int(d) for d in shapes[0]]}, f, indent=2)
+
+
+def read_manifest(manifest_path):
+    """
+    :param manifest_path: CSV with a path and a label column, and optionally bag_index
+    :return: paths, labels, bag_index like get_images_pathlist_labels
+    """
+    manifest = pd.read_csv(manifest_path)
+    bag_index = manifest['bag_index'].values if 'bag_index' in manifest else np.arange(len(manifest))
+    return manifest['path'].values.astype(str), manifest['label'].values, bag_index
+
+
+def read_metadata(shard_dir):
+    with open(os.path.join(shard_dir, METADATA_FILE)) as f:
+        return json.load(f)
+
+
+def worker_shards(shard_dir, worker_index = 0, n_workers = 1):
+    """
+    Shards read by one of n_workers workers (every n_workers-th shard, deterministic)
+    :return: shard paths and number of records
+    """
+    metadata = read_metadata(shard_dir)
+    if (metadata['n_shards'] < n_workers):
+        raise ValueError(f"{metadata['n_shards']} shards in {shard_dir} for {n_workers} workers, "
+                         f"write at least one shard per worker")
+    shards = metadata['shards'][worker_index::n_workers]
+    counts = metadata['counts'][worker_index::n_workers]
+    return [os.path.join(shard_dir, s) for s in shards], int(sum(counts))
+
+
+def interleaved_records(shard_paths, n_readers = 4, shuffle = False, seed = None):
+    """
+    Serialized records of the shards, n_readers shards read in parallel and interleaved
+    one record at a time (deterministic order unless shuffle, which reshuffles the shards
+    every epoch)
+    """
+    files = tf.data.Dataset.from_tensor_slices(np.asarray(shard_paths))
+    if (shuffle):
+        files = files.shuffle(len(shard_paths), seed = seed, reshuffle_each_iteration = True)
+    return files.apply(tf.contrib.data.parallel_interleave(
+        tf.data.TFRecordDataset, cycle_length = min(n_readers, len(shard_paths)), block_length = 1, sloppy = False))
+
+
+def parse_example(serialized):
+    features = tf.parse_single_example(serialized, {
+        'image': tf.FixedLenFeature([], tf.string),
+        'shape': tf.FixedLenFeature([3], tf.int64),
+        'label': tf.FixedLenFeature([], tf.int64),
+        'bag_index': tf.FixedLenFeature([], tf.int64)})
+    image = tf.reshape(tf.decode_raw(features['image'], tf.uint8), tf.cast(features['shape'], tf.int32))
+    return image, features['label'], features['bag_index']
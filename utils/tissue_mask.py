@@ -0,0 +1,143 @@
+import numpy as np
+from PIL import Image
+
+from utils.numpy_ops import patch_positions
+
+
+# Low resolution tissue masks of the H&E images and per-tile tissue fractions, written
+# once by build_tissue_index.py and used by DatasetFileLoader to skip background
+# This module must not import tensorflow (like utils.numpy_ops)
+#
+# A mask cell covers downsample x downsample pixels and is tissue when its mean HSV
+# saturation is above saturation_threshold: the slide background is white or light gray,
+# stained tissue is not. Window fractions are computed from an integral image of the mask,
+# cells outside of the image (SAME padding of the sequential tiles) count as background.
+
+def tissue_mask(image, downsample = 16, saturation_threshold = 0.07):
+    """
+    :param image: h X w X 3 uint8 array
+    :return: ceil(h / downsample) X ceil(w / downsample) boolean mask
+    """
+    h, w = image.shape[:2]
+    mh, mw = -(-h // downsample), -(-w // downsample)
+    small = Image.fromarray(image).resize((mw, mh), Image.BOX)
+    saturation = np.asarray(small.convert('HSV'))[..., 1] / 255.0
+    return saturation > saturation_threshold
+
+
+def window_fractions(mask, rows, cols, size, downsample):
+    """
+    Tissue fraction of windows of the full resolution image
+    :param rows, cols: top-left corners of the windows in image pixels (may be negative)
+    :param size: window size in pixels, or (height, width)
+    """
+    size_h, size_w = (size, size) if np.isscalar(size) else size
+    mh, mw = mask.shape
+    integral = np.pad(mask.astype(np.float64).cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+
+    rows, cols = np.asarray(rows), np.asarray(cols)
+    # mask cells covered by the window, the cells outside the image count as background
+    r0, r1 = np.floor(rows / downsample).astype(np.int64), np.ceil((rows + size_h) / downsample).astype(np.int64)
+    c0, c1 = np.floor(cols / downsample).astype(np.int64), np.ceil((cols + size_w) / downsample).astype(np.int64)
+    n_cells = (r1 - r0) * (c1 - c0)
+    r0, r1, c0, c1 = np.clip(r0, 0, mh), np.clip(r1, 0, mh), np.clip(c0, 0, mw), np.clip(c1, 0, mw)
+
+    tissue = integral[r1, c1] - integral[r0, c1] - integral[r1, c0] + integral[r0, c0]
+    return (tissue / n_cells).astype(np.float32)
+
+
+def crop_grid(mask, image_shape, size, downsample):
+    """
+    Tissue fraction of every crop whose top-left corner is on a mask cell corner and that
+    lies inside the image (the valid positions of tf.random_crop, subsampled by downsample)
+    :return: grid of (h - size) // downsample + 1 X (w - size) // downsample + 1 fractions
+    """
+    gh = (image_shape[0] - size) // downsample + 1
+    gw = (image_shape[1] - size) // downsample + 1
+    rows, cols = np.meshgrid(np.arange(gh) * downsample, np.arange(gw) * downsample, indexing='ij')
+    return window_fractions(mask, rows, cols, size, downsample)
+
+
+class TissueIndex:
+    """
+
+    Tissue masks and sequential tile fractions of a set of images of the same size,
+    stored in one .npz file and looked up by image path
+
+    """
+
+    def __init__(self, paths, masks, tile_fractions, params):
+        self.paths = np.asarray(paths)
+        self.masks = np.asarray(masks, dtype=bool)
+        self.tile_fractions = np.asarray(tile_fractions, dtype=np.float32)
+        self.params = params
+        self.lookup = {path: i for i, path in enumerate(self.paths)}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def image_index(self, image_path):
+        return self.lookup[image_path]
+
+    def save(self, path):
+        np.savez(path, paths = self.paths, masks = self.masks, tile_fractions = self.tile_fractions,
+                 **{'param_' + k: v for k, v in self.params.items()})
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        params = {k[len('param_'):]: data[k].item() for k in data.files if k.startswith('param_')}
+        return cls(data['paths'], data['masks'], data['tile_fractions'], params)
+
+    def check(self, patch_size, patches_overlap):
+        # the tile fractions are only valid for the tiling they were computed with
+        if (self.params['patch_size'] != patch_size or self.params['patches_overlap'] != patches_overlap):
+            raise ValueError("The tissue index was built with patch_size={} and patches_overlap={}, "
+                             "run build_tissue_index.py again".format(self.params['patch_size'],
+                                                                      self.params['patches_overlap']))
+
+    def keep_tiles(self, paths, threshold):
+        """
+        Sequential tiles with a tissue fraction >= threshold, the most tissue-rich tile of
+        an image is always kept so that no bag is empty
+        :return: len(paths) X n_tiles boolean array
+        """
+        fractions = self.tile_fractions[[self.image_index(p) for p in paths]]
+        keep = fractions >= threshold
+        keep[np.arange(len(paths)), fractions.argmax(axis=1)] = True
+        return keep
+
+    def crop_grids(self, paths, threshold, patch_size, n_times_90 = 0):
+        """
+        Valid random crop positions with a tissue fraction >= threshold (all positions of
+        an image without any), for images rotated by n_times_90 x 90 degrees
+        :return: len(paths) X gh X gw boolean array
+        """
+        downsample = self.params['downsample']
+        shape = (self.params['image_h'], self.params['image_w'])
+        if (n_times_90 % 2 == 1):
+            shape = shape[::-1]
+        grids = []
+        for p in paths:
+            mask = np.rot90(self.masks[self.image_index(p)], k = n_times_90)
+            valid = crop_grid(mask, shape, patch_size, downsample) >= threshold
+            grids.append(valid if valid.any() else np.ones_like(valid))
+        return np.stack(grids)
+
+
+def build_tissue_index(paths, patch_size, patches_overlap, downsample = 16, saturation_threshold = 0.07):
+    masks, tile_fractions = [], []
+    for path in paths:
+        image = np.asarray(Image.open(path).convert('RGB'))
+        if (len(masks) > 0 and image.shape != first_shape):
+            raise ValueError(f"All images must have the same size, {path} is {image.shape[:2]}")
+        first_shape = image.shape
+        mask = tissue_mask(image, downsample, saturation_threshold)
+        positions = patch_positions(image.shape, (patch_size, patch_size), patches_overlap)
+        masks.append(mask)
+        tile_fractions.append(window_fractions(mask, positions[:, 0], positions[:, 1], patch_size, downsample))
+
+    params = {'image_h': first_shape[0], 'image_w': first_shape[1],
+              'patch_size': patch_size, 'patches_overlap': patches_overlap,
+              'downsample': downsample, 'saturation_threshold': saturation_threshold}
+    return TissueIndex(paths, masks, tile_fractions, params)
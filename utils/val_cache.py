@@ -0,0 +1,122 @@
+import numpy as np
+
+import hashlib
+import json
+import os
+
+
+# -------------------------------------------------------------------------------------
+
+# Cache of the (deterministic) validation batches of DatasetFileLoader: the batches produced
+# in the first validation epoch are stored and replayed in the following ones, instead of
+# reading, decoding, tiling and resizing the validation images again every epoch.
+# The images are kept in memory up to a byte budget, past it they are spilled to a raw file
+# under cache_dir/<key> (read back memory mapped). The key hashes the parameters the batches
+# depend on, a change of any of them (patch size, overlap, resize target, ...) is a new cache.
+# Layout of a spilled cache:
+#   images.raw       all images of all batches, n_total X h X w X c
+#   batches.npz      per batch: image count, labels, mi labels and bag indices
+#   metadata.json    key parameters, image shape and dtype (written last, marks it complete)
+
+IMAGES_FILE = 'images.raw'
+BATCHES_FILE = 'batches.npz'
+METADATA_FILE = 'metadata.json'
+
+
+def cache_key(params):
+    """
+    :param params: JSON serializable dict of everything the cached batches depend on
+    """
+    return hashlib.sha1(json.dumps(params, sort_keys = True).encode()).hexdigest()[:16]
+
+
+class ValidationCache:
+    """
+
+    add() the validation batches once, close(), then iterate batches() every epoch
+    mode: 'memory', 'disk' or 'auto' (memory up to budget_mb, disk past it)
+
+    """
+
+    def __init__(self, params, cache_dir, mode = 'auto', budget_mb = 2048):
+        self.params = params
+        self.key = cache_key(params)
+        self.dir = os.path.join(cache_dir, self.key)
+        self.mode = mode
+        self.budget = budget_mb * 2**20 if mode == 'auto' else (0 if mode == 'disk' else np.inf)
+        self.reset()
+        if (mode != 'memory' and os.path.exists(os.path.join(self.dir, METADATA_FILE))):
+            # complete cache of a previous run with the same parameters
+            self.load()
+
+    def reset(self):
+        self.images = []
+        self.counts, self.labels, self.mi_labels, self.bag_index = [], [], [], []
+        self.nbytes = 0
+        self.file = None
+        self.on_disk = False
+        self.complete = False
+
+    def add(self, images, labels, mi_labels, bag_index):
+        images = np.ascontiguousarray(images)
+        self.counts.append(images.shape[0])
+        self.labels.append(labels)
+        self.mi_labels.append(mi_labels)
+        self.bag_index.append(bag_index)
+        self.nbytes += images.nbytes
+        self.shape, self.dtype = images.shape[1:], images.dtype
+        if (self.file is None and self.nbytes > self.budget):
+            self.spill()
+        if (self.file is not None):
+            self.file.write(images.tobytes())
+        else:
+            self.images.append(images)
+
+    def spill(self):
+        # over budget: the batches held so far and the following ones go to disk
+        if (not os.path.exists(self.dir)):
+            os.makedirs(self.dir)
+        self.file = open(os.path.join(self.dir, IMAGES_FILE), 'wb')
+        for images in self.images:
+            self.file.write(images.tobytes())
+        self.images = []
+
+    def close(self):
+        if (self.file is not None):
+            self.file.close()
+            self.file = None
+            np.savez(os.path.join(self.dir, BATCHES_FILE), counts = np.asarray(self.counts, dtype=np.int64),
+                     **self.ragged('labels', self.labels), **self.ragged('mi_labels', self.mi_labels),
+                     **self.ragged('bag_index', self.bag_index))
+            with open(os.path.join(self.dir, METADATA_FILE), 'w') as f:
+                json.dump({'params': self.params, 'shape': list(self.shape), 'dtype': self.dtype.name,
+                           'n_batches': len(self.counts), 'nbytes': int(self.nbytes)}, f, indent=2)
+            self.load()
+        self.complete = True
+
+    @staticmethod
+    def ragged(name, arrays):
+        return {name: np.concatenate(arrays), name + '_counts': np.asarray([len(a) for a in arrays], dtype=np.int64)}
+
+    @staticmethod
+    def split(batches, name):
+        return np.split(batches[name], np.cumsum(batches[name + '_counts'])[:-1])
+
+    def load(self):
+        with open(os.path.join(self.dir, METADATA_FILE)) as f:
+            metadata = json.load(f)
+        batches = np.load(os.path.join(self.dir, BATCHES_FILE))
+        self.counts = batches['counts'].tolist()
+        self.labels, self.mi_labels, self.bag_index = [self.split(batches, name) for name in
+                                                       ['labels', 'mi_labels', 'bag_index']]
+        self.shape, self.dtype = tuple(metadata['shape']), np.dtype(metadata['dtype'])
+        self.nbytes = metadata['nbytes']
+        images = np.memmap(os.path.join(self.dir, IMAGES_FILE), dtype = self.dtype, mode = 'r',
+                           shape = (sum(self.counts), *self.shape))
+        self.images = np.split(images, np.cumsum(self.counts)[:-1])
+        self.on_disk = True
+        self.complete = True
+
+    def batches(self):
+        for batch in zip(self.images, self.labels, self.mi_labels, self.bag_index):
+            yield batch